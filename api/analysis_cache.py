@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_BACKEND = os.getenv("ANALYSIS_CACHE_BACKEND", "memory").lower()
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "1024"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ANALYSIS_CACHE_REDIS_URL = os.getenv("ANALYSIS_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Opt-in lookup of near-duplicate captures by the face crop's perceptual hash.
+# A 64-bit dHash can collide between different people, so face keys are only
+# ever matched within one client session (X-Session-Id / `session_id`)
+ANALYSIS_CACHE_FACE_MATCH = os.getenv("ANALYSIS_CACHE_FACE_MATCH", "false").lower() == "true"
+
+
+class InProcessStore:
+    """LRU store with per-entry TTL and caps on entry count and total bytes."""
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+
+class RedisStore:
+    """Shared store so several workers share hits (eviction is left to Redis' maxmemory policy)."""
+
+    def __init__(self, url=ANALYSIS_CACHE_REDIS_URL, prefix="analysis:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, ttl, value)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+def create_store(backend=ANALYSIS_CACHE_BACKEND):
+    if backend == "redis":
+        try:
+            return RedisStore()
+        except Exception as e:
+            print(f"Could not connect to Redis for the analysis cache, using in-process store: {e}")
+    return InProcessStore()
+
+
+def face_perceptual_hash(face_img, hash_size=8):
+    """64-bit difference hash (dHash) of a face crop, robust to re-encoding and small changes."""
+    gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY) if face_img.ndim == 3 else face_img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class AnalysisCache:
+    """
+    Caches full /analyze responses, keyed on the SHA-256 of the uploaded image
+    bytes. With `face_match`, near-duplicate captures within one client
+    session are also matched on a perceptual hash of the face crop.
+    `variant` namespaces keys by options that change the result.
+    """
+
+    def __init__(self, store=None, ttl=ANALYSIS_CACHE_TTL, enabled=ANALYSIS_CACHE_ENABLED,
+                 face_match=ANALYSIS_CACHE_FACE_MATCH):
+        self.store = store if store is not None else create_store()
+        self.ttl = ttl
+        self.enabled = enabled
+        self.face_match = face_match
+        self._lock = threading.Lock()
+        self._counters = {"imageHits": 0, "faceHits": 0, "misses": 0, "bypassed": 0, "stored": 0, "errors": 0}
+
+    def image_key(self, image_bytes, variant=""):
+        return f"img:{variant}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    def face_key(self, face_img, variant="", session_id=None):
+        """Perceptual-hash key scoped to `session_id`, or None when face matching is off or there is no session."""
+        if not (self.enabled and self.face_match and session_id):
+            return None
+        session = hashlib.sha256(str(session_id).encode("utf-8")).hexdigest()[:32]
+        return f"face:{variant}:{session}:{face_perceptual_hash(face_img):016x}"
+
+    def get(self, key, kind="image"):
+        if not self.enabled:
+            return None
+        try:
+            value = self.store.get(key)
+        except Exception as e:
+            print(f"Analysis cache get error: {e}")
+            self._count("errors")
+            return None
+        if value is None:
+            return None
+        self._count("imageHits" if kind == "image" else "faceHits")
+        return json.loads(value)
+
+    def set(self, keys, response_data):
+        if not self.enabled:
+            return
+        value = json.dumps(response_data)
+        for key in keys:
+            try:
+                self.store.set(key, value, self.ttl)
+            except Exception as e:
+                print(f"Analysis cache set error: {e}")
+                self._count("errors")
+                return
+        self._count("stored")
+
+    def record_miss(self):
+        self._count("misses")
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+        hits = counters["imageHits"] + counters["faceHits"]
+        lookups = hits + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "faceMatch": self.face_match,
+            **counters,
+            "hitRate": hits / lookups if lookups else 0.0,
+            "store": self.store.stats(),
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
@@ -0,0 +1,316 @@
+"""
+Async (ASGI) serving mode.
+
+The I/O-bound endpoints (/chat, /chat/stream, /find-dermatologists,
+/nearby-stores, /nearby-products, /product-recommendations) run as asyncio
+handlers on non-blocking upstream clients with bounded concurrency per
+upstream, so a request waiting on Groq or Places holds no thread. Every
+other route is served by the Flask app: /analyze and /analyze/batch on
+their own thread pool so model inference never competes with the event
+loop or other routes, the rest on a shared pool. Response bodies are built by the same functions as the Flask views.
+
+Usage (from the api/ directory):
+    uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import server
+from chat_stream import astream_chat_events, sse_event
+from http_client import get_async_client
+
+
+# Thread pools behind the routes still served by the Flask app
+ASGI_ANALYZE_WORKERS = int(os.getenv("ASGI_ANALYZE_WORKERS", "4"))
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "8"))
+# Blocking calls made from async handlers (SQLite product reads)
+ASGI_BLOCKING_WORKERS = int(os.getenv("ASGI_BLOCKING_WORKERS", "8"))
+
+FALLBACK_RESPONSE = "I'm sorry, I can't provide a personalized response at the moment. Please try again later."
+
+groq_client = get_async_client("groq")
+places_client = get_async_client("google_places")
+
+blocking_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ASGI_BLOCKING_WORKERS, thread_name_prefix="asgi-blocking")
+
+
+class JSONResponse(Response):
+    """JSON rendered exactly like Flask's jsonify, so both serving modes return the same bytes."""
+
+    media_type = "application/json"
+
+    def render(self, content):
+        return (json.dumps(content, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class RequestMetrics:
+    """In-flight request counts per backend (async handlers or a Flask thread pool)."""
+
+    def __init__(self):
+        self._in_flight = {}
+        self._max_in_flight = {}
+        self._requests = {}
+
+    def enter(self, backend):
+        in_flight = self._in_flight[backend] = self._in_flight.get(backend, 0) + 1
+        self._max_in_flight[backend] = max(self._max_in_flight.get(backend, 0), in_flight)
+        self._requests[backend] = self._requests.get(backend, 0) + 1
+
+    def exit(self, backend):
+        self._in_flight[backend] -= 1
+
+    def metrics(self):
+        return {backend: {"requests": count, "inFlight": self._in_flight[backend],
+                          "maxInFlight": self._max_in_flight[backend]}
+                for backend, count in self._requests.items()}
+
+
+request_metrics = RequestMetrics()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def search_nearby_places(lat, lng, radius, place_type, keyword):
+    """Async server.search_nearby_places: local places index, then the tile cache."""
+    radius = int(float(radius))
+    data = server.indexed_nearby_places(lat, lng, radius, place_type, keyword)
+    if data is not None:
+        return 200, data, "INDEX"
+    return await server.places_cache.nearby_search_async(places_client, lat, lng, radius, place_type, keyword)
+
+
+async def chat(request):
+    # Clients that accept an event stream get the streaming variant
+    if parse_accept_header(request.headers.get("accept"), MIMEAccept).best == 'text/event-stream':
+        return await chat_stream(request)
+    try:
+        data = await request.json()
+        user_message = data.get('message')
+
+        if not user_message:
+            return JSONResponse({'error': 'No message provided'}, 400)
+
+        if not server.GROQ_API_KEY:
+            return JSONResponse({"response": FALLBACK_RESPONSE})
+
+        cached_data, similarity, cache_status = server.chat_cache_lookup(data)
+        if cached_data is not None:
+            return JSONResponse(cached_data, headers={"X-Chat-Cache": "HIT",
+                                                      "X-Chat-Cache-Similarity": f"{similarity:.3f}"})
+
+        payload, is_product_request, context = server.build_chat_payload(data)
+
+        response = await groq_client.post(server.GROQ_CHAT_URL, headers=server.groq_headers(), json=payload)
+        if response.status_code != 200:
+            print(f"Error from GROQ API: {response.text}")
+            return JSONResponse({"error": "Failed to get response from AI", "details": response.text}, 500)
+
+        response_data = server.chat_reply(data, response.json(), is_product_request, context, cache_status)
+        return JSONResponse(response_data, headers={"X-Chat-Cache": cache_status})
+    except Exception as e:
+        print(f"Error in chat endpoint: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def chat_stream(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    if not data.get('message'):
+        return JSONResponse({'error': 'No message provided'}, 400)
+
+    if not server.GROQ_API_KEY:
+        events = [sse_event("token", {"content": FALLBACK_RESPONSE}), sse_event("done", {})]
+        return Response("".join(events), media_type='text/event-stream')
+
+    user_message = data['message']
+    skin_analysis = data.get('skinAnalysis')
+    stream_headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    on_complete = None
+    cached_data, similarity, cache_status = server.chat_cache_lookup(data)
+    if cached_data is not None:
+        return Response("".join(server.cached_chat_events(cached_data)), media_type='text/event-stream',
+                        headers={**stream_headers, 'X-Chat-Cache': 'HIT',
+                                 'X-Chat-Cache-Similarity': f"{similarity:.3f}"})
+    stream_headers['X-Chat-Cache'] = cache_status
+    if cache_status == "MISS":
+        on_complete = lambda text: server.chat_cache.store(skin_analysis, user_message, text)
+
+    try:
+        payload, is_product_request, context = server.build_chat_payload(data)
+    except Exception as e:
+        print(f"Error in chat endpoint: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+    suggestions = server.chat_suggestions(data, is_product_request)
+
+    return StreamingResponse(
+        astream_chat_events(groq_client, server.GROQ_CHAT_URL, server.groq_headers(), payload, suggestions,
+                            server.chat_stream_metrics,
+                            on_usage=lambda usage: server.chat_context.record_usage(context, usage),
+                            on_complete=on_complete),
+        media_type='text/event-stream',
+        headers=stream_headers
+    )
+
+
+async def find_dermatologists(request):
+    try:
+        lat = request.query_params.get('lat')
+        lng = request.query_params.get('lng')
+
+        if not lat or not lng:
+            return JSONResponse({'error': 'Latitude and longitude are required'}, 400)
+
+        status_code, data, cache_status = await search_nearby_places(lat, lng, 5000, "doctor", "dermatologist")
+        if status_code != 200:
+            return JSONResponse({'error': f'Error from Google Places API: {status_code}'}, 500)
+
+        return JSONResponse(data, headers={"X-Places-Cache": cache_status})
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def product_recommendations(request):
+    try:
+        params = request.query_params
+        country = params.get('country')
+        skin_type = params.get('skinType')
+        skin_issues = params.getlist('skinIssues')
+        gender = params.get('gender')
+        age_group = params.get('ageGroup')
+
+        print(f"Getting product recommendations for: {skin_type} skin, issues: {skin_issues}, gender: {gender}, age: {age_group}")
+
+        # The product store is SQLite, so the read runs off the event loop
+        products = await run_blocking(server.recommended_products, country, skin_type, skin_issues, gender, age_group)
+        return JSONResponse(products)
+    except Exception as e:
+        print(f"Error in product recommendations: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def nearby_stores(request):
+    try:
+        lat = request.query_params.get('lat')
+        lng = request.query_params.get('lng')
+        radius = request.query_params.get('radius', 5000)
+        product_type = request.query_params.get('product_type', 'skincare')
+
+        if not lat or not lng:
+            return JSONResponse({'error': 'Latitude and longitude are required'}, 400)
+
+        if not server.GOOGLE_MAPS_API_KEY:
+            return JSONResponse({'error': 'Google Maps API key is not configured'}, 500)
+
+        status_code, places_data, cache_status = await search_nearby_places(
+            lat, lng, radius, "store", f"{product_type} store beauty")
+        if status_code != 200:
+            return JSONResponse({'error': f'Error from Google Places API: {status_code}'}, 500)
+
+        return JSONResponse(server.format_nearby_stores(places_data), headers={"X-Places-Cache": cache_status})
+    except Exception as e:
+        print(f"Error finding nearby stores: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def nearby_products(request):
+    try:
+        params = request.query_params
+        lat = params.get('lat')
+        lng = params.get('lng')
+        radius = params.get('radius', 5000)
+        skin_type = params.get('skinType')
+        skin_issues = params.getlist('skinIssues')
+        gender = params.get('gender')
+        age_group = params.get('ageGroup')
+        rank_by = params.get('rankBy')
+
+        if not lat or not lng:
+            return JSONResponse({'error': 'Latitude and longitude are required'}, 400)
+
+        if not server.GOOGLE_MAPS_API_KEY:
+            return JSONResponse({'error': 'Google Maps API key is not configured'}, 500)
+
+        # Store search and product lookup run concurrently
+        (status_code, places_data, cache_status), product_recommendations = await asyncio.gather(
+            search_nearby_places(lat, lng, radius, "store", "beauty skincare cosmetics"),
+            run_blocking(server.catalog_products, skin_type, skin_issues, gender, age_group, max_products=15))
+        if status_code != 200:
+            return JSONResponse({'error': f'Error from Google Places API: {status_code}'}, 500)
+
+        body = server.nearby_products_result(places_data, product_recommendations, lat, lng, rank_by)
+        return JSONResponse(body, headers={"X-Places-Cache": cache_status})
+    except Exception as e:
+        print(f"Error finding nearby products: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def metrics(request):
+    body = await run_blocking(server.runtime_metrics)
+    return JSONResponse({**body, "asgi": request_metrics.metrics()})
+
+
+async def shutdown():
+    for client in (groq_client, places_client):
+        await client.aclose()
+    blocking_executor.shutdown(wait=False)
+
+
+async_app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/find-dermatologists', find_dermatologists, methods=['GET']),
+        Route('/product-recommendations', product_recommendations, methods=['GET']),
+        Route('/nearby-stores', nearby_stores, methods=['GET']),
+        Route('/nearby-products', nearby_products, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    on_shutdown=[shutdown],
+)
+# Same policy as flask_cors' CORS(app) defaults
+async_app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+ASYNC_PATHS = frozenset(route.path for route in async_app.routes)
+
+ANALYZE_PATHS = frozenset(("/analyze", "/analyze/batch"))
+analyze_app = WSGIMiddleware(server.app, workers=ASGI_ANALYZE_WORKERS)
+wsgi_app = WSGIMiddleware(server.app, workers=ASGI_WSGI_WORKERS)
+
+
+async def app(scope, receive, send):
+    # Lifespan events go to the Starlette app (client shutdown)
+    if scope["type"] != "http":
+        await async_app(scope, receive, send)
+        return
+
+    path = scope["path"]
+    if path in ASYNC_PATHS:
+        backend, target = "async", async_app
+    elif path in ANALYZE_PATHS:
+        backend, target = "analyze", analyze_app
+    else:
+        backend, target = "wsgi", wsgi_app
+
+    request_metrics.enter(backend)
+    try:
+        await target(scope, receive, send)
+    finally:
+        request_metrics.exit(backend)
@@ -0,0 +1,153 @@
+"""
+Rendering throughput of email bodies: the original send_email body (f-string
+literals grown with `body +=`, recommendation blocks picked by if/elif)
+against the precompiled email_templates renderer, and a digest run for
+thousands of users: render HTML + plaintext, build the MIME messages and,
+with --enqueue, store them in a scratch EmailQueue in one transaction.
+
+Usage (from the api/ directory):
+    python benchmarks/bench_email_render.py --users 5000
+    python benchmarks/bench_email_render.py --users 20000 --enqueue
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_queue import EmailQueue, build_message  # noqa: E402
+from email_templates import DIGEST_SUBJECT, render_digest_email, render_results_email  # noqa: E402
+from product_catalog import get_catalog  # noqa: E402
+
+SKIN_TYPES = ["Dry", "Oily", "Normal"]
+SKIN_ISSUES = ["Acne", "Redness", "Bags"]
+
+
+def legacy_render(results):
+    skin_type = results['skinType']['type']
+    skin_type_confidence = results['skinType']['confidence']
+    skin_issues = results['skinIssues']
+    body = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6;">
+            <h2 style="color: #3b82f6;">Your SkinPredict Analysis Results</h2>
+            <p>Thank you for using SkinPredict! Here are your skin analysis results:</p>
+            <div style="background-color: #f0f9ff; padding: 15px; border-radius: 5px; margin: 20px 0;">
+                <h3 style="margin-top: 0; color: #1e40af;">Skin Type Analysis</h3>
+                <p><strong>Skin Type:</strong> {skin_type} ({skin_type_confidence:.2f}% confidence)</p>
+                <h3 style="color: #1e40af;">Detected Skin Issues:</h3>
+                {'<ul>' if skin_issues else '<p>No significant skin issues detected.</p>'}
+        """
+    if skin_issues:
+        for issue in skin_issues:
+            body += f"<li><strong>{issue['name']}:</strong> {issue['confidence']:.2f}% confidence</li>"
+        body += "</ul>"
+    body += """
+                <h3 style="color: #1e40af;">Recommendations:</h3>
+        """
+    if skin_type.lower() == "dry":
+        body += """
+                <ul>
+                    <li>Use a gentle, hydrating cleanser</li>
+                    <li>Apply moisturizer while skin is still damp</li>
+                    <li>Look for products with hyaluronic acid, glycerin, ceramides</li>
+                    <li>Avoid hot water and harsh soaps</li>
+                    <li>Consider using a humidifier, especially during winter</li>
+                </ul>
+            """
+    elif skin_type.lower() == "oily":
+        body += """
+                <ul>
+                    <li>Use a foaming or gel cleanser</li>
+                    <li>Choose oil-free, non-comedogenic products</li>
+                    <li>Consider products with salicylic acid, niacinamide, or clay</li>
+                    <li>Use a lightweight moisturizer (don't skip this step!)</li>
+                    <li>Blotting papers can help during the day</li>
+                </ul>
+            """
+    else:
+        body += """
+                <ul>
+                    <li>Use a gentle cleanser</li>
+                    <li>Regular exfoliation (1-2 times per week)</li>
+                    <li>Apply moisturizer daily</li>
+                    <li>Don't forget sunscreen with SPF 30 or higher</li>
+                    <li>Stay hydrated and maintain a balanced diet</li>
+                </ul>
+            """
+    body += """
+            </div>
+            <p style="font-style: italic; color: #64748b;">This analysis is for informational purposes only and should not replace professional medical advice. If you have skin concerns, please consult with a dermatologist.</p>
+            <p>Thank you for using SkinPredict!</p>
+        </body>
+        </html>
+        """
+    return body
+
+
+def sample_users(count, seed=0):
+    rng = random.Random(seed)
+    catalog = get_catalog()
+    users = []
+    for i in range(count):
+        skin_type = rng.choice(SKIN_TYPES)
+        issues = rng.sample(SKIN_ISSUES, rng.randint(0, 2))
+        users.append({
+            "email": f"user{i}@example.com",
+            "name": f"User {i}",
+            "analyzedOn": f"2026-10-{rng.randint(1, 28):02d}",
+            "results": {
+                "skinType": {"type": skin_type, "confidence": rng.uniform(50, 99)},
+                "skinIssues": [{"name": issue, "confidence": rng.uniform(50, 99)} for issue in issues],
+            },
+            "products": catalog.find(skin_type, issues, "All", 5),
+        })
+    return users
+
+
+def timed(fn, items):
+    started = time.perf_counter()
+    outputs = [fn(item) for item in items]
+    return time.perf_counter() - started, outputs
+
+
+def report(name, seconds, count, total_bytes=None):
+    size = f"{total_bytes / count / 1024:>8.1f}" if total_bytes is not None else f"{'-':>8}"
+    print(f"{name:<34} {count:>7} {seconds * 1000:>9.1f} {count / seconds:>10.0f} {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--enqueue", action="store_true", help="also store the digests in a scratch EmailQueue")
+    args = parser.parse_args()
+
+    users = sample_users(args.users)
+    results = [user["results"] for user in users]
+    print(f"{'stage':<34} {'emails':>7} {'ms':>9} {'emails/s':>10} {'avg KB':>8}")
+
+    seconds, bodies = timed(legacy_render, results)
+    report("results email, legacy (HTML)", seconds, len(bodies), sum(len(b) for b in bodies))
+    seconds, bodies = timed(render_results_email, results)
+    report("results email, renderer (HTML+text)", seconds, len(bodies), sum(len(h) + len(t) for h, t in bodies))
+
+    seconds, digests = timed(render_digest_email, users)
+    report("digest, render (HTML+text)", seconds, len(digests), sum(len(h) + len(t) for h, t in digests))
+    started = time.perf_counter()
+    messages = [(user["email"], build_message(user["email"], DIGEST_SUBJECT, html, text))
+                for user, (html, text) in zip(users, digests)]
+    report("digest, build MIME messages", time.perf_counter() - started, len(messages))
+
+    if args.enqueue:
+        with tempfile.TemporaryDirectory() as directory:
+            queue = EmailQueue(os.path.join(directory, "email_queue.sqlite3"))
+            started = time.perf_counter()
+            queue.enqueue_many(messages)
+            report("digest, serialize + enqueue_many", time.perf_counter() - started, len(messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare face detectors on latency and detection rate over a local image set.
+
+Usage (from the api/ directory):
+    python benchmarks/bench_face_detectors.py path/to/images --detectors haar yunet
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_detection import DETECTORS, detect_faces  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_images(image_dir, limit=None):
+    paths = sorted(
+        os.path.join(root, f)
+        for root, _, files in os.walk(image_dir)
+        for f in files if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if limit:
+        paths = paths[:limit]
+    images = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append((path, image))
+    return images
+
+
+def bench_detector(detector, images, max_dim, min_size, repeats):
+    latencies = []
+    detected = 0
+    for _, image in images:
+        found = False
+        for _ in range(repeats):
+            start = time.perf_counter()
+            faces = detect_faces(image, detector=detector, max_dim=max_dim, min_size=min_size)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            found = len(faces) > 0
+        detected += int(found)
+    latencies = np.array(latencies)
+    return {
+        "images": len(images),
+        "detection_rate": detected / len(images) if images else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(latencies.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image_dir")
+    parser.add_argument("--detectors", nargs="+", default=list(DETECTORS))
+    parser.add_argument("--max-dim", type=int, nargs="+", default=[0, 640],
+                        help="Downscale sizes to compare (0 = full resolution)")
+    parser.add_argument("--min-size", type=int, default=80)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    images = load_images(args.image_dir, args.limit)
+    if not images:
+        print(f"No images found in {args.image_dir}")
+        return 1
+    print(f"Loaded {len(images)} images from {args.image_dir}")
+
+    print(f"{'detector':<10} {'max_dim':>8} {'rate':>7} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for name in args.detectors:
+        try:
+            detector = DETECTORS[name]()
+        except Exception as e:
+            print(f"{name:<10} unavailable: {e}")
+            continue
+        for max_dim in args.max_dim:
+            r = bench_detector(detector, images, max_dim, args.min_size, args.repeats)
+            print(f"{name:<10} {max_dim or 'full':>8} {r['detection_rate']:>7.1%} "
+                  f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['mean_ms']:>9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Memory and latency of the /analyze ingest stage for 1MP, 4MP and 12MP JPEGs.
+
+Compares the original pipeline (base64 decode -> full decode -> resize ->
+float64 normalize) with image_ingest (binary upload, reduced-scale decode,
+normalize into a preallocated float32 buffer). A centered square stands in
+for the detected face so the numbers do not depend on the detector.
+
+Usage (from the api/ directory):
+    python benchmarks/bench_image_ingest.py --repeats 10
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_ingest import decode_image, thread_buffer  # noqa: E402
+from model_backends import SKIN_INPUT_SIZE, skin_preprocess  # noqa: E402
+
+SIZES = {
+    "1MP": (1280, 800),
+    "4MP": (2560, 1600),
+    "12MP": (4000, 3000),
+}
+
+
+def synthetic_jpeg(width, height):
+    rng = np.random.default_rng(0)
+    # Smooth gradients plus noise compress like a photo rather than pure noise
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.stack([(x + y) / 2, x * np.ones_like(y), y * np.ones_like(x)], axis=-1)
+    image += rng.normal(0, 8, image.shape)
+    ok, encoded = cv2.imencode(".jpg", np.clip(image, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def center_face(image):
+    h, w = image.shape[:2]
+    side = min(h, w) // 2
+    y, x = (h - side) // 2, (w - side) // 2
+    return image[y:y + side, x:x + side]
+
+
+def original_pipeline(encoded_b64):
+    image_data = base64.b64decode(encoded_b64)
+    np_arr = np.frombuffer(image_data, np.uint8)
+    image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    face = center_face(image)
+    face_resized = cv2.resize(face, (224, 224))
+    return np.expand_dims(face_resized, axis=0) / 255.0
+
+
+def ingest_pipeline(jpeg_bytes):
+    image = decode_image(jpeg_bytes)
+    face = center_face(image)
+    return skin_preprocess(face, out=thread_buffer("skin_input", (SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3)))
+
+
+def measure(fn, arg, repeats):
+    fn(arg)  # warm-up (also allocates the thread-local buffer)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(arg)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(latencies)), peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'input':<6} {'jpeg KB':>8} {'pipeline':<9} {'p50 ms':>8} {'peak MB':>8}")
+    for label, (width, height) in SIZES.items():
+        jpeg_bytes = synthetic_jpeg(width, height)
+        encoded_b64 = base64.b64encode(jpeg_bytes).decode("ascii")
+        for name, fn, arg in (("original", original_pipeline, encoded_b64),
+                              ("ingest", ingest_pipeline, jpeg_bytes)):
+            latency, peak = measure(fn, arg, args.repeats)
+            print(f"{label:<6} {len(jpeg_bytes) // 1024:>8} {name:<9} {latency:>8.2f} {peak:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
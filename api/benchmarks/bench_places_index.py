@@ -0,0 +1,87 @@
+"""
+Radius and k-nearest query latency of the local places index against a
+brute-force haversine scan, on synthetic places around one city. Also checks
+both return the same places.
+
+Usage (from the api/ directory):
+    python benchmarks/bench_places_index.py --places 20000 --queries 1000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from places_cache import haversine_m  # noqa: E402
+from places_index import PlacesIndex  # noqa: E402
+
+NAMES = ["CVS Pharmacy", "Walgreens", "Sephora", "Ulta Beauty", "Lush", "Corner Beauty Supply"]
+
+
+def synthetic_places(count, lat, lng, spread, seed=0):
+    rng = random.Random(seed)
+    return [{
+        "place_id": f"place-{i}",
+        "name": rng.choice(NAMES),
+        "geometry": {"location": {"lat": lat + rng.uniform(-spread, spread), "lng": lng + rng.uniform(-spread, spread)}},
+    } for i in range(count)]
+
+
+def brute_radius(places, lat, lng, radius):
+    found = []
+    for place in places:
+        location = place["geometry"]["location"]
+        distance = haversine_m(lat, lng, location["lat"], location["lng"])
+        if distance <= radius:
+            found.append((distance, place))
+    found.sort(key=lambda item: item[0])
+    return found
+
+
+def timed(label, fn, points):
+    started = time.perf_counter()
+    for lat, lng in points:
+        fn(lat, lng)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {elapsed / len(points) * 1e6:10.1f} us/query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--places", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--radius", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    lat, lng, spread = 40.71, -74.0, 0.25
+    places = synthetic_places(args.places, lat, lng, spread)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = PlacesIndex(os.path.join(tmp, "places.sqlite3"))
+        started = time.perf_counter()
+        index.add_places(places, "store", "beauty")
+        print(f"Indexed {len(places)} places in {time.perf_counter() - started:.2f}s")
+
+        rng = random.Random(1)
+        points = [(lat + rng.uniform(-spread, spread), lng + rng.uniform(-spread, spread)) for _ in range(args.queries)]
+
+        for q_lat, q_lng in points[:50]:
+            expected = brute_radius(places, q_lat, q_lng, args.radius)
+            actual = index.radius(q_lat, q_lng, args.radius, "store", "beauty")
+            assert [p["place_id"] for _, p in expected] == [p["place_id"] for _, p in actual]
+            nearest = index.nearest(q_lat, q_lng, args.k, "store", "beauty")
+            expected_nearest = brute_radius(places, q_lat, q_lng, 50000)[:args.k]
+            assert [round(d, 6) for d, _ in nearest] == [round(d, 6) for d, _ in expected_nearest]
+        print("Index results match the brute-force scan")
+
+        timed("brute-force radius", lambda a, b: brute_radius(places, a, b, args.radius), points[:50])
+        timed("index radius", lambda a, b: index.radius(a, b, args.radius, "store", "beauty"), points)
+        timed(f"index {args.k}-nearest", lambda a, b: index.nearest(a, b, args.k, "store", "beauty"), points)
+        timed("index 3-nearest luxury", lambda a, b: index.nearest(a, b, 3, category="luxury"), points)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Latency of get_drugstore_products: the original implementation (rebuild the
+nested products literal on every call, list-comprehension gender filter,
+nested-loop issue match with list membership) against the indexed
+ProductCatalog. Also checks both return identical results for every skin
+type x issue subset x gender combination.
+
+Usage (from the api/ directory):
+    python benchmarks/bench_product_catalog.py --repeats 20000
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from product_catalog import PRODUCT_CATALOG_PATH, ProductCatalog  # noqa: E402
+
+LEGACY_SOURCE = '''
+def legacy_get_drugstore_products(skin_type, skin_issues, gender="All", age_group=None, max_products=3):
+    products_by_skin_type = {products_literal}
+
+    default_products = products_by_skin_type.get(skin_type.lower(), products_by_skin_type["normal"])
+
+    if gender and gender != "All":
+        default_products = [p for p in default_products if p.get("targetGender") in ["All", gender]]
+
+    if skin_issues and len(skin_issues) > 0:
+        issue_specific_products = []
+        for product in default_products:
+            if "forSkinIssues" in product:
+                for issue in skin_issues:
+                    if issue.capitalize() in product["forSkinIssues"]:
+                        issue_specific_products.append(product)
+                        break
+
+        if issue_specific_products:
+            combined_products = issue_specific_products + [p for p in default_products if p not in issue_specific_products]
+            return combined_products[:max_products]
+
+    return default_products[:max_products]
+'''
+
+
+def legacy_function():
+    """Compile the original function with the catalog embedded as a dict literal."""
+    with open(PRODUCT_CATALOG_PATH, encoding="utf-8") as f:
+        products = json.load(f)
+    namespace = {}
+    exec(LEGACY_SOURCE.replace("{products_literal}", repr(products)), namespace)
+    return namespace["legacy_get_drugstore_products"]
+
+
+def queries(catalog):
+    skin_types = list(catalog.by_skin_type) + ["unknown"]
+    issues = [issue.lower() for issue in catalog.by_skin_issue] + ["bags"]
+    issue_sets = [[]] + [[issue] for issue in issues] + [list(pair) for pair in itertools.combinations(issues, 2)]
+    for skin_type, skin_issues, gender in itertools.product(skin_types, issue_sets, ["All", "Male", "Female", None]):
+        for max_products in (3, 12):
+            yield skin_type.capitalize(), skin_issues, gender, max_products
+
+
+def check(legacy, catalog):
+    checked = 0
+    for skin_type, skin_issues, gender, max_products in queries(catalog):
+        expected = legacy(skin_type, skin_issues, gender, None, max_products)
+        actual = catalog.find(skin_type, skin_issues, gender, max_products)
+        # Compare key order too, so JSON output is byte-identical
+        if [list(p.items()) for p in expected] != [list(p.items()) for p in actual]:
+            raise SystemExit(f"Mismatch for {skin_type} {skin_issues} {gender} {max_products}:\n{expected}\n{actual}")
+        checked += 1
+    print(f"Identical results for {checked} queries")
+
+
+def bench(label, fn, cases, repeats):
+    started = time.perf_counter()
+    for i in range(repeats):
+        fn(*cases[i % len(cases)])
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {elapsed / repeats * 1e6:8.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=20000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    catalog = ProductCatalog()
+    print(f"Catalog load: {(time.perf_counter() - started) * 1000:.2f} ms ({len(catalog.records)} products)")
+    legacy = legacy_function()
+    check(legacy, catalog)
+
+    # Typical endpoint calls: a skin type with one or two issues
+    cases = [("Oily", ["acne"], "All", 3), ("Dry", ["wrinkles", "redness"], "Female", 12),
+             ("Combination", [], None, 12), ("Sensitive", ["redness"], "All", 3)]
+    bench("legacy", lambda s, i, g, m: legacy(s, i, g, None, m), cases, args.repeats)
+    bench("catalog", catalog.find, cases, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
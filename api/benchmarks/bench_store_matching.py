@@ -0,0 +1,123 @@
+"""
+Product-to-store matching for /nearby-products: the original per-product
+list comprehensions over every store against StoreMatcher (pre-normalized
+names, type buckets, one Aho-Corasick brand scan). Checks both produce the
+same entries, then times them for growing product x store counts.
+
+Usage (from the api/ directory):
+    python benchmarks/bench_store_matching.py --repeats 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from places_index import classify_store  # noqa: E402
+from store_matching import StoreMatcher  # noqa: E402
+
+API_KEY = "test-key"
+BRANDS = ["CeraVe", "La Roche-Posay", "The Ordinary", "Neutrogena", "Cetaphil", "Paula's Choice", "TruSkin",
+          "Kiehl's", "Drunk Elephant", "Olay", "Aveeno", "Bioderma", "Sephora Collection", ""]
+STORE_NAMES = ["CVS Pharmacy", "Walgreens", "Target", "Sephora", "Ulta Beauty", "Lush Cosmetics",
+               "The Body Shop", "Kiehl's Since 1851", "Neutrogena Outlet", "Rite Aid", "Beauty Supply Co"]
+
+
+def legacy_match(stores, product_recommendations):
+    nearby_products = []
+    for product in product_recommendations:
+        brand = product.get("brand", "").lower()
+        price_value = 0
+        try:
+            price_value = float(product.get("price", "0"))
+        except:  # noqa: E722
+            pass
+
+        if price_value < 10:
+            product["priceCategory"] = "Budget"
+        elif price_value < 25:
+            product["priceCategory"] = "Moderate"
+        else:
+            product["priceCategory"] = "Premium"
+
+        matching_stores = []
+        if price_value > 30 or brand in ["the ordinary", "kiehl's", "drunk elephant", "la roche-posay"]:
+            matching_stores = [s for s in stores if s.get("type") == "luxury"]
+        elif price_value < 15:
+            matching_stores = [s for s in stores if s.get("type") == "drugstore"]
+        brand_specific_stores = [s for s in stores if brand.lower() in s.get("name", "").lower()]
+        if brand_specific_stores:
+            matching_stores.extend(brand_specific_stores)
+
+        if not matching_stores:
+            matching_stores = stores[:3]
+
+        product_entry = {
+            **product,
+            "nearbyStores": [
+                {
+                    "name": store.get("name"),
+                    "address": store.get("address"),
+                    "location": store.get("location"),
+                    "rating": store.get("rating"),
+                    "place_id": store.get("place_id"),
+                    "open_now": store.get("open_now"),
+                    "map_url": f"https://www.google.com/maps/place/?q=place_id:{store.get('place_id')}"
+                } for store in matching_stores[:3]
+            ]
+        }
+        if matching_stores and matching_stores[0].get("photo_reference"):
+            product_entry["storePhotoUrl"] = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photoreference={matching_stores[0]['photo_reference']}&key={API_KEY}"
+        nearby_products.append(product_entry)
+    return nearby_products
+
+
+def synthetic(num_products, num_stores, seed=0):
+    rng = random.Random(seed)
+    products = [{"name": f"Product {i}", "brand": rng.choice(BRANDS), "price": rng.choice(["4.99", "12.50", "19.99", "34.00", "n/a"])}
+                for i in range(num_products)]
+    stores = []
+    for i in range(num_stores):
+        name = f"{rng.choice(STORE_NAMES)} #{i}"
+        stores.append({
+            "name": name,
+            "address": f"{i} Main St",
+            "location": {"lat": 40.7 + rng.uniform(-0.05, 0.05), "lng": -74.0 + rng.uniform(-0.05, 0.05)},
+            "rating": round(rng.uniform(2, 5), 1),
+            "place_id": f"place-{i}",
+            "type": classify_store(name),
+            "photo_reference": f"photo-{i}" if rng.random() < 0.7 else None,
+            "open_now": rng.random() < 0.5,
+        })
+    return products, stores
+
+
+def timed(fn, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    for num_products, num_stores in [(15, 20), (15, 60), (200, 60), (1000, 500)]:
+        products, stores = synthetic(num_products, num_stores)
+        expected = legacy_match(stores, [dict(p) for p in products])
+        actual = StoreMatcher(stores, API_KEY).match([dict(p) for p in products])
+        assert expected == actual, f"Mismatch for {num_products} products x {num_stores} stores"
+
+        repeats = max(1, args.repeats * 15 * 20 // (num_products * num_stores))
+        legacy_ms = timed(lambda: legacy_match(stores, [dict(p) for p in products]), repeats)
+        matcher_ms = timed(lambda: StoreMatcher(stores, API_KEY).match([dict(p) for p in products]), repeats)
+        print(f"{num_products:>5} products x {num_stores:>4} stores: legacy {legacy_ms:8.3f} ms  "
+              f"matcher {matcher_ms:8.3f} ms  ({legacy_ms / matcher_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Concurrent in-flight capacity of one server process: the Flask app as it
+runs today (threaded WSGI server) against the ASGI serving mode
+(asgi_server:app under uvicorn), both talking to local stub upstreams that
+answer Groq chat completions and Places nearby searches after a fixed delay.
+
+For each concurrency level the driver keeps that many requests open against
+/chat and /nearby-stores and reports throughput, latency and errors. The
+stub counts how many upstream calls were open at once, which is how many
+requests the server process was actually holding in flight.
+
+Usage (from the api/ directory):
+    python benchmarks/load_test_asgi.py --concurrency 50,200,800 --upstream-delay-ms 500
+    python benchmarks/load_test_asgi.py --servers asgi --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+import requests
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+FLASK_COMMAND = [sys.executable, "-c",
+                 "import sys, server; server.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"]
+ASGI_COMMAND = [sys.executable, "-m", "uvicorn", "asgi_server:app", "--host", "127.0.0.1",
+                "--log-level", "warning", "--backlog", "4096", "--port"]
+
+CHAT_BODY = {"message": "How can I improve my skin texture?", "conversation": [],
+             "skinAnalysis": {"skinType": {"type": "Oily", "confidence": 0.9}, "skinIssues": []}}
+
+
+def http_response(status, body):
+    payload = json.dumps(body).encode()
+    return (f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload
+
+
+async def read_message(reader):
+    """(start line, lower-cased headers, body) of one HTTP/1.x message with a Content-Length body."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    start_line, *lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    elif start_line.startswith("HTTP/"):
+        body = await reader.read()
+    else:
+        body = b""
+    return start_line, headers, body
+
+
+async def serve_stub(port, delay):
+    """
+    Minimal keep-alive HTTP stand-in for Groq and Google Places that answers
+    after `delay` seconds and tracks concurrent upstream calls. Raw asyncio,
+    so the stub costs little CPU next to the server under test.
+    """
+    state = {"inFlight": 0, "maxInFlight": 0, "requests": 0}
+    completion = {"choices": [{"message": {"role": "assistant", "content": "Use a gentle exfoliant."}}],
+                  "usage": {"prompt_tokens": 500, "completion_tokens": 6, "total_tokens": 506}}
+    store_names = ["Sephora", "CVS Pharmacy", "Ulta Beauty", "Target", "Lush"]
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                start_line, _, _ = await read_message(reader)
+                path, _, query = start_line.split(" ")[1].partition("?")
+                if path == "/stats":
+                    writer.write(http_response("200 OK", state))
+                    if parse_qs(query).get("reset"):
+                        state["maxInFlight"] = state["inFlight"]
+                        state["requests"] = 0
+                    continue
+
+                state["inFlight"] += 1
+                state["requests"] += 1
+                state["maxInFlight"] = max(state["maxInFlight"], state["inFlight"])
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    state["inFlight"] -= 1
+                if path == "/v1/chat/completions":
+                    body = completion
+                else:
+                    lat, lng = (float(v) for v in parse_qs(query)["location"][0].split(","))
+                    body = {"html_attributions": [], "status": "OK", "results": [
+                        {"name": name, "vicinity": f"{i} Main St", "place_id": f"stub-{i}", "rating": 4.2,
+                         "geometry": {"location": {"lat": lat + i * 1e-4, "lng": lng}},
+                         "opening_hours": {"open_now": True}} for i, name in enumerate(store_names)]}
+                writer.write(http_response("200 OK", body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+def wait_until_up(url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1.0)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_server(name, port, stub_url, data_dir, upstream_limit):
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "load-test", "GOOGLE_MAPS_API_KEY": "load-test",
+        "GROQ_CHAT_URL": f"{stub_url}/v1/chat/completions",
+        "PLACES_NEARBY_URL": f"{stub_url}/maps/api/place/nearbysearch/json",
+        # Every request goes upstream: no answer caches, no local places coverage
+        "PLACES_CACHE_ENABLED": "false", "CHAT_CACHE_ENABLED": "false",
+        "PLACES_INDEX_PATH": os.path.join(data_dir, f"{name}-places.sqlite3"),
+        "PRODUCT_STORE_PATH": os.path.join(data_dir, f"{name}-products.sqlite3"),
+        "PRODUCT_CRAWLER": "off", "MODEL_LOADING": "lazy",
+        # No retries or breaker trips, so errors show up as errors
+        "UPSTREAM_GOOGLE_PLACES_RETRIES": "0",
+        "UPSTREAM_GROQ_FAILURE_THRESHOLD": "1000000", "UPSTREAM_GOOGLE_PLACES_FAILURE_THRESHOLD": "1000000",
+    }
+    # Same connection pool (and, for the ASGI server, in-flight limit) per upstream in both modes
+    for upstream in ("GROQ", "GOOGLE_PLACES"):
+        env[f"UPSTREAM_{upstream}_POOL_SIZE"] = str(upstream_limit)
+        env[f"UPSTREAM_{upstream}_MAX_CONCURRENCY"] = str(upstream_limit)
+    command = (FLASK_COMMAND if name == "flask" else ASGI_COMMAND) + [str(port)]
+    process = subprocess.Popen(command, cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f"http://127.0.0.1:{port}/healthz")
+    return process
+
+
+def build_requests():
+    chat = json.dumps(CHAT_BODY).encode()
+    return [
+        b"GET /nearby-stores?lat=40.7128&lng=-74.006 HTTP/1.1\r\nHost: load-test\r\n\r\n",
+        (f"POST /chat HTTP/1.1\r\nHost: load-test\r\nContent-Type: application/json\r\n"
+         f"Content-Length: {len(chat)}\r\n\r\n").encode() + chat,
+    ]
+
+
+async def drive(host, port, concurrency, duration, timeout):
+    """
+    Keep `concurrency` requests open for `duration` seconds, alternating
+    /nearby-stores and /chat, over keep-alive connections (reconnecting when
+    the server closes them). Returns latencies and the error count.
+    """
+    requests = build_requests()
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(i):
+        nonlocal errors
+        connection = None
+        while time.perf_counter() < deadline:
+            request = requests[i % 2]
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                reader, writer = connection
+                writer.write(request)
+                status_line, headers, _ = await asyncio.wait_for(read_message(reader), timeout)
+                if status_line.startswith("HTTP/1.0") or headers.get("connection", "").lower() == "close":
+                    writer.close()
+                    connection = None
+                ok = status_line.split(" ")[1] == "200"
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                if connection is not None:
+                    connection[1].close()
+                connection = None
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+            i += 1
+        if connection is not None:
+            connection[1].close()
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors
+
+
+def run_level(port, stub_url, concurrency, duration, timeout):
+    requests.get(f"{stub_url}/stats", params={"reset": 1})
+    started = time.perf_counter()
+    latencies, errors = asyncio.run(drive("127.0.0.1", port, concurrency, duration, timeout))
+    elapsed = time.perf_counter() - started
+    stats = requests.get(f"{stub_url}/stats").json()
+    latencies = np.array(latencies) * 1000.0
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": float(np.percentile(latencies, 50)) if len(latencies) else float("nan"),
+        "p95": float(np.percentile(latencies, 95)) if len(latencies) else float("nan"),
+        "errors": errors,
+        "inFlight": stats["maxInFlight"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default="flask,asgi")
+    parser.add_argument("--concurrency", default="50,200,800")
+    parser.add_argument("--upstream-delay-ms", type=float, default=500)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--upstream-limit", type=int, default=1000,
+                        help="connection pool size and ASGI in-flight limit per upstream")
+    parser.add_argument("--port", type=int, default=8190)
+    parser.add_argument("--stub", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stub:
+        asyncio.run(serve_stub(args.port, args.upstream_delay_ms / 1000.0))
+        return
+
+    stub_url = f"http://127.0.0.1:{args.port}"
+    stub = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--stub", "--port", str(args.port),
+                             "--upstream-delay-ms", str(args.upstream_delay_ms)])
+    try:
+        wait_until_up(f"{stub_url}/stats")
+        print(f"Stub upstream delay {args.upstream_delay_ms:.0f} ms, {args.duration:.0f} s per level")
+        print(f"{'server':>6} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>9} {'errors':>7} {'in flight':>10}")
+        with tempfile.TemporaryDirectory() as data_dir:
+            for offset, name in enumerate(args.servers.split(","), start=1):
+                port = args.port + offset
+                process = start_server(name, port, stub_url, data_dir, args.upstream_limit)
+                try:
+                    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                        result = run_level(port, stub_url, concurrency, args.duration, args.timeout)
+                        print(f"{name:>6} {concurrency:>5} {result['throughput']:>8.1f} {result['p50']:>8.0f} "
+                              f"{result['p95']:>9.0f} {result['errors']:>7} {result['inFlight']:>10}")
+                finally:
+                    process.terminate()
+                    process.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
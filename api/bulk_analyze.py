@@ -0,0 +1,386 @@
+"""
+Offline re-scoring of archived scans, e.g. after multitask_skin_model.h5 is
+updated, without going through /analyze.
+
+Usage (from the api/ directory):
+    python bulk_analyze.py scans/ --output scans.jsonl
+    python bulk_analyze.py scans.tar.gz --output scans_parquet/ --format parquet
+    python bulk_analyze.py scans.tar.gz --output scans_parquet/ --format parquet --resume
+
+Images are read from a directory tree (in sorted order) or streamed from a
+tar archive. A thread pool reads, decodes and crops them (crop_face) a
+bounded number of images ahead of inference; the faces then go through the
+skin model and FairFace in batches of --batch-size. Results are written as
+they are produced, one row per image in source order: JSONL lines, or
+Parquet part files in the output directory. Every --checkpoint-every
+images the output is flushed and a checkpoint (OUTPUT.checkpoint.json)
+records how far into the source the run got; --resume continues from there.
+At most the prefetch window and one batch are held in memory, however
+large the archive.
+"""
+import argparse
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import tarfile
+import time
+
+import numpy as np
+
+from demographics import DemographicsEngine
+from face_detection import crop_face
+from image_ingest import decode_image
+from model_backends import (SKIN_INPUT_SIZE, SKIN_ISSUE_LABELS, load_fairface_model, load_skin_model,
+                            skin_preprocess, skin_results_from_predictions)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_CHECKPOINT_EVERY = 1000
+REPORT_SECONDS = 10.0
+
+# Output columns, the same for JSONL and Parquet
+ISSUE_COLUMNS = [f"{label.lower()}Confidence" for label in SKIN_ISSUE_LABELS]
+COLUMNS = ["path", "error", "skinType", "skinTypeConfidence", "skinIssues", *ISSUE_COLUMNS, "race", "gender", "age"]
+
+
+def directory_images(root):
+    """(path, load) for every image under `root`, walking each directory in sorted order."""
+    with os.scandir(root) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from directory_images(entry.path)
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path, functools.partial(_read_file, entry.path)
+
+
+def tar_images(path, skip=0):
+    """
+    (member name, load) for every image in a tar archive, read as a stream.
+    Members have to be read while the stream is on them, so `load` returns
+    bytes already read, except for the first `skip` images (load is None).
+    """
+    with tarfile.open(path, "r|*") as archive:
+        index = 0
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if index < skip:
+                yield member.name, None
+            else:
+                data = archive.extractfile(member).read()
+                yield member.name, lambda data=data: data
+            index += 1
+
+
+def source_images(source, skip=0):
+    if os.path.isdir(source):
+        root = os.path.abspath(source)
+        for path, load in directory_images(root):
+            yield os.path.relpath(path, root), load
+    else:
+        yield from tar_images(source, skip)
+
+
+def load_face(load):
+    """Read, decode and crop one image (on a prefetch thread); returns (face, error)."""
+    try:
+        image = decode_image(load())
+        if image is None:
+            return None, "Invalid image format"
+        face = crop_face(image)
+    except Exception as e:
+        return None, str(e)
+    if face is None:
+        return None, "No face detected in the image"
+    # A copy of the crop feeds both models, so the full decoded image is released here
+    return face.copy(), None
+
+
+def result_row(path, type_pred=None, prob_pred=None, demographics=None, error=None):
+    row = dict.fromkeys(COLUMNS)
+    row["path"] = path
+    row["error"] = error
+    if type_pred is not None:
+        results = skin_results_from_predictions(type_pred, prob_pred)
+        row["skinType"] = results["skinType"]["type"]
+        row["skinTypeConfidence"] = results["skinType"]["confidence"]
+        row["skinIssues"] = [issue["name"] for issue in results["skinIssues"]]
+        for column, probability in zip(ISSUE_COLUMNS, prob_pred):
+            row[column] = float(probability * 100)
+    if demographics:
+        row["race"] = demographics["race"]
+        row["gender"] = demographics["gender"]
+        row["age"] = demographics["age"]
+    return row
+
+
+class BatchAnalyzer:
+    """Skin model and FairFace over batches of face crops, reusing one input buffer."""
+
+    def __init__(self, skin_model, fairface_model, batch_size):
+        self.skin_model = skin_model
+        self.engine = DemographicsEngine(fairface_model, batch_size) if fairface_model is not None else None
+        self.batch = np.empty((batch_size, SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3), dtype=np.float32)
+
+    def analyze(self, items):
+        """One row per (path, face, error) item, in order."""
+        faces = [face for _, face, _ in items if face is not None]
+        type_pred = prob_pred = demographics = None
+        if faces:
+            batch = self.batch[:len(faces)]
+            for i, face in enumerate(faces):
+                skin_preprocess(face, out=batch[i])
+            type_pred, prob_pred = self.skin_model.predict(batch)
+            demographics = self.engine.predict_batch(faces) if self.engine is not None else None
+
+        rows = []
+        i = 0
+        for path, face, error in items:
+            if face is None:
+                rows.append(result_row(path, error=error))
+                continue
+            rows.append(result_row(path, type_pred[i], prob_pred[i], demographics[i] if demographics else None))
+            i += 1
+        return rows
+
+
+class JsonlWriter:
+    """Appends one JSON line per row; a resumed run first truncates to the checkpointed offset."""
+
+    def __init__(self, path, state=None):
+        offset = (state or {}).get("offset", 0)
+        self.file = open(path, "r+b" if offset else "wb")
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def write(self, rows):
+        self.file.write("".join(json.dumps(row) + "\n" for row in rows).encode("utf-8"))
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes Parquet part files (part-00000.parquet, ...) into a directory.
+    Each commit closes the current part, so committed parts are never
+    rewritten; a resumed run deletes the parts written after its checkpoint.
+    """
+
+    def __init__(self, directory, state=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.schema = pa.schema(
+            [("path", pa.string()), ("error", pa.string()), ("skinType", pa.string()),
+             ("skinTypeConfidence", pa.float64()), ("skinIssues", pa.list_(pa.string()))]
+            + [(column, pa.float64()) for column in ISSUE_COLUMNS]
+            + [("race", pa.string()), ("gender", pa.string()), ("age", pa.string())])
+        self.directory = directory
+        self.parts = (state or {}).get("parts", 0)
+        self.writer = None
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith("part-") and name.endswith(".parquet") and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(directory, name))
+
+    def write(self, rows):
+        if self.writer is None:
+            path = os.path.join(self.directory, f"part-{self.parts:05d}.parquet")
+            self.writer = self.pq.ParquetWriter(path, self.schema)
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def commit(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.parts += 1
+        return {"parts": self.parts}
+
+    def close(self):
+        self.commit()
+
+
+WRITERS = {"jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def model_signature(model):
+    """Identifies the model file a run was scored with, so a resume cannot mix models."""
+    if model is None:
+        return None
+    stat = os.stat(model.path)
+    return {"path": os.path.abspath(model.path), "backend": model.backend, "size": stat.st_size,
+            "mtime": stat.st_mtime}
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Progress:
+    def __init__(self, skipped):
+        self.skipped = skipped
+        self.images = 0
+        self.faces = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.reported = self.started
+
+    def add(self, rows):
+        self.images += len(rows)
+        self.errors += sum(row["error"] is not None for row in rows)
+        self.faces = self.images - self.errors
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.images / elapsed if elapsed > 0 else 0.0
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.reported < REPORT_SECONDS:
+            return
+        self.reported = now
+        print(f"{self.skipped + self.images} images ({self.images} this run, {self.rate():.1f} images/s), "
+              f"{self.faces} analyzed, {self.errors} without result")
+
+
+def run(args):
+    checkpoint_path = args.checkpoint or f"{args.output.rstrip(os.sep)}.checkpoint.json"
+    skin_model = load_skin_model(args.backend)
+    if skin_model is None:
+        print("Skin model could not be loaded")
+        return 1
+    fairface_model = None if args.no_demographics else load_fairface_model(args.backend)
+    models = {"skin": model_signature(skin_model), "fairface": model_signature(fairface_model)}
+
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else None
+    if checkpoint is not None:
+        if checkpoint["source"] != os.path.abspath(args.source) or checkpoint["format"] != args.format:
+            print(f"{checkpoint_path} is for {checkpoint['source']} ({checkpoint['format']}), not this run")
+            return 1
+        if checkpoint["models"] != models:
+            print(f"{checkpoint_path} was written with different models; start over without --resume")
+            return 1
+        print(f"Resuming after {checkpoint['processed']} images (last: {checkpoint['lastPath']})")
+    skip = checkpoint["processed"] if checkpoint else 0
+
+    analyzer = BatchAnalyzer(skin_model, fairface_model, args.batch_size)
+    writer = WRITERS[args.format](args.output, checkpoint["writer"] if checkpoint else None)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk-decode")
+    progress = Progress(skip)
+    processed = skip
+    last_path = checkpoint["lastPath"] if checkpoint else None
+    committed = processed
+
+    def write_batch(items):
+        nonlocal processed, last_path
+        rows = analyzer.analyze(items)
+        writer.write(rows)
+        processed += len(rows)
+        last_path = rows[-1]["path"]
+        progress.add(rows)
+        progress.report()
+        if processed - committed >= args.checkpoint_every:
+            commit()
+
+    def commit():
+        nonlocal committed
+        save_checkpoint(checkpoint_path, {
+            "source": os.path.abspath(args.source),
+            "format": args.format,
+            "output": os.path.abspath(args.output),
+            "models": models,
+            "processed": processed,
+            "lastPath": last_path,
+            "writer": writer.commit(),
+        })
+        committed = processed
+
+    # Decoding runs up to `prefetch` images ahead; results are consumed in source order
+    window = collections.deque()
+    batch = []
+    try:
+        for index, (path, load) in enumerate(source_images(args.source, skip)):
+            if index < skip:
+                if index == skip - 1 and path != last_path:
+                    print(f"Source changed since the checkpoint: image {index} is {path}, expected {last_path}")
+                    return 1
+                continue
+            window.append((path, executor.submit(load_face, load)))
+            if len(window) < args.prefetch:
+                continue
+            path, future = window.popleft()
+            batch.append((path, *future.result()))
+            if len(batch) == args.batch_size:
+                write_batch(batch)
+                batch = []
+        while window:
+            path, future = window.popleft()
+            batch.append((path, *future.result()))
+            if len(batch) == args.batch_size:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+        commit()
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun with --resume to continue after image {committed}")
+        return 130
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+
+    progress.report(force=True)
+    print(f"Done: {processed} images in {args.output}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of images or tar archive (optionally compressed)")
+    parser.add_argument("--output", required=True, help="JSONL file, or directory of Parquet parts")
+    parser.add_argument("--format", choices=list(WRITERS), default="jsonl")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="decode/face detection threads")
+    parser.add_argument("--prefetch", type=int, default=None, help="images decoded ahead (default 2 batches)")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default OUTPUT.checkpoint.json)")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY)
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint")
+    parser.add_argument("--backend", default=None, help="keras or onnx (default SKIN_MODEL_BACKEND)")
+    parser.add_argument("--no-demographics", action="store_true", help="skip FairFace")
+    args = parser.parse_args()
+    args.batch_size = max(1, args.batch_size)
+    args.prefetch = max(1, args.prefetch or 2 * args.batch_size)
+    return run(args)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
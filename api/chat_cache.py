@@ -0,0 +1,225 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+# Opt-in: cached answers ignore everything but the skin profile and the message
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "false").lower() == "true"
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", str(6 * 3600)))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "5000"))
+# Minimum cosine similarity of character n-gram vectors for a hit
+CHAT_CACHE_THRESHOLD = float(os.getenv("CHAT_CACHE_THRESHOLD", "0.9"))
+# Only conversations this short are answered from (or stored in) the cache
+CHAT_CACHE_MAX_HISTORY = int(os.getenv("CHAT_CACHE_MAX_HISTORY", "2"))
+
+NGRAM_SIZE = 3
+# Messages shorter than this have few n-grams, so their entries demand a closer match
+SHORT_MESSAGE_CHARS = 40
+SHORT_MESSAGE_PENALTY = 0.1
+
+# Words that change the answer while barely moving the n-gram similarity
+# ("morning" vs "evening", "oily" vs "dry", "not"). A cached answer is only
+# served when both questions name the same key terms, mapped to these groups.
+KEY_TERMS = {
+    "oily": "oily", "dry": "dry", "combination": "combination", "combo": "combination",
+    "normal": "normal", "sensitive": "sensitive",
+    "morning": "morning", "am": "morning", "daytime": "morning",
+    "evening": "evening", "night": "evening", "nighttime": "evening", "bedtime": "evening", "pm": "evening",
+    # "t" is what normalize_message leaves of "don't", "can't", ...
+    "not": "not", "no": "not", "never": "not", "without": "not", "avoid": "not", "cannot": "not", "t": "not",
+}
+
+
+def normalize_message(text):
+    """Lower-case, punctuation-free, single-spaced message text."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def key_terms(text):
+    """Key term groups named in a normalized message."""
+    return frozenset(KEY_TERMS[word] for word in text.split() if word in KEY_TERMS)
+
+
+def ngram_vector(text, n=NGRAM_SIZE):
+    """L2-normalized character n-gram counts of a normalized message (a tiny local embedding)."""
+    padded = f" {text} "
+    counts = {}
+    for i in range(len(padded) - n + 1):
+        gram = padded[i:i + n]
+        counts[gram] = counts.get(gram, 0) + 1
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return {gram: c / norm for gram, c in counts.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+def profile_key(skin_analysis):
+    """(skin type, confident issues, gender, age band) the answer was personalized for."""
+    if not skin_analysis:
+        return "anonymous"
+    skin_type = (skin_analysis.get('skinType', {}).get('type') or 'unknown').lower()
+    issues = sorted((issue.get('name') or '').lower() for issue in skin_analysis.get('skinIssues', [])
+                    if issue.get('confidence', 0) > 0.5)
+    demographics = skin_analysis.get('demographics', {})
+    gender = (demographics.get('gender') or 'unknown').lower()
+    age_band = (demographics.get('age') or 'unknown').lower()
+    return "|".join([skin_type, ",".join(issues), gender, age_band])
+
+
+class _Entry:
+    __slots__ = ("profile", "message", "terms", "vector", "response", "threshold", "expires_at", "hits")
+
+    def __init__(self, profile, message, vector, response, threshold, expires_at):
+        self.profile = profile
+        self.message = message
+        self.terms = key_terms(message)
+        self.vector = vector
+        self.response = response
+        self.threshold = threshold
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class SemanticChatCache:
+    """
+    Caches /chat answers per skin profile and matches new questions by
+    character n-gram cosine similarity, so paraphrases of a cached question
+    hit. A hit also needs the same key terms (skin type, time of day,
+    negation) as the cached question, since a one-word change there changes
+    the answer but not the similarity. Each skin profile has its own
+    inverted n-gram index for candidate lookup. Entries expire after a TTL and the least recently used are
+    evicted past `max_entries`; each entry carries its own similarity
+    threshold (stricter for short questions).
+    """
+
+    def __init__(self, ttl=CHAT_CACHE_TTL, max_entries=CHAT_CACHE_MAX_ENTRIES, threshold=CHAT_CACHE_THRESHOLD,
+                 max_history=CHAT_CACHE_MAX_HISTORY, enabled=CHAT_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_history = max_history
+        self.enabled = enabled
+        self._entries = OrderedDict()  # id -> _Entry, least recently used first
+        self._index = {}  # profile -> {ngram: set of ids}
+        self._exact = {}  # (profile, message) -> id
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "misses": 0, "bypassed": 0, "stored": 0,
+                          "evictions": 0, "expired": 0, "termMismatches": 0}
+
+    def cacheable(self, data):
+        """Whether this chat request may be answered from or stored in the cache."""
+        return self.enabled and len(data.get('conversation') or []) <= self.max_history
+
+    def entry_threshold(self, message):
+        shortfall = max(0, SHORT_MESSAGE_CHARS - len(message)) / SHORT_MESSAGE_CHARS
+        return min(0.99, self.threshold + SHORT_MESSAGE_PENALTY * shortfall)
+
+    def lookup(self, skin_analysis, message):
+        """Returns (cached response or None, best similarity)."""
+        profile = profile_key(skin_analysis)
+        normalized = normalize_message(message)
+        terms = key_terms(normalized)
+        vector = ngram_vector(normalized)
+        now = time.monotonic()
+        with self._lock:
+            self._counters["lookups"] += 1
+            index = self._index.get(profile, {})
+            candidates = set()
+            for gram in vector:
+                candidates |= index.get(gram, set())
+
+            best_id, best_score = None, 0.0
+            mismatched = False
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.expires_at < now:
+                    continue
+                score = cosine(vector, entry.vector)
+                if score < entry.threshold or score <= best_score:
+                    continue
+                if entry.terms != terms:
+                    mismatched = True
+                    continue
+                best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self._counters["misses"] += 1
+                self._counters["termMismatches"] += mismatched
+                return None, best_score
+            entry = self._entries[best_id]
+            entry.hits += 1
+            self._entries.move_to_end(best_id)
+            self._counters["hits"] += 1
+            return entry.response, best_score
+
+    def store(self, skin_analysis, message, response, threshold=None):
+        profile = profile_key(skin_analysis)
+        normalized = normalize_message(message)
+        if not normalized or not response:
+            return
+        vector = ngram_vector(normalized)
+        entry = _Entry(profile, normalized, vector, response,
+                       threshold if threshold is not None else self.entry_threshold(normalized),
+                       time.monotonic() + self.ttl)
+        with self._lock:
+            previous = self._exact.get((profile, normalized))
+            if previous is not None:
+                self._remove(previous)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._exact[(profile, normalized)] = entry_id
+            index = self._index.setdefault(profile, {})
+            for gram in vector:
+                index.setdefault(gram, set()).add(entry_id)
+            self._counters["stored"] += 1
+            self._evict()
+
+    def record_bypass(self):
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def _evict(self):
+        now = time.monotonic()
+        # Expired entries at the LRU end go first, then anything over the cap
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if entry.expires_at < now:
+                self._counters["expired"] += 1
+            elif len(self._entries) > self.max_entries:
+                self._counters["evictions"] += 1
+            else:
+                break
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._exact.pop((entry.profile, entry.message), None)
+        index = self._index.get(entry.profile, {})
+        for gram in entry.vector:
+            ids = index.get(gram)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del index[gram]
+        if not index:
+            self._index.pop(entry.profile, None)
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "entries": entries,
+            "hitRate": counters["hits"] / counters["lookups"] if counters["lookups"] else 0.0,
+        }
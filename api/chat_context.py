@@ -0,0 +1,251 @@
+import json
+import os
+import re
+import threading
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+
+
+# Context window of the chat model and the tokens reserved for its reply
+CHAT_CONTEXT_WINDOW = int(os.getenv("CHAT_CONTEXT_WINDOW", "8192"))
+CHAT_MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", "1024"))
+# Token budget for prior turns; older turns beyond it are summarized
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2048"))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "256"))
+
+# Per-message framing tokens (role, separators) in the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+PERSONA_PROMPT = """
+    You are Hasna, a friendly and knowledgeable skincare assistant with expertise in dermatology. Respond in a warm, conversational tone that feels like talking to a trusted skincare expert friend.
+    
+    PERSONALITY:
+    - Friendly, supportive, and empathetic with a touch of appropriate humor
+    - Communicate clearly with occasional emoji to convey warmth and approachability (but don't overuse them)
+    - Balance being conversational with being informative
+    - Adapt your tone to match the user's emotions and concerns
+    
+    WHEN GIVING SKINCARE ADVICE:
+    - Be specific and personalized based on the user's skin type, concerns, age, gender, and location
+    - Prioritize evidence-based recommendations and clarify when something is your opinion
+    - Mention both affordable/drugstore options and premium products when recommending
+    - Suggest specific ingredients that work well for their skin condition
+    - Format information in easy-to-read sections with bullets when providing detailed routines
+    
+    PRODUCT RECOMMENDATIONS:
+    - Always consider skin type compatibility first and foremost
+    - Adjust recommendations based on climate if you know their location
+    - If they want to find products locally, offer to help them locate nearby stores
+    - Mention what makes a product particularly good for their specific skin needs
+    
+    SPECIAL CONTEXTS:
+    - If user asks about skin conditions that might need medical attention (severe acne, rashes, etc.), gently suggest consulting a dermatologist
+    - If they mention sensitive skin or allergies, be extra cautious with recommendations
+    - If they're new to skincare, explain terms and concepts clearly without jargon
+    
+    USER'S SKIN INFORMATION:
+    {}
+    
+    Remember to be conversational while being helpful. Address their specific questions directly and personalize your responses to their unique skin profile.
+    """
+
+# The persona text is static: split once around the skin block and concatenate
+PERSONA_PREFIX, PERSONA_SUFFIX = PERSONA_PROMPT.split("{}")
+
+
+def estimate_tokens(text):
+    """
+    Conservative token estimate (about 3 characters per token, which
+    over-counts English for Llama-family tokenizers). Used for budgeting
+    only; the exact count comes back as the upstream usage.prompt_tokens.
+    """
+    return (len(text) + 2) // 3
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def skin_profile_block(skin_analysis, user_location=None):
+    """The user's skin information as shown to the model (empty without an analysis)."""
+    if not skin_analysis:
+        return ""
+    skin_type = skin_analysis.get('skinType', {}).get('type', 'Unknown')
+    skin_type_confidence = skin_analysis.get('skinType', {}).get('confidence', 0)
+
+    # Only include issues with high confidence
+    skin_issues = [issue.get('name') for issue in skin_analysis.get('skinIssues', [])
+                   if issue.get('confidence', 0) > 0.5]
+
+    # Get demographics if available
+    demographics = skin_analysis.get('demographics', {})
+    gender = demographics.get('gender', 'Unknown')
+    age_range = demographics.get('age', 'Unknown')
+
+    skin_info = f"""
+        Skin Type: {skin_type} (confidence: {skin_type_confidence:.2f})
+        Skin Issues: {', '.join(skin_issues) if skin_issues else 'None detected'}
+        Gender: {gender}
+        Age Range: {age_range}
+        """
+
+    # Add location info if available
+    if user_location:
+        skin_info += f"\nUser Location: {user_location.get('city', '')}, {user_location.get('country', '')}"
+    return skin_info
+
+
+@lru_cache(maxsize=1024)
+def _system_prompt(profile_key):
+    skin_analysis, user_location = json.loads(profile_key)
+    return PERSONA_PREFIX + skin_profile_block(skin_analysis, user_location) + PERSONA_SUFFIX
+
+
+def system_prompt(skin_analysis, user_location=None):
+    """Persona prompt with the user's skin block, memoized per analysis and location."""
+    return _system_prompt(json.dumps([skin_analysis or None, user_location or None], sort_keys=True))
+
+
+def _first_sentence(text, limit=160):
+    text = " ".join(text.split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + "..."
+
+
+@lru_cache(maxsize=1024)
+def _summarize(turns_key, budget):
+    lines = []
+    for role, content in json.loads(turns_key):
+        speaker = "User" if role == "user" else "Assistant"
+        lines.append(f"- {speaker}: {_first_sentence(content)}")
+
+    # Keep the most recent lines that fit the budget
+    header = "Summary of the earlier conversation (older turns, condensed):"
+    used = estimate_tokens(header) + MESSAGE_OVERHEAD_TOKENS
+    kept = []
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        return None
+    return "\n".join([header] + kept[::-1])
+
+
+def summarize_turns(messages, budget=CHAT_SUMMARY_TOKEN_BUDGET):
+    """
+    Extractive summary of dropped turns (first sentence of each), newest kept
+    first within the budget. Runs locally, so trimming adds no upstream call.
+    """
+    if not messages or budget <= 0:
+        return None
+    key = json.dumps([[m["role"], m["content"]] for m in messages])
+    return _summarize(key, budget)
+
+
+def trim_history(history, budget=CHAT_HISTORY_TOKEN_BUDGET):
+    """
+    Newest-first walk over the conversation keeping turns while they fit the
+    token budget. Returns (kept messages, dropped messages). A newest turn
+    larger than the whole budget is cut down rather than dropped.
+    """
+    kept = []
+    used = 0
+    cutoff = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        message = {"role": history[i]["role"], "content": history[i]["content"]}
+        cost = message_tokens(message)
+        if used + cost > budget:
+            if not kept and budget > MESSAGE_OVERHEAD_TOKENS:
+                # Keep the start of an oversized latest turn
+                chars = (budget - MESSAGE_OVERHEAD_TOKENS) * 3 - 4
+                message["content"] = message["content"][:chars].rstrip() + " ..."
+                kept.append(message)
+                cutoff = i
+            break
+        kept.append(message)
+        used += cost
+        cutoff = i
+    return kept[::-1], list(history[:cutoff])
+
+
+class ChatContextBuilder:
+    """
+    Assembles the messages for a chat completion: the cached persona prompt
+    with the memoized skin block, prior turns trimmed to a token budget (with
+    older turns summarized) and the user message. Records the prompt token
+    counts reported back by the upstream.
+    """
+
+    def __init__(self, context_window=CHAT_CONTEXT_WINDOW, max_tokens=CHAT_MAX_TOKENS,
+                 history_budget=CHAT_HISTORY_TOKEN_BUDGET, summary_budget=CHAT_SUMMARY_TOKEN_BUDGET):
+        self.context_window = context_window
+        self.max_tokens = max_tokens
+        self.history_budget = history_budget
+        self.summary_budget = summary_budget
+        self._lock = threading.Lock()
+        self._prompt_tokens = deque(maxlen=1000)
+        self._estimate_errors = deque(maxlen=1000)
+        self._counters = {"requests": 0, "trimmed": 0, "summarized": 0, "droppedMessages": 0}
+
+    def build(self, skin_analysis, user_location, conversation_history, user_message):
+        """Returns (messages, context info with the estimated prompt tokens)."""
+        system = {"role": "system", "content": system_prompt(skin_analysis, user_location)}
+        user = {"role": "user", "content": user_message}
+        fixed = message_tokens(system) + message_tokens(user)
+
+        # Never let history push the prompt past the context window
+        budget = min(self.history_budget, self.context_window - self.max_tokens - fixed)
+        kept, dropped = trim_history(conversation_history or [], max(0, budget))
+
+        messages = [system]
+        summary = None
+        if dropped:
+            used = sum(message_tokens(m) for m in kept)
+            summary = summarize_turns(dropped, min(self.summary_budget, max(0, budget - used)))
+            if summary:
+                messages.append({"role": "system", "content": summary})
+        messages.extend(kept)
+        messages.append(user)
+
+        info = {
+            "estimatedPromptTokens": sum(message_tokens(m) for m in messages),
+            "historyMessages": len(kept),
+            "droppedMessages": len(dropped),
+            "summarized": summary is not None,
+        }
+        with self._lock:
+            self._counters["requests"] += 1
+            if dropped:
+                self._counters["trimmed"] += 1
+                self._counters["droppedMessages"] += len(dropped)
+            if summary:
+                self._counters["summarized"] += 1
+        return messages, info
+
+    def record_usage(self, info, usage):
+        """Attach the upstream's exact token usage to the context info and track it."""
+        prompt_tokens = (usage or {}).get("prompt_tokens")
+        info["promptTokens"] = prompt_tokens
+        info["completionTokens"] = (usage or {}).get("completion_tokens")
+        if prompt_tokens:
+            with self._lock:
+                self._prompt_tokens.append(prompt_tokens)
+                self._estimate_errors.append(info["estimatedPromptTokens"] / prompt_tokens)
+        return info
+
+    def metrics(self):
+        with self._lock:
+            tokens = np.array(self._prompt_tokens)
+            ratios = np.array(self._estimate_errors)
+            return {
+                **self._counters,
+                "promptTokensP50": float(np.percentile(tokens, 50)) if len(tokens) else None,
+                "promptTokensP95": float(np.percentile(tokens, 95)) if len(tokens) else None,
+                "estimateRatioP50": float(np.percentile(ratios, 50)) if len(ratios) else None,
+            }
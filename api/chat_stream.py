@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def parse_completion_line(line, usage=None):
+    """
+    (end of stream, content delta or None) for one line of an OpenAI-style
+    streaming chat-completions response. Token usage sent with the final
+    chunk (OpenAI `usage` or Groq `x_groq.usage`) is copied into the `usage`
+    dict if one is passed.
+    """
+    if not line or not line.startswith(b"data:"):
+        return False, None
+    chunk = line[5:].strip()
+    if chunk == b"[DONE]":
+        return True, None
+    try:
+        event = json.loads(chunk)
+    except ValueError:
+        return False, None
+    if usage is not None:
+        chunk_usage = event.get("usage") or (event.get("x_groq") or {}).get("usage")
+        if chunk_usage:
+            usage.update(chunk_usage)
+    try:
+        delta = event["choices"][0].get("delta", {})
+    except (KeyError, IndexError):
+        return False, None
+    return False, delta.get("content") or None
+
+
+def iter_completion_deltas(response, usage=None):
+    """Yield content deltas from a streaming chat-completions response (requests)."""
+    for line in response.iter_lines():
+        done, content = parse_completion_line(line, usage)
+        if done:
+            return
+        if content:
+            yield content
+
+
+async def aiter_completion_deltas(response, usage=None):
+    """Yield content deltas from a streaming chat-completions response (aiohttp)."""
+    async for line in response.content:
+        done, content = parse_completion_line(line.rstrip(b"\r\n"), usage)
+        if done:
+            return
+        if content:
+            yield content
+
+
+class StreamMetrics:
+    """Time-to-first-token and outcome counters for streamed chat responses."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._ttfb = deque(maxlen=window)
+        self._durations = deque(maxlen=window)
+        self._counters = {"streams": 0, "completed": 0, "cancelled": 0, "errors": 0}
+
+    def record(self, outcome, ttfb=None, duration=None):
+        with self._lock:
+            self._counters["streams"] += 1
+            self._counters[outcome] += 1
+            if ttfb is not None:
+                self._ttfb.append(ttfb)
+            if duration is not None:
+                self._durations.append(duration)
+
+    def metrics(self):
+        with self._lock:
+            ttfb = np.array(self._ttfb) * 1000.0
+            durations = np.array(self._durations) * 1000.0
+            return {
+                **self._counters,
+                "ttfbMsP50": float(np.percentile(ttfb, 50)) if len(ttfb) else None,
+                "ttfbMsP95": float(np.percentile(ttfb, 95)) if len(ttfb) else None,
+                "durationMsP50": float(np.percentile(durations, 50)) if len(durations) else None,
+            }
+
+
+def stream_chat_events(client, url, headers, payload, suggestions, metrics, on_usage=None, on_complete=None):
+    """
+    Generator of SSE events for a chat completion: one `token` event per
+    upstream delta, then `suggestions` (if any) and `done`, which carries
+    `on_usage(usage)` when given. `on_complete(text)` gets the full reply of
+    a stream that ran to the end. If the client disconnects, the WSGI server
+    closes this generator and the upstream connection is closed with it, so
+    the generation stops.
+    """
+    started = time.perf_counter()
+    ttfb = None
+    outcome = "errors"
+    response = None
+    try:
+        # Flush the headers to the client straight away
+        yield ": stream-open\n\n"
+
+        # The client's read timeout applies per chunk while streaming
+        response = client.post(url, headers=headers, json={**payload, "stream": True}, stream=True)
+        if response.status_code != 200:
+            print(f"Error from GROQ API: {response.text}")
+            yield sse_event("error", {"error": "Failed to get response from AI", "details": response.text})
+            return
+
+        usage = {}
+        parts = []
+        for content in iter_completion_deltas(response, usage):
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+            parts.append(content)
+            yield sse_event("token", {"content": content})
+
+        if on_complete is not None:
+            on_complete("".join(parts))
+
+        if suggestions:
+            yield sse_event("suggestions", suggestions)
+        yield sse_event("done", {"usage": on_usage(usage)} if on_usage is not None else {})
+        outcome = "completed"
+    except GeneratorExit:
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        print(f"Error in chat stream: {str(e)}")
+        yield sse_event("error", {"error": str(e)})
+    finally:
+        if response is not None:
+            response.close()
+        metrics.record(outcome, ttfb, time.perf_counter() - started)
+
+
+async def astream_chat_events(client, url, headers, payload, suggestions, metrics, on_usage=None, on_complete=None):
+    """
+    stream_chat_events for the ASGI server, through an AsyncUpstreamClient.
+    A client disconnect cancels this generator, which closes the upstream
+    stream (and frees its concurrency slot).
+    """
+    started = time.perf_counter()
+    ttfb = None
+    outcome = "errors"
+    try:
+        yield ": stream-open\n\n"
+
+        async with client.stream("POST", url, headers=headers, json={**payload, "stream": True}) as response:
+            if response.status != 200:
+                details = await response.text(errors="replace")
+                print(f"Error from GROQ API: {details}")
+                yield sse_event("error", {"error": "Failed to get response from AI", "details": details})
+                return
+
+            usage = {}
+            parts = []
+            async for content in aiter_completion_deltas(response, usage):
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                parts.append(content)
+                yield sse_event("token", {"content": content})
+
+        if on_complete is not None:
+            on_complete("".join(parts))
+
+        if suggestions:
+            yield sse_event("suggestions", suggestions)
+        yield sse_event("done", {"usage": on_usage(usage)} if on_usage is not None else {})
+        outcome = "completed"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        print(f"Error in chat stream: {str(e)}")
+        yield sse_event("error", {"error": str(e)})
+    finally:
+        metrics.record(outcome, ttfb, time.perf_counter() - started)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from model_backends import FAIRFACE_INPUT_SIZE, demographics_from_logits, fairface_preprocess
+
+
+class DemographicsEngine:
+    """
+    Batched FairFace inference.
+
+    Faces are preprocessed straight into one preallocated Nx3x224x224 batch
+    and run through the model in a single forward pass. Thread counts and
+    inference mode are set up by the FairFace backend (FAIRFACE_NUM_THREADS).
+    """
+
+    def __init__(self, model, max_batch_size=16):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+
+    def predict(self, face_img):
+        """Predict demographics for a single BGR face crop."""
+        return self.predict_batch([face_img])[0]
+
+    def predict_batch(self, faces):
+        """Predict demographics for a list of BGR face crops, in order."""
+        results = []
+        for start in range(0, len(faces), self.max_batch_size):
+            chunk = faces[start:start + self.max_batch_size]
+            batch = np.empty((len(chunk), 3, FAIRFACE_INPUT_SIZE, FAIRFACE_INPUT_SIZE), dtype=np.float32)
+            for i, face in enumerate(chunk):
+                fairface_preprocess(face, out=batch[i])
+            race_logits, gender_logits, age_logits = self.model.predict(batch)
+            results.extend(demographics_from_logits(race_logits, gender_logits, age_logits))
+        return results
@@ -0,0 +1,396 @@
+"""
+Outbound email: a durable SQLite job queue and a worker that delivers it
+over one reused, authenticated SMTP connection.
+
+/send-email renders the message, stores it as a queued job and returns
+right away. The worker claims due jobs in batches, sends them back to back
+on the open connection and records each outcome. Temporary failures (4xx
+replies, dropped connections) are retried with exponential backoff up to
+EMAIL_MAX_ATTEMPTS; permanent 5xx rejections fail the job at once.
+Delivery is at-least-once: a job claimed by a worker that dies is claimed
+again after EMAIL_CLAIM_TIMEOUT.
+
+Usage (from the api/ directory), to run the worker outside the API process:
+    EMAIL_WORKER=off python server.py
+    python email_queue.py
+"""
+import argparse
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+# "thread" delivers from a daemon thread inside the API process; "off" leaves
+# it to a separate `python email_queue.py`
+EMAIL_WORKER = os.getenv("EMAIL_WORKER", "thread").lower()
+EMAIL_QUEUE_PATH = os.getenv("EMAIL_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "data", "email_queue.sqlite3"))
+
+# SMTP server and account (point EMAIL_SMTP_HOST/PORT at tools/fake_smtp_server.py locally)
+EMAIL_SMTP_HOST = os.getenv("EMAIL_SMTP_HOST", "smtp.gmail.com")
+EMAIL_SMTP_PORT = int(os.getenv("EMAIL_SMTP_PORT", "587"))
+EMAIL_SMTP_STARTTLS = os.getenv("EMAIL_SMTP_STARTTLS", "true").lower() == "true"
+EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", "30"))
+EMAIL_SENDER = os.getenv("EMAIL_SENDER", "skinpredict@example.com")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "your_email_password")
+# Close the connection after this long without anything to send
+EMAIL_SMTP_IDLE_SECONDS = float(os.getenv("EMAIL_SMTP_IDLE_SECONDS", "60"))
+
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+# Retry delays double from the base up to the cap (with +/-20% jitter)
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS", "3600"))
+EMAIL_CLAIM_TIMEOUT = float(os.getenv("EMAIL_CLAIM_TIMEOUT", "300"))
+# How often the worker looks for due jobs when nothing wakes it up
+EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
+# Sent and failed jobs are deleted after this long
+EMAIL_QUEUE_RETENTION = int(os.getenv("EMAIL_QUEUE_RETENTION", str(7 * 24 * 3600)))
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_jobs (
+    id TEXT PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claim TEXT,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS email_jobs_due ON email_jobs (status, next_attempt_at);
+"""
+
+
+def build_message(recipient, subject, html, text=None, sender=EMAIL_SENDER):
+    """A MIME message with an HTML body (and a plaintext alternative when given)."""
+    msg = MIMEMultipart('alternative') if text is not None else MIMEMultipart()
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    if text is not None:
+        msg.attach(MIMEText(text, 'plain'))
+    msg.attach(MIMEText(html, 'html'))
+    return msg
+
+
+class EmailQueue:
+    """
+    SQLite-backed queue of rendered messages. Several processes may share
+    the file: claiming marks a batch with a claim token in one UPDATE.
+    Each thread gets its own connection.
+    """
+
+    def __init__(self, path=EMAIL_QUEUE_PATH, claim_timeout=EMAIL_CLAIM_TIMEOUT):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, recipient, msg):
+        """Store a message for delivery; returns the job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO email_jobs (id, recipient, message, status, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, recipient, msg.as_string(), QUEUED, now, now))
+        return job_id
+
+    def enqueue_many(self, messages):
+        """Store [(recipient, message)] in one transaction (e.g. a digest run); returns the job ids."""
+        now = time.time()
+        rows = [(uuid.uuid4().hex, recipient, msg.as_string(), QUEUED, now, now) for recipient, msg in messages]
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO email_jobs (id, recipient, message, status, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return [row[0] for row in rows]
+
+    def claim(self, limit):
+        """Claim up to `limit` due jobs (and stale claims); returns [(id, recipient, message, attempts)]."""
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._connection() as connection:
+            connection.execute(
+                "UPDATE email_jobs SET status = ?, claim = ?, claimed_at = ? WHERE id IN ("
+                "SELECT id FROM email_jobs WHERE (status = ? AND next_attempt_at <= ?) "
+                "OR (status = ? AND claimed_at < ?) ORDER BY next_attempt_at LIMIT ?)",
+                (SENDING, token, now, QUEUED, now, SENDING, now - self.claim_timeout, limit))
+            return connection.execute(
+                "SELECT id, recipient, message, attempts FROM email_jobs WHERE claim = ? AND status = ? "
+                "ORDER BY next_attempt_at", (token, SENDING)).fetchall()
+
+    def record(self, sent, retries, failures):
+        """
+        Store a batch's outcomes: `sent` job ids, `retries` as
+        [(id, delay seconds, error)], `failures` as [(id, error)].
+        """
+        now = time.time()
+        with self._connection() as connection:
+            connection.executemany(
+                "UPDATE email_jobs SET status = ?, attempts = attempts + 1, finished_at = ?, claim = NULL, "
+                "last_error = NULL WHERE id = ?", [(SENT, now, job_id) for job_id in sent])
+            connection.executemany(
+                "UPDATE email_jobs SET status = ?, attempts = attempts + 1, next_attempt_at = ?, claim = NULL, "
+                "last_error = ? WHERE id = ?", [(QUEUED, now + delay, error, job_id)
+                                               for job_id, delay, error in retries])
+            connection.executemany(
+                "UPDATE email_jobs SET status = ?, attempts = attempts + 1, finished_at = ?, claim = NULL, "
+                "last_error = ? WHERE id = ?", [(FAILED, now, error, job_id) for job_id, error in failures])
+
+    def get(self, job_id):
+        """Status of one job, or None if it is unknown (or past retention)."""
+        row = self._connection().execute(
+            "SELECT id, status, attempts, next_attempt_at, last_error, created_at, finished_at "
+            "FROM email_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job_id, status, attempts, next_attempt_at, last_error, created_at, finished_at = row
+        return {
+            "jobId": job_id,
+            "status": status,
+            "attempts": attempts,
+            "nextAttemptAt": next_attempt_at if status == QUEUED else None,
+            "lastError": last_error,
+            "createdAt": created_at,
+            "finishedAt": finished_at,
+        }
+
+    def purge(self, max_age=EMAIL_QUEUE_RETENTION):
+        with self._connection() as connection:
+            return connection.execute("DELETE FROM email_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                      (SENT, FAILED, time.time() - max_age)).rowcount
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM email_jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, SENDING: 0, SENT: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+
+class SmtpConnection:
+    """One SMTP session (STARTTLS + login), opened on demand and reused across messages."""
+
+    def __init__(self, host=EMAIL_SMTP_HOST, port=EMAIL_SMTP_PORT, username=EMAIL_SENDER, password=EMAIL_PASSWORD,
+                 starttls=EMAIL_SMTP_STARTTLS, timeout=EMAIL_SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.smtp = None
+        self.opened = 0
+
+    def send(self, sender, recipient, message):
+        if self.smtp is None:
+            self._open()
+        self.smtp.sendmail(sender, [recipient], message)
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.opened += 1
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+
+def _permanent(error):
+    """5xx replies to a message are final; everything else is worth retrying."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return error.smtp_code >= 500
+    return False
+
+
+class EmailWorker:
+    """
+    Delivers the EmailQueue in batches over one SmtpConnection. notify()
+    wakes it as soon as a job is queued in this process; otherwise it polls
+    every EMAIL_POLL_SECONDS.
+    """
+
+    def __init__(self, queue, connection=None, sender=EMAIL_SENDER, batch_size=EMAIL_BATCH_SIZE,
+                 max_attempts=EMAIL_MAX_ATTEMPTS, mode=EMAIL_WORKER):
+        self.queue = queue
+        self.connection = connection or SmtpConnection()
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.mode = mode
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {"batches": 0, "sent": 0, "retried": 0, "failed": 0}
+        self._send_time = 0.0
+
+    def start_if_enabled(self):
+        if self.mode == "thread":
+            self.start()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="email-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        self._wake.set()
+
+    def deliver_once(self):
+        """Claim and send one batch; returns how many jobs it handled."""
+        jobs = self.queue.claim(self.batch_size)
+        if not jobs:
+            return 0
+
+        sent, retries, failures = [], [], []
+        started = time.perf_counter()
+        for job_id, recipient, message, attempts in jobs:
+            try:
+                try:
+                    self.connection.send(self.sender, recipient, message)
+                except smtplib.SMTPServerDisconnected:
+                    # The server dropped the idle connection: reconnect once
+                    self.connection.close()
+                    self.connection.send(self.sender, recipient, message)
+                sent.append(job_id)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                # A rejected message leaves the session usable; anything else starts a fresh one
+                if (not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                        or isinstance(e, smtplib.SMTPAuthenticationError)):
+                    self.connection.close()
+                if _permanent(e) or attempts + 1 >= self.max_attempts:
+                    failures.append((job_id, error))
+                else:
+                    retries.append((job_id, retry_delay(attempts), error))
+        elapsed = time.perf_counter() - started
+
+        self.queue.record(sent, retries, failures)
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["sent"] += len(sent)
+            self._counters["retried"] += len(retries)
+            self._counters["failed"] += len(failures)
+            self._send_time += elapsed
+        if retries or failures:
+            print(f"Email batch: {len(sent)} sent, {len(retries)} to retry, {len(failures)} failed "
+                  f"(last error: {(retries or failures)[-1][-1]})")
+        return len(jobs)
+
+    def _run(self):
+        idle_since = time.monotonic()
+        last_purge = 0.0
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                if self.deliver_once():
+                    idle_since = time.monotonic()
+                    continue
+            except Exception as e:
+                print(f"Error in email worker: {e}")
+            if self.connection.smtp is not None and time.monotonic() - idle_since > EMAIL_SMTP_IDLE_SECONDS:
+                self.connection.close()
+            if time.monotonic() - last_purge > 3600:
+                last_purge = time.monotonic()
+                try:
+                    self.queue.purge()
+                except sqlite3.Error as e:
+                    print(f"Error purging email queue: {e}")
+            self._wake.wait(EMAIL_POLL_SECONDS)
+        self.connection.close()
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+            send_time = self._send_time
+        handled = counters["sent"] + counters["retried"] + counters["failed"]
+        return {
+            "mode": self.mode,
+            **counters,
+            "connectionsOpened": self.connection.opened,
+            "avgSendMs": send_time / handled * 1000.0 if handled else 0.0,
+            "queue": self.queue.stats(),
+        }
+
+
+def retry_delay(attempts):
+    """Backoff before retry number `attempts + 1`."""
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** attempts)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver queued emails")
+    parser.add_argument("--db", default=None, help="SQLite path (default: EMAIL_QUEUE_PATH)")
+    parser.add_argument("--once", action="store_true", help="send what is due and exit")
+    args = parser.parse_args()
+
+    queue = EmailQueue(args.db) if args.db else EmailQueue()
+    worker = EmailWorker(queue, mode="off")
+    if args.once:
+        started = time.perf_counter()
+        while worker.deliver_once():
+            pass
+        worker.connection.close()
+        print(f"Delivered in {time.perf_counter() - started:.1f}s: {worker.metrics()}")
+        return
+    print(f"Delivering {queue.path} through {worker.connection.host}:{worker.connection.port}")
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Email bodies rendered from the Jinja2 templates in templates/email/.
+
+Every email has an HTML template and a plaintext twin (`name.html`,
+`name.txt`) rendered from the same context. Templates are loaded and
+compiled once, when this module is imported; the per-skin-type
+recommendation blocks never change, so they are rendered once here too and
+dropped into each email as finished fragments. Rendering an email is a
+single pass of the compiled template, joined into one string. HTML output
+is autoescaped, so text from requests (issue names, the AI analysis,
+product names) cannot inject markup.
+"""
+import os
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+
+RESULTS_SUBJECT = "Your SkinPredict Analysis Results"
+DIGEST_SUBJECT = "Your SkinPredict Skincare Digest"
+
+# Skin types with their own recommendations; anything else gets "normal"
+RECOMMENDATION_SKIN_TYPES = ("dry", "oily", "normal")
+
+_environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(["html"]),
+                           trim_blocks=True, lstrip_blocks=True)
+_templates = {
+    (name, kind): _environment.get_template(f"{name}.{kind}")
+    for name in ("results", "digest")
+    for kind in ("html", "txt")
+}
+_recommendations = {
+    kind: {skin_type: _environment.get_template(f"recommendations.{kind}").render(skin_type=skin_type).strip("\n")
+           for skin_type in RECOMMENDATION_SKIN_TYPES}
+    for kind in ("html", "txt")
+}
+_recommendations["html"] = {skin_type: Markup(html) for skin_type, html in _recommendations["html"].items()}
+
+
+def recommendations(skin_type, kind="html"):
+    """The pre-rendered recommendation block for a skin type."""
+    fragments = _recommendations[kind]
+    return fragments.get((skin_type or "").lower(), fragments["normal"])
+
+
+def render(name, context):
+    """(html, text) bodies of email `name` for one template context."""
+    html = _templates[(name, "html")].render(context, recommendations=recommendations(context["skin_type"]))
+    text = _templates[(name, "txt")].render(context, recommendations=recommendations(context["skin_type"], "txt"))
+    return html, text
+
+
+def analysis_context(results):
+    skin_type = results['skinType']
+    return {
+        "skin_type": skin_type['type'],
+        "confidence": skin_type['confidence'],
+        "skin_issues": results['skinIssues'],
+    }
+
+
+def render_results_email(results):
+    """(html, text) bodies of the analysis-results email for an /analyze response."""
+    return render("results", {**analysis_context(results), "ai_response": results.get('ai_response')})
+
+
+def render_digest_email(user):
+    """
+    (html, text) bodies of a periodic digest for one user:
+    {"name", "results" (an /analyze response), "products", "analyzedOn"}.
+    """
+    return render("digest", {
+        **analysis_context(user['results']),
+        "name": user.get('name'),
+        "products": user.get('products') or [],
+        "analyzed_on": user.get('analyzedOn'),
+    })
@@ -0,0 +1,187 @@
+"""
+Offline export of the multitask skin model and FairFace to ONNX.
+
+Usage (from the api/ directory):
+    python export_onnx.py                      # export both models
+    python export_onnx.py --verify face_crops/ # export, then check parity
+
+The exported files are what SKIN_MODEL_BACKEND=onnx loads at runtime
+(SKIN_ONNX_MODEL_PATH / FAIRFACE_ONNX_MODEL_PATH). --verify runs the Keras
+and ONNX backends side by side and fails if the `skinType`/`skinIssues`
+(and demographics) results differ.
+"""
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from model_backends import (
+    FAIRFACE_INPUT_SIZE, FAIRFACE_MODEL_PATH, FAIRFACE_ONNX_MODEL_PATH, SKIN_INPUT_SIZE,
+    SKIN_ONNX_MODEL_PATH, OnnxFairFaceModel, OnnxSkinModel, KerasSkinModel, TorchFairFaceModel,
+    demographics_from_logits, fairface_preprocess, find_skin_model_path, skin_preprocess,
+    skin_results_from_predictions,
+)
+
+ONNX_OPSET = 13
+
+# Maximum absolute difference allowed between backend outputs
+RAW_TOLERANCE = 1e-4
+# Maximum difference allowed between reported confidences (in percent)
+CONFIDENCE_TOLERANCE = 1e-2
+
+
+def export_skin_model(h5_path, onnx_path, opset=ONNX_OPSET):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(h5_path)
+    spec = (tf.TensorSpec((None, SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=onnx_path)
+    print(f"Exported skin model {h5_path} -> {onnx_path}")
+
+
+def export_fairface_model(pt_path, onnx_path, opset=ONNX_OPSET):
+    import torch
+
+    model = torch.load(pt_path)
+    model.eval()
+    dummy = torch.zeros(1, 3, FAIRFACE_INPUT_SIZE, FAIRFACE_INPUT_SIZE)
+    torch.onnx.export(
+        model, dummy, onnx_path, opset_version=opset,
+        input_names=["input"], output_names=["race", "gender", "age"],
+        dynamic_axes={"input": {0: "batch"}, "race": {0: "batch"}, "gender": {0: "batch"}, "age": {0: "batch"}},
+    )
+    print(f"Exported FairFace model {pt_path} -> {onnx_path}")
+
+
+def load_faces(face_dir, limit):
+    """Load face crops for the parity check, or random crops when no dir is given."""
+    faces = []
+    if face_dir:
+        for name in sorted(os.listdir(face_dir)):
+            image = cv2.imread(os.path.join(face_dir, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                faces.append(image)
+            if len(faces) >= limit:
+                break
+    if not faces:
+        rng = np.random.default_rng(0)
+        faces = [rng.integers(0, 256, (256, 256, 3), dtype=np.uint8) for _ in range(limit)]
+    return faces
+
+
+def skin_parity(expected, actual):
+    """
+    Compare two (type_pred, prob_pred) outputs of the skin model. Returns
+    (ok, max abs diff, mismatches), mismatches being (face index, expected
+    result, actual result) for faces whose `skinType`/`skinIssues` differ.
+    """
+    expected_type, expected_prob = expected
+    actual_type, actual_prob = actual
+    max_diff = float(max(np.abs(expected_type - actual_type).max(), np.abs(expected_prob - actual_prob).max()))
+
+    mismatches = []
+    for i in range(len(expected_type)):
+        expected_result = skin_results_from_predictions(expected_type[i], expected_prob[i])
+        actual_result = skin_results_from_predictions(actual_type[i], actual_prob[i])
+        if not _results_match(expected_result, actual_result):
+            mismatches.append((i, expected_result, actual_result))
+    return not mismatches and max_diff <= RAW_TOLERANCE, max_diff, mismatches
+
+
+def fairface_parity(expected, actual):
+    """
+    Compare two (race, gender, age) logit outputs of FairFace. Returns (ok,
+    max abs logit diff, mismatches) like skin_parity; only the predicted
+    classes have to agree.
+    """
+    max_diff = float(max(np.abs(e - a).max() for e, a in zip(expected, actual)))
+
+    mismatches = []
+    expected_results = demographics_from_logits(*expected)
+    actual_results = demographics_from_logits(*actual)
+    for i, (expected_result, actual_result) in enumerate(zip(expected_results, actual_results)):
+        if any(expected_result[k] != actual_result[k] for k in ("race", "gender", "age")):
+            mismatches.append((i, expected_result, actual_result))
+    return not mismatches, max_diff, mismatches
+
+
+def verify_skin_model(h5_path, onnx_path, faces):
+    keras_model = KerasSkinModel(h5_path)
+    onnx_model = OnnxSkinModel(onnx_path)
+    batch = np.stack([skin_preprocess(face) for face in faces])
+
+    ok, max_diff, mismatches = skin_parity(keras_model.predict(batch), onnx_model.predict(batch))
+    for i, expected, actual in mismatches:
+        print(f"  face {i}: keras={expected} onnx={actual}")
+    print(f"Skin model: {len(faces)} faces, max abs diff {max_diff:.2e}, {len(mismatches)} result mismatches")
+    return ok
+
+
+def verify_fairface_model(pt_path, onnx_path, faces):
+    torch_model = TorchFairFaceModel(pt_path)
+    onnx_model = OnnxFairFaceModel(onnx_path)
+    batch = np.concatenate([fairface_preprocess(face) for face in faces])
+
+    ok, max_diff, mismatches = fairface_parity(torch_model.predict(batch), onnx_model.predict(batch))
+    for i, expected, actual in mismatches:
+        print(f"  face {i}: torch={expected} onnx={actual}")
+    print(f"FairFace: {len(faces)} faces, max abs logit diff {max_diff:.2e}, {len(mismatches)} result mismatches")
+    return ok
+
+
+def _results_match(expected, actual):
+    if expected["skinType"]["type"] != actual["skinType"]["type"]:
+        return False
+    if abs(expected["skinType"]["confidence"] - actual["skinType"]["confidence"]) > CONFIDENCE_TOLERANCE:
+        return False
+    if [i["name"] for i in expected["skinIssues"]] != [i["name"] for i in actual["skinIssues"]]:
+        return False
+    return all(abs(e["confidence"] - a["confidence"]) <= CONFIDENCE_TOLERANCE
+               for e, a in zip(expected["skinIssues"], actual["skinIssues"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skin-model", default=find_skin_model_path())
+    parser.add_argument("--fairface-model", default=FAIRFACE_MODEL_PATH)
+    parser.add_argument("--skin-output", default=SKIN_ONNX_MODEL_PATH)
+    parser.add_argument("--fairface-output", default=FAIRFACE_ONNX_MODEL_PATH)
+    parser.add_argument("--skip-export", action="store_true", help="Only run the parity check")
+    parser.add_argument("--verify", nargs="?", const="", default=None, metavar="FACE_DIR",
+                        help="Check parity on face crops from FACE_DIR (random crops if omitted)")
+    parser.add_argument("--verify-limit", type=int, default=32)
+    args = parser.parse_args()
+
+    have_skin = args.skin_model and os.path.exists(args.skin_model)
+    have_fairface = os.path.exists(args.fairface_model)
+    if not have_skin:
+        print("Skin model (.h5) not found, skipping")
+    if not have_fairface:
+        print(f"FairFace model not found at {args.fairface_model}, skipping")
+
+    if not args.skip_export:
+        for path in (args.skin_output, args.fairface_output):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if have_skin:
+            export_skin_model(args.skin_model, args.skin_output)
+        if have_fairface:
+            export_fairface_model(args.fairface_model, args.fairface_output)
+
+    if args.verify is None:
+        return 0
+
+    faces = load_faces(args.verify, args.verify_limit)
+    ok = True
+    if have_skin:
+        ok = verify_skin_model(args.skin_model, args.skin_output, faces) and ok
+    if have_fairface:
+        ok = verify_fairface_model(args.fairface_model, args.fairface_output, faces) and ok
+    print("Parity check passed" if ok else "Parity check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import abc
+import os
+import threading
+
+import cv2
+
+
+# Detection settings (overridable through the environment)
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar")
+FACE_DETECT_MAX_DIM = int(os.getenv("FACE_DETECT_MAX_DIM", "640"))
+# Smallest face to detect, in full-image pixels (0 = no minimum, as originally)
+FACE_MIN_SIZE = int(os.getenv("FACE_MIN_SIZE", "0"))
+YUNET_MODEL_PATH = os.getenv("FACE_DETECTOR_YUNET_MODEL", "face_detection_yunet_2023mar.onnx")
+# How much a face's distance from the image centre lowers its rank (0 = rank by size only)
+FACE_CENTER_WEIGHT = float(os.getenv("FACE_CENTER_WEIGHT", "0.5"))
+
+
+class FaceDetector(abc.ABC):
+    """
+    Interface for face detectors used by crop_face.
+
+    `detect` receives a BGR image and the minimum face size in pixels of that
+    image (0 = no minimum), and returns a list of (x, y, w, h) boxes in the
+    same coordinates.
+    """
+    name = "base"
+
+    @abc.abstractmethod
+    def detect(self, image, min_size):
+        pass
+
+
+class HaarFaceDetector(FaceDetector):
+    """OpenCV's frontal-face Haar cascade (the original crop_face detector)."""
+    name = "haar"
+
+    def __init__(self, scale_factor=1.1, min_neighbors=5):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        if self.cascade.empty():
+            raise RuntimeError("Could not load haarcascade_frontalface_default.xml")
+
+    def detect(self, image, min_size):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        options = {}
+        if min_size > 0:
+            # minSize prunes the small scales of the image pyramid
+            options["minSize"] = (min_size, min_size)
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors, **options)
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class YuNetFaceDetector(FaceDetector):
+    """OpenCV's DNN-based YuNet detector (cv2.FaceDetectorYN, OpenCV >= 4.5.4)."""
+    name = "yunet"
+
+    def __init__(self, model_path=YUNET_MODEL_PATH, score_threshold=0.8, nms_threshold=0.3):
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise RuntimeError("This OpenCV build does not provide FaceDetectorYN")
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"YuNet model not found at {model_path}")
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320),
+                                                  score_threshold, nms_threshold)
+        self.input_size = None
+
+    def detect(self, image, min_size):
+        h, w = image.shape[:2]
+        if self.input_size != (w, h):
+            self.detector.setInputSize((w, h))
+            self.input_size = (w, h)
+        _, faces = self.detector.detect(image)
+        if faces is None:
+            return []
+        boxes = []
+        for face in faces:
+            x, y, fw, fh = (int(round(v)) for v in face[:4])
+            if fw >= min_size and fh >= min_size:
+                boxes.append((x, y, fw, fh))
+        return boxes
+
+
+DETECTORS = {
+    HaarFaceDetector.name: HaarFaceDetector,
+    YuNetFaceDetector.name: YuNetFaceDetector,
+}
+
+# Detectors are not thread-safe, so each worker thread keeps its own instances
+_thread_local = threading.local()
+
+
+def get_face_detector(name=None):
+    """Return this thread's cached detector, creating it on first use."""
+    name = name or FACE_DETECTOR
+    detectors = getattr(_thread_local, "detectors", None)
+    if detectors is None:
+        detectors = _thread_local.detectors = {}
+    detector = detectors.get(name)
+    if detector is None:
+        if name not in DETECTORS:
+            raise ValueError(f"Unknown face detector: {name}")
+        detector = detectors[name] = DETECTORS[name]()
+    return detector
+
+
+def detect_faces(image, detector=None, max_dim=None, min_size=None):
+    """
+    Detect faces on a downscaled copy of `image` and map the boxes back to
+    full-resolution coordinates, ranked by rank_faces (most prominent
+    first). `min_size` is given in full-image pixels.
+    """
+    detector = detector or get_face_detector()
+    max_dim = FACE_DETECT_MAX_DIM if max_dim is None else max_dim
+    min_size = FACE_MIN_SIZE if min_size is None else min_size
+
+    h, w = image.shape[:2]
+    scale = 1.0
+    small = image
+    if max_dim and max(h, w) > max_dim:
+        scale = max_dim / float(max(h, w))
+        small = cv2.resize(image, (int(round(w * scale)), int(round(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    boxes = detector.detect(small, max(1, int(min_size * scale)) if min_size > 0 else 0)
+
+    faces = []
+    for x, y, fw, fh in boxes:
+        x0 = max(0, int(x / scale))
+        y0 = max(0, int(y / scale))
+        x1 = min(w, int((x + fw) / scale))
+        y1 = min(h, int((y + fh) / scale))
+        if x1 > x0 and y1 > y0:
+            faces.append((x0, y0, x1 - x0, y1 - y0))
+    return rank_faces(faces, w, h)
+
+
+def rank_faces(faces, width, height, center_weight=None):
+    """
+    Order (x, y, w, h) boxes by size and centrality: the face area, scaled
+    down by up to `center_weight` as its centre moves from the image centre
+    to a corner. Detectors return boxes in no useful order.
+    """
+    center_weight = FACE_CENTER_WEIGHT if center_weight is None else center_weight
+    cx, cy = width / 2.0, height / 2.0
+    half_diagonal = max(1.0, (cx * cx + cy * cy) ** 0.5)
+
+    def score(box):
+        x, y, w, h = box
+        distance = ((x + w / 2.0 - cx) ** 2 + (y + h / 2.0 - cy) ** 2) ** 0.5 / half_diagonal
+        return w * h * (1.0 - center_weight * min(1.0, distance))
+
+    return sorted(faces, key=score, reverse=True)
+
+
+def crop_face(image, detector=None):
+    """Crop (a view into `image`) of the most prominent face, or None."""
+    faces = detect_faces(image, detector)
+    if len(faces) == 0:
+        return None
+    x, y, w, h = faces[0]
+    return image[y:y+h, x:x+w]
+
+
+def crop_faces(image, max_faces=1, detector=None):
+    """(box, crop) of up to `max_faces` faces, most prominent first."""
+    return [((x, y, w, h), image[y:y+h, x:x+w]) for x, y, w, h in detect_faces(image, detector)[:max_faces]]
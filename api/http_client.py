@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class UpstreamClient:
+    """
+    Outbound HTTP client for one upstream: a keep-alive connection pool,
+    connect/read timeouts, jittered-backoff retries for idempotent calls,
+    a circuit breaker and latency/error metrics.
+    """
+
+    def __init__(self, name, pool_size=10, connect_timeout=3.05, read_timeout=10.0, retries=0,
+                 backoff_base=0.2, backoff_max=2.0, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._counters = {"requests": 0, "errors": 0, "retries": 0, "rejected": 0}
+        self._statuses = {}
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        attempts = 1 + (self.retries if method.upper() in IDEMPOTENT_METHODS else 0)
+
+        last_error = None
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                self._count("rejected")
+                # A retry that trips the breaker surfaces the original failure
+                if last_error is not None:
+                    raise last_error
+                raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(time.perf_counter() - started, None)
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                last_error = e
+            else:
+                self._record(time.perf_counter() - started, response.status_code)
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    return response
+                response.close()
+
+            self._count("retries")
+            # Full jitter: sleep a random time up to the exponential backoff
+            time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+
+    def metrics(self):
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            return {
+                **self._counters,
+                "statuses": dict(self._statuses),
+                "latencyMsP50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "latencyMsP95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "circuit": self.breaker.state,
+            }
+
+    def _record(self, latency, status):
+        with self._lock:
+            self._counters["requests"] += 1
+            self._latencies.append(latency)
+            if status is None or status >= 500:
+                self._counters["errors"] += 1
+            key = str(status) if status is not None else "exception"
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+class AsyncResponse:
+    """Buffered upstream response with the parts of the requests API the handlers use."""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncUpstreamClient(UpstreamClient):
+    """
+    Non-blocking counterpart of UpstreamClient for the ASGI server (aiohttp).
+    Same timeouts, retries, circuit breaker and metrics; at most
+    `max_concurrency` calls (and connections) are in flight at once, later
+    ones wait for a slot. Idle connections are kept alive up to that limit.
+    """
+
+    def __init__(self, name, pool_size=10, connect_timeout=3.05, read_timeout=10.0, retries=0,
+                 backoff_base=0.2, backoff_max=2.0, failure_threshold=5, reset_timeout=30.0, max_concurrency=64):
+        import aiohttp  # only needed by the ASGI server
+
+        self.name = name
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._aiohttp = aiohttp
+        self._errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self._timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        # The session is bound to the event loop, so it is created on first use
+        self.session = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._counters = {"requests": 0, "errors": 0, "retries": 0, "rejected": 0, "queued": 0, "maxInFlight": 0}
+        self._statuses = {}
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        attempts = 1 + (self.retries if method.upper() in IDEMPOTENT_METHODS else 0)
+
+        last_error = None
+        for attempt in range(attempts):
+            try:
+                async with self._slot():
+                    response = await self._send(method, url, kwargs)
+                    try:
+                        buffered = AsyncResponse(response.status, await response.read(), response.headers)
+                    finally:
+                        response.release()
+            except self._errors as e:
+                if attempt + 1 >= attempts:
+                    raise
+                last_error = e
+            except CircuitOpenError:
+                # A retry that trips the breaker surfaces the original failure
+                if last_error is not None:
+                    raise last_error
+                raise
+            else:
+                if buffered.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    return buffered
+
+            self._count("retries")
+            await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+
+    @asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        """Unbuffered aiohttp response (no retries); holds a concurrency slot until it is closed."""
+        async with self._slot():
+            response = await self._send(method, url, kwargs)
+            try:
+                yield response
+            finally:
+                # A stream read to the end keeps its connection; an abandoned one is dropped
+                if response.content.at_eof():
+                    response.release()
+                else:
+                    response.close()
+
+    async def _send(self, method, url, kwargs):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+        if self.session is None:
+            self.session = self._aiohttp.ClientSession(
+                timeout=self._timeout, connector=self._aiohttp.TCPConnector(limit=self.max_concurrency))
+
+        started = time.perf_counter()
+        try:
+            response = await self.session.request(method, url, **kwargs)
+        except self._errors:
+            self._record(time.perf_counter() - started, None)
+            self.breaker.record_failure()
+            raise
+        self._record(time.perf_counter() - started, response.status)
+        if response.status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self._slots.locked():
+            self._count("queued")
+        async with self._slots:
+            self._in_flight += 1
+            with self._lock:
+                self._counters["maxInFlight"] = max(self._counters["maxInFlight"], self._in_flight)
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+
+    async def aclose(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def metrics(self):
+        return {**super().metrics(), "inFlight": self._in_flight, "maxConcurrency": self.max_concurrency}
+
+
+# Per-upstream defaults; each value can be overridden with
+# UPSTREAM_<NAME>_<SETTING>, e.g. UPSTREAM_GOOGLE_PLACES_READ_TIMEOUT=5
+UPSTREAM_DEFAULTS = {
+    "groq": {"pool_size": 20, "connect_timeout": 3.05, "read_timeout": 60.0, "retries": 0},
+    "google_places": {"pool_size": 10, "connect_timeout": 3.05, "read_timeout": 10.0, "retries": 2},
+    "sephora": {"pool_size": 4, "connect_timeout": 3.05, "read_timeout": 10.0, "retries": 0},
+    "ulta": {"pool_size": 4, "connect_timeout": 3.05, "read_timeout": 10.0, "retries": 0},
+}
+
+# In-flight call limits of the ASGI server's clients (UPSTREAM_<NAME>_MAX_CONCURRENCY)
+ASYNC_MAX_CONCURRENCY = {"groq": 256, "google_places": 64, "sephora": 8, "ulta": 8}
+
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _settings_from_env(name, defaults):
+    settings = dict(defaults)
+    for setting, default in defaults.items():
+        value = os.getenv(f"UPSTREAM_{name.upper()}_{setting.upper()}")
+        if value is not None:
+            settings[setting] = type(default)(value)
+    return settings
+
+
+def get_client(name):
+    """Return the shared client for an upstream, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            settings = _settings_from_env(name, UPSTREAM_DEFAULTS.get(name, {}))
+            client = _clients[name] = UpstreamClient(name, **settings)
+        return client
+
+
+def get_async_client(name):
+    """Return the shared non-blocking client for an upstream (ASGI server only)."""
+    with _clients_lock:
+        client = _async_clients.get(name)
+        if client is None:
+            defaults = {**UPSTREAM_DEFAULTS.get(name, {}), "max_concurrency": ASYNC_MAX_CONCURRENCY.get(name, 64)}
+            client = _async_clients[name] = AsyncUpstreamClient(name, **_settings_from_env(name, defaults))
+        return client
+
+
+def upstream_metrics():
+    with _clients_lock:
+        clients = dict(_clients)
+        clients.update({f"{name}:async": client for name, client in _async_clients.items()})
+    return {name: client.metrics() for name, client in clients.items()}
@@ -0,0 +1,237 @@
+import base64
+import binascii
+import os
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+
+# Upload limits, enforced before any decoding happens
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50 * 1000 * 1000)))
+# Images accepted by one /analyze/batch request
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "8"))
+
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale as long as the short side stays
+# at least this large (enough for face detection and a 224x224 model crop)
+DECODE_MIN_SIDE = int(os.getenv("INGEST_DECODE_MIN_SIDE", "720"))
+
+RAW_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp", "application/octet-stream")
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class TooManyImages(ValueError):
+    pass
+
+
+class ImagePayload:
+    """
+    Encoded image bytes from an /analyze request plus the request options.
+    The base64 form is only produced if something (the GROQ path) asks for it.
+    """
+
+    def __init__(self, data, options=None, base64_str=None, error=None):
+        self.data = data
+        self.options = options or {}
+        self._base64_str = base64_str
+        # Set (with empty data) for a batch image rejected before decoding
+        self.error = error
+
+    def flag(self, name, default=False):
+        """Read a boolean option, accepting JSON booleans or form/query strings."""
+        value = self.options.get(name, default)
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return bool(value)
+
+    def integer(self, name, default=0):
+        """Read an integer option (JSON number or string), falling back to `default`."""
+        try:
+            return int(self.options.get(name, default))
+        except (TypeError, ValueError):
+            return default
+
+    def base64(self):
+        if self._base64_str is None:
+            self._base64_str = base64.b64encode(self.data).decode("ascii")
+        return self._base64_str
+
+
+def read_image_payload(req):
+    """
+    Read the image from a Flask request. Accepts multipart/form-data (field
+    `image`), a raw image body (image/jpeg, image/png, ...) or the original
+    JSON body with a base64 `image` string. Returns None if there is no image.
+    """
+    if req.content_length is not None and req.content_length > _max_request_bytes():
+        raise ImageTooLarge(f"Request body exceeds {MAX_UPLOAD_BYTES} bytes")
+
+    mimetype = req.mimetype or ""
+
+    if mimetype == "multipart/form-data":
+        upload = req.files.get("image")
+        if upload is None:
+            return None
+        data = upload.read(MAX_UPLOAD_BYTES + 1)
+        _check_size(len(data))
+        return ImagePayload(data, dict(req.form.items()) | dict(req.args.items()))
+
+    if mimetype in RAW_IMAGE_TYPES:
+        data = req.get_data(cache=False)
+        _check_size(len(data))
+        return ImagePayload(data, dict(req.args.items()))
+
+    body = req.get_json(silent=True)
+    if not body or "image" not in body:
+        return None
+    encoded = body["image"]
+    # Base64 inflates by 4/3, so the decoded size is known before decoding
+    _check_size(len(encoded) * 3 // 4)
+    try:
+        data = base64.b64decode(encoded)
+    except (binascii.Error, ValueError):
+        return ImagePayload(b"", body, encoded)
+    return ImagePayload(data, body, encoded)
+
+
+def read_image_batch(req):
+    """
+    Read the images of an /analyze/batch request: multipart/form-data with
+    one or more `images` (or `image`) files, or a JSON body with a list of
+    base64 strings under `images`. Returns one ImagePayload per image, all
+    sharing the request options; an image over MAX_UPLOAD_BYTES gets an
+    `error` instead of failing the whole request.
+    """
+    if req.content_length is not None and req.content_length > _max_request_bytes() * MAX_BATCH_IMAGES:
+        raise ImageTooLarge(f"Request body exceeds {MAX_BATCH_IMAGES} images of {MAX_UPLOAD_BYTES} bytes")
+
+    if (req.mimetype or "") == "multipart/form-data":
+        uploads = req.files.getlist("images") or req.files.getlist("image")
+        _check_count(len(uploads))
+        options = dict(req.form.items()) | dict(req.args.items())
+        payloads = []
+        for upload in uploads:
+            data = upload.read(MAX_UPLOAD_BYTES + 1)
+            payloads.append(_batch_payload(data, len(data), options))
+        return payloads
+
+    body = req.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("images"), list):
+        return []
+    _check_count(len(body["images"]))
+    payloads = []
+    for encoded in body["images"]:
+        if not isinstance(encoded, str):
+            payloads.append(ImagePayload(b"", body, error="Image must be a base64 string"))
+            continue
+        payload = _batch_payload(None, len(encoded) * 3 // 4, body, encoded)
+        if payload.error is None:
+            try:
+                payload.data = base64.b64decode(encoded)
+            except (binascii.Error, ValueError):
+                payload.data = b""
+        payloads.append(payload)
+    return payloads
+
+
+def image_dimensions(data):
+    """Read (width, height) from a JPEG or PNG header without decoding, or None."""
+    view = memoryview(data)
+    if len(view) >= 24 and view[:8] == b"\x89PNG\r\n\x1a\n":
+        width, height = struct.unpack(">II", view[16:24])
+        return width, height
+
+    if len(view) < 4 or view[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(view):
+        if view[i] != 0xFF:
+            i += 1
+            continue
+        marker = view[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack(">H", view[i + 2:i + 4])[0]
+        # SOF0..SOF15 (excluding DHT, JPG and DAC) carry the frame size
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", view[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def decode_image(data, min_side=None):
+    """
+    Decode image bytes to a BGR array, rejecting oversized images from their
+    header and decoding large JPEGs at reduced scale. Returns None if the
+    bytes are not a valid image.
+    """
+    if not data:
+        return None
+    min_side = DECODE_MIN_SIDE if min_side is None else min_side
+
+    flag = cv2.IMREAD_COLOR
+    dims = image_dimensions(data)
+    if dims is not None:
+        width, height = dims
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ImageTooLarge(f"Image has {width * height} pixels, limit is {MAX_IMAGE_PIXELS}")
+        if min_side and bytes(data[:2]) == b"\xff\xd8":
+            for factor, reduced_flag in _REDUCED_FLAGS:
+                if min(width, height) // factor >= min_side:
+                    flag = reduced_flag
+                    break
+
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+
+# Per-thread scratch buffers, so preprocessing does not allocate per request
+_thread_buffers = threading.local()
+
+
+def thread_buffer(name, shape, dtype=np.float32):
+    buffers = getattr(_thread_buffers, "buffers", None)
+    if buffers is None:
+        buffers = _thread_buffers.buffers = {}
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def _max_request_bytes():
+    # Room for base64 inflation and JSON/multipart framing
+    return MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+
+
+def _check_count(count):
+    if count > MAX_BATCH_IMAGES:
+        raise TooManyImages(f"Batch has {count} images, limit is {MAX_BATCH_IMAGES}")
+
+
+def _batch_payload(data, size, options, base64_str=None):
+    try:
+        _check_size(size)
+    except ImageTooLarge as e:
+        return ImagePayload(b"", options, error=str(e))
+    return ImagePayload(data, options, base64_str)
+
+
+def _check_size(size):
+    if size > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"Image exceeds {MAX_UPLOAD_BYTES} bytes")
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class BatchingPredictor:
+    """
+    Collects single-face inputs from concurrent requests and runs them through
+    the multitask skin model as one batched forward pass.
+
+    A background thread waits for the first queued face, then keeps gathering
+    until either `max_batch_size` faces are queued or `max_wait_ms` has passed
+    since that first face arrived. Each caller gets back its own
+    (type_pred, prob_pred) row.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10, name="skin-model"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        # Metrics
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._batch_size_histogram = {}
+        self._total_queue_wait = 0.0
+        self._total_inference_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, face, timeout=None):
+        """
+        Queue a single preprocessed face (224x224x3) and block until its
+        predictions are ready. Returns (type_pred_row, prob_pred_row).
+        """
+        return self.predict_many([face], timeout)[0]
+
+    def predict_many(self, faces, timeout=None):
+        """
+        Queue several preprocessed faces at once, so they share a forward pass
+        (as far as max_batch_size allows). Returns one row pair per face.
+        """
+        items = [_PendingItem(face) for face in faces]
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError(f"{self.name} batcher has been stopped")
+            self._queue.extend(items)
+            depth = len(self._queue)
+            self._cond.notify()
+
+        with self._metrics_lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for item in items:
+            remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            if not item.done.wait(remaining):
+                raise TimeoutError(f"Timed out waiting for {self.name} prediction")
+            if item.error is not None:
+                raise item.error
+        return [item.result for item in items]
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=1.0)
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def metrics(self):
+        with self._metrics_lock:
+            batches = self._batches
+            return {
+                "queueDepth": self.queue_depth(),
+                "maxQueueDepth": self._max_queue_depth,
+                "batches": batches,
+                "items": self._items,
+                "avgBatchSize": (self._items / batches) if batches else 0.0,
+                "batchSizeHistogram": dict(sorted(self._batch_size_histogram.items())),
+                "avgQueueWaitMs": (self._total_queue_wait / self._items * 1000.0) if self._items else 0.0,
+                "avgInferenceMs": (self._total_inference_time / batches * 1000.0) if batches else 0.0,
+                "maxBatchSize": self.max_batch_size,
+                "maxWaitMs": self.max_wait * 1000.0,
+            }
+
+    def _collect_batch(self):
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if self._stopped and not self._queue:
+                return None
+
+            # Wait for more faces until the batch is full or the window closes
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            try:
+                inputs = np.stack([item.face for item in batch])
+                type_pred, prob_pred = self.predict_fn(inputs)
+                for i, item in enumerate(batch):
+                    item.result = (type_pred[i], prob_pred[i])
+            except Exception as e:
+                print(f"Error running batched {self.name} prediction: {e}")
+                for item in batch:
+                    item.error = e
+            finished = time.perf_counter()
+
+            with self._metrics_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_size_histogram[len(batch)] = self._batch_size_histogram.get(len(batch), 0) + 1
+                self._total_queue_wait += sum(started - item.enqueued_at for item in batch)
+                self._total_inference_time += finished - started
+
+            for item in batch:
+                item.done.set()
+
+
+class _PendingItem:
+    __slots__ = ("face", "enqueued_at", "done", "result", "error")
+
+    def __init__(self, face):
+        self.face = face
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def batcher_settings_from_env():
+    """
+    Read the batching window from the environment (SKIN_BATCH_MAX_SIZE,
+    SKIN_BATCH_MAX_WAIT_MS). A max size of 1 effectively disables batching.
+    """
+    return {
+        "max_batch_size": int(os.getenv("SKIN_BATCH_MAX_SIZE", "16")),
+        "max_wait_ms": float(os.getenv("SKIN_BATCH_MAX_WAIT_MS", "10")),
+    }
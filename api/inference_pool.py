@@ -0,0 +1,562 @@
+"""
+Process pool for /analyze inference (face detection, the skin model and
+FairFace), isolated from the web workers.
+
+Each worker process loads the models once, with every native thread pool
+pinned to INFERENCE_THREADS_PER_WORKER threads, and takes batches of tasks
+from the web process over its own pipe: whatever is queued when it becomes
+idle (up to INFERENCE_MAX_BATCH) runs as one batched forward pass per model.
+Decoded images are placed in shared memory, so a task only carries the
+segment name, shape and face box. Once INFERENCE_MAX_QUEUE tasks are
+waiting, new requests are rejected with InferencePoolFull, which /analyze
+turns into a 503 with Retry-After. Workers that die are restarted and their tasks failed.
+"""
+import atexit
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing import connection, resource_tracker, shared_memory
+
+import numpy as np
+
+
+# "process" runs /analyze inference in the pool; "off" keeps it in the web process
+INFERENCE_POOL = os.getenv("INFERENCE_POOL", "off").lower()
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+# Intra-op threads per worker (0 = cores divided evenly between the workers)
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("INFERENCE_THREADS_PER_WORKER", "0"))
+# Tasks waiting for a worker beyond which new work is rejected
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "32"))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "16"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+# "fork" starts workers from the web process before it has loaded any model;
+# "spawn"/"forkserver" need an entry point (gunicorn, uvicorn) rather than
+# `python server.py`, whose start-up code would run again in every worker
+INFERENCE_START_METHOD = os.getenv("INFERENCE_START_METHOD", "fork")
+
+DETECT = "detect"
+SKIN = "skin"
+DEMOGRAPHICS = "demographics"
+
+# Native thread pools capped in each worker before the model libraries load
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                   "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS")
+
+UTILIZATION_WINDOW = 60.0
+QUEUE_WAIT_SAMPLES = 1024
+
+
+class InferencePoolFull(Exception):
+    """The pool's queue is past its depth limit; retry after `retry_after` seconds."""
+
+    def __init__(self, depth, retry_after):
+        super().__init__(f"Inference queue is full ({depth} waiting), retry later")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class _Task:
+    __slots__ = ("id", "kind", "image_ref", "box", "future", "enqueued_at")
+
+    def __init__(self, task_id, kind, image_ref, box):
+        self.id = task_id
+        self.kind = kind
+        self.image_ref = image_ref
+        self.box = box
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class _Worker:
+    __slots__ = ("slot", "process", "conn", "ready", "tasks", "models", "busy_since")
+
+    def __init__(self, slot, process, conn):
+        self.slot = slot
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.tasks = []
+        self.models = None
+        self.busy_since = None
+
+
+class InferencePool:
+    """
+    N inference worker processes fed from one queue in the web process.
+
+    Request threads call `session(image)` and use the returned
+    InferenceSession like the in-process path: crop_face(),
+    submit_demographics(), predict_skin(); `batch_session(images)` does the
+    same for several images at once.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+                 max_queue=INFERENCE_MAX_QUEUE, max_batch=INFERENCE_MAX_BATCH, timeout=INFERENCE_TIMEOUT,
+                 retry_after=INFERENCE_RETRY_AFTER, start_method=INFERENCE_START_METHOD):
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.max_queue = max_queue
+        self.max_batch = max(1, int(max_batch))
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.start_method = start_method
+        self._context = multiprocessing.get_context(start_method)
+
+        self._queue = deque()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._thread = None
+        self._stopped = False
+        self._started_at = None
+
+        # Metrics
+        self._counters = {"tasks": 0, "failed": 0, "rejected": 0, "batches": 0, "restarts": 0}
+        self._max_queue_depth = 0
+        self._queue_waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+        self._busy = deque()  # (finished_at, busy seconds) of recent batches
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Workers register the segments they attach with the web process's tracker
+            resource_tracker.ensure_running()
+            self._started_at = time.perf_counter()
+            self._workers = [self._start_worker(slot) for slot in range(self.workers)]
+            self._thread = threading.Thread(target=self._run, name="inference-pool", daemon=True)
+            self._thread.start()
+        # Runs before multiprocessing terminates its daemon children at exit, so
+        # the dispatcher doesn't take those exits for crashes and restart workers
+        atexit.register(self.stop)
+        print(f"Inference pool started: {self.workers} workers x {self.threads_per_worker} threads "
+              f"({self.start_method})")
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5.0)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def is_ready(self):
+        """True once at least one worker has loaded its models."""
+        with self._lock:
+            return any(worker.ready for worker in self._workers)
+
+    def available(self, name):
+        """Whether the workers have model `name` loaded."""
+        status = self.status().get(name)
+        return status is not None and status["state"] == "ready"
+
+    def status(self):
+        """Model status as reported by a ready worker (ModelRegistry.status() format)."""
+        with self._lock:
+            for worker in self._workers:
+                if worker.ready:
+                    return dict(worker.models)
+        return {}
+
+    def check_capacity(self):
+        """Raise InferencePoolFull when the queue is at its depth limit."""
+        with self._lock:
+            depth = len(self._queue)
+            if depth >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise InferencePoolFull(depth, self.retry_after)
+
+    def session(self, image):
+        """
+        Admit one request's image (or raise InferencePoolFull). Its follow-up
+        tasks are never rejected, so admitted requests always complete.
+        """
+        self.check_capacity()
+        return InferenceSession(self, image)
+
+    def batch_session(self, images):
+        """Admit the images of one /analyze/batch request together (or raise InferencePoolFull)."""
+        self.check_capacity()
+        return InferenceBatchSession(self, images)
+
+    def submit(self, kind, image_ref, box=None):
+        """Queue one task on a shared image; returns a future with its result."""
+        return self.submit_many([(kind, image_ref, box)])[0]
+
+    def submit_many(self, tasks):
+        """
+        Queue (kind, image_ref, box) tasks together, so an idle worker takes
+        them as one batch; returns one future per task.
+        """
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("Inference pool has been stopped")
+            queued = [_Task(next(self._task_ids), kind, image_ref, box) for kind, image_ref, box in tasks]
+            self._queue.extend(queued)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            for worker in self._workers:
+                if not self._queue:
+                    break
+                if worker.ready and not worker.tasks:
+                    self._dispatch(worker)
+        return [task.future for task in queued]
+
+    def metrics(self):
+        now = time.perf_counter()
+        with self._lock:
+            while self._busy and self._busy[0][0] < now - UTILIZATION_WINDOW:
+                self._busy.popleft()
+            window = min(UTILIZATION_WINDOW, now - self._started_at) if self._started_at else 0.0
+            busy = sum(seconds for _, seconds in self._busy)
+            # Batches still running count up to now
+            busy += sum(now - worker.busy_since for worker in self._workers if worker.busy_since is not None)
+            waits = np.array(self._queue_waits) * 1000.0
+            counters = dict(self._counters)
+            return {
+                "workers": self.workers,
+                "readyWorkers": sum(worker.ready for worker in self._workers),
+                "busyWorkers": sum(bool(worker.tasks) for worker in self._workers),
+                "threadsPerWorker": self.threads_per_worker,
+                "utilization": min(1.0, busy / (window * self.workers)) if window > 0 else 0.0,
+                "queueDepth": len(self._queue),
+                "maxQueueDepth": self._max_queue_depth,
+                "queueLimit": self.max_queue,
+                **counters,
+                "avgBatchSize": counters["tasks"] / counters["batches"] if counters["batches"] else 0.0,
+                "queueWaitMs": {
+                    "p50": float(np.percentile(waits, 50)) if len(waits) else 0.0,
+                    "p95": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+                    "max": float(waits.max()) if len(waits) else 0.0,
+                },
+            }
+
+    def _start_worker(self, slot):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.threads_per_worker, self.max_batch),
+                                        name=f"inference-worker-{slot}", daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(slot, process, parent_conn)
+
+    def _dispatch(self, worker):
+        """Hand an idle worker everything queued, up to max_batch (called with the lock held)."""
+        if not self._queue:
+            return
+        now = time.perf_counter()
+        batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+        worker.tasks = batch
+        worker.busy_since = now
+        self._queue_waits.extend(now - task.enqueued_at for task in batch)
+        try:
+            worker.conn.send([(task.id, task.kind, task.image_ref, task.box) for task in batch])
+        except OSError:
+            # The worker is gone; _run fails these tasks when its sentinel fires
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                waitables = {}
+                for worker in self._workers:
+                    waitables[worker.conn] = worker
+                    waitables[worker.process.sentinel] = worker
+            for ready in connection.wait(list(waitables), timeout=1.0):
+                worker = waitables[ready]
+                if ready is worker.conn:
+                    try:
+                        message = worker.conn.recv()
+                    except (EOFError, OSError):
+                        self._replace(worker)
+                        continue
+                    self._handle(worker, message)
+                elif worker.process.exitcode is not None:
+                    self._replace(worker)
+
+    def _handle(self, worker, message):
+        if message[0] == "ready":
+            _, pid, models = message
+            print(f"Inference worker {worker.slot} (pid {pid}) ready: "
+                  + ", ".join(f"{name} {status['state']}" for name, status in models.items()))
+            with self._lock:
+                worker.models = models
+                worker.ready = True
+                self._dispatch(worker)
+            return
+
+        _, results, busy = message
+        with self._lock:
+            tasks = {task.id: task for task in worker.tasks}
+            worker.tasks = []
+            worker.busy_since = None
+            self._busy.append((time.perf_counter(), busy))
+            self._counters["batches"] += 1
+            self._counters["tasks"] += len(results)
+            self._counters["failed"] += sum(error is not None for _, _, error in results)
+            self._dispatch(worker)
+        for task_id, result, error in results:
+            task = tasks[task_id]
+            if error is not None:
+                task.future.set_exception(RuntimeError(error))
+            else:
+                task.future.set_result(result)
+
+    def _replace(self, worker):
+        """Fail a dead worker's tasks and start a new process in its slot."""
+        with self._lock:
+            if worker not in self._workers:
+                return
+            tasks, worker.tasks = worker.tasks, []
+            self._counters["failed"] += len(tasks)
+            replacement = None
+            if not self._stopped:
+                self._counters["restarts"] += 1
+                replacement = self._start_worker(worker.slot)
+            if replacement is not None:
+                self._workers[self._workers.index(worker)] = replacement
+            else:
+                self._workers.remove(worker)
+        print(f"Inference worker {worker.slot} exited ({worker.process.exitcode}), "
+              f"failing {len(tasks)} tasks" + (", restarting" if replacement else ""))
+        worker.conn.close()
+        for task in tasks:
+            task.future.set_exception(RuntimeError("Inference worker exited"))
+
+
+class InferenceSession:
+    """
+    One decoded image shared with the pool for the length of a request.
+    The image is copied once into a shared memory segment; tasks only pass
+    its name and the face box. Close the session to release the segment.
+    """
+
+    def __init__(self, pool, image):
+        self.pool = pool
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        self._image = np.ndarray(image.shape, dtype=image.dtype, buffer=self._shm.buf)
+        self._image[...] = image
+        self.image_ref = (self._shm.name, image.shape, image.dtype.str)
+        self.boxes = []
+
+    def crop_face(self, max_faces=1):
+        """
+        Detect faces in a worker and keep up to `max_faces` boxes (most
+        prominent first) for the model tasks; returns a copy of the first
+        face crop, or None.
+        """
+        return self.face_from_boxes(self.pool.submit(DETECT, self.image_ref).result(self.pool.timeout), max_faces)
+
+    def face_from_boxes(self, boxes, max_faces=1):
+        self.boxes = list(boxes[:max_faces])
+        if not self.boxes:
+            return None
+        x, y, w, h = self.boxes[0]
+        return self._image[y:y+h, x:x+w].copy()
+
+    def submit_demographics(self):
+        """Start FairFace on the kept faces; `.result()` gives their demographics (or None) in order."""
+        return _FutureList(self.pool.submit_many([(DEMOGRAPHICS, self.image_ref, box) for box in self.boxes]),
+                           self.pool.timeout)
+
+    def predict_skin(self):
+        """(type_pred, prob_pred) rows of the skin model for each kept face."""
+        futures = self.pool.submit_many([(SKIN, self.image_ref, box) for box in self.boxes])
+        return [future.result(self.pool.timeout) for future in futures]
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._image = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class InferenceBatchSession:
+    """
+    The images of one /analyze/batch request, each in its own
+    InferenceSession. Detection, skin and FairFace tasks for all of them are
+    queued together, so a worker runs each stage as one batch.
+    """
+
+    def __init__(self, pool, images):
+        self.pool = pool
+        self.sessions = []
+        try:
+            for image in images:
+                self.sessions.append(InferenceSession(pool, image))
+        except Exception:
+            self.close()
+            raise
+
+    def crop_faces(self):
+        """(face crop or None, error or None) for each image."""
+        futures = self.pool.submit_many([(DETECT, session.image_ref, None) for session in self.sessions])
+        faces = []
+        for session, future in zip(self.sessions, futures):
+            try:
+                faces.append((session.face_from_boxes(future.result(self.pool.timeout)), None))
+            except Exception as e:
+                faces.append((None, str(e)))
+        return faces
+
+    def submit_demographics(self, indices):
+        """Start FairFace on the faces of images `indices`; `.result()` gives their demographics in order."""
+        return _FutureList(self.pool.submit_many(
+            [(DEMOGRAPHICS, self.sessions[i].image_ref, self.sessions[i].boxes[0]) for i in indices]),
+            self.pool.timeout)
+
+    def predict_skin(self, indices):
+        """(type_pred, prob_pred) rows of the skin model for the faces of images `indices`."""
+        futures = self.pool.submit_many(
+            [(SKIN, self.sessions[i].image_ref, self.sessions[i].boxes[0]) for i in indices])
+        return [future.result(self.pool.timeout) for future in futures]
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _FutureList:
+    """Several task futures read as one list of results."""
+
+    def __init__(self, futures, timeout):
+        self.futures = futures
+        self.timeout = timeout
+
+    def result(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        return [future.result(timeout) for future in self.futures]
+
+
+def _worker_main(conn, threads, max_batch):
+    """Worker process: load the models with pinned thread counts, then serve task batches."""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    import cv2
+    cv2.setNumThreads(threads)
+
+    from demographics import DemographicsEngine
+    from model_backends import (SKIN_INPUT_SIZE, FAIRFACE_INPUT_SIZE, load_skin_model, load_fairface_model)
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry(mode="background")
+    registry.register("skin", lambda: load_skin_model(num_threads=threads),
+                      warmup=lambda model: model.predict(
+                          np.zeros((1, SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3), dtype=np.float32)))
+    registry.register("fairface", lambda: load_fairface_model(num_threads=threads),
+                      warmup=lambda model: model.predict(
+                          np.zeros((1, 3, FAIRFACE_INPUT_SIZE, FAIRFACE_INPUT_SIZE), dtype=np.float32)))
+    registry.start()
+    skin_model = registry.get("skin", wait=True)
+    fairface_model = registry.get("fairface", wait=True)
+    engine = DemographicsEngine(fairface_model, max_batch) if fairface_model is not None else None
+    conn.send(("ready", os.getpid(), registry.status()))
+
+    while True:
+        try:
+            tasks = conn.recv()
+        except EOFError:
+            return
+        if tasks is None:
+            return
+        started = time.perf_counter()
+        segments = {}
+        try:
+            results = _run_tasks(tasks, segments, skin_model, engine)
+        finally:
+            for segment in segments.values():
+                try:
+                    segment.close()
+                except BufferError:
+                    pass
+        conn.send(("done", results, time.perf_counter() - started))
+
+
+def _attach(image_ref, segments):
+    name, shape, dtype = image_ref
+    segment = segments.get(name)
+    if segment is None:
+        segment = segments[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+def _run_tasks(tasks, segments, skin_model, engine):
+    """
+    Run one batch: detections one by one, skin and FairFace as one forward
+    pass each. FairFace gets the face crops (it resizes them with PIL's
+    filter), the skin model their 224x224 resize.
+    """
+    from face_detection import detect_faces
+    from model_backends import SKIN_INPUT_SIZE, resize_face, skin_preprocess
+
+    results = []
+    faces = {SKIN: [], DEMOGRAPHICS: []}
+    resized = {}
+    for task_id, kind, image_ref, box in tasks:
+        try:
+            image = _attach(image_ref, segments)
+            if kind == DETECT:
+                results.append((task_id, detect_faces(image), None))
+            else:
+                x, y, w, h = box
+                face = image[y:y+h, x:x+w]
+                if kind == SKIN:
+                    key = (image_ref[0], tuple(box))
+                    if key not in resized:
+                        resized[key] = resize_face(face)
+                    face = resized[key]
+                faces[kind].append((task_id, face))
+        except Exception as e:
+            results.append((task_id, None, f"{type(e).__name__}: {e}"))
+
+    if faces[SKIN]:
+        task_ids = [task_id for task_id, _ in faces[SKIN]]
+        try:
+            if skin_model is None:
+                raise RuntimeError("Model not loaded")
+            batch = np.empty((len(task_ids), SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3), dtype=np.float32)
+            for i, (_, face) in enumerate(faces[SKIN]):
+                skin_preprocess(face, out=batch[i])
+            type_pred, prob_pred = skin_model.predict(batch)
+            results.extend((task_id, (type_pred[i], prob_pred[i]), None) for i, task_id in enumerate(task_ids))
+        except Exception as e:
+            print(f"Error running batched skin-model prediction: {e}")
+            results.extend((task_id, None, str(e)) for task_id in task_ids)
+
+    if faces[DEMOGRAPHICS]:
+        task_ids = [task_id for task_id, _ in faces[DEMOGRAPHICS]]
+        # Like predict_demographics, a FairFace failure means no demographics rather than an error
+        demographics = [None] * len(task_ids)
+        if engine is not None:
+            try:
+                demographics = engine.predict_batch([face for _, face in faces[DEMOGRAPHICS]])
+            except Exception as e:
+                print(f"Error predicting demographics: {e}")
+        results.extend(zip(task_ids, demographics, [None] * len(task_ids)))
+
+    return results
@@ -0,0 +1,292 @@
+"""
+Inference backends for the multitask skin model and the FairFace model.
+
+The Keras/torch backends import TensorFlow and torch lazily, so a server
+configured with SKIN_MODEL_BACKEND=onnx never pays for those imports.
+"""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# Backend selection: "keras" (TensorFlow + torch) or "onnx" (onnxruntime only)
+SKIN_MODEL_BACKEND = os.getenv("SKIN_MODEL_BACKEND", "keras").lower()
+
+# Original model files
+SKIN_MODEL_PATHS = [
+    "multitask_skin_model.h5",  # Current directory
+    "../multitask_skin_model.h5",  # Parent directory
+    "../../multitask_skin_model.h5",  # Project root
+    "D:/Tek-UP/4eme SDIA/Semester2/Project/skinPredict/multitask_skin_model.h5"  # Absolute path
+]
+FAIRFACE_MODEL_PATH = "fairface_models/res34_fair_align_multi_7_20190809.pt"
+
+# Exported ONNX files (see export_onnx.py)
+SKIN_ONNX_MODEL_PATH = os.getenv("SKIN_ONNX_MODEL_PATH", "models/multitask_skin_model.onnx")
+FAIRFACE_ONNX_MODEL_PATH = os.getenv("FAIRFACE_ONNX_MODEL_PATH", "models/fairface_res34.onnx")
+
+# Precision variant of the ONNX models to serve: fp32, fp16, int8 or int8-static
+# (see quantize_models.py). Variants are stored next to the FP32 file, e.g.
+# models/multitask_skin_model.int8.onnx
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "fp32").lower()
+MODEL_VARIANTS = ("fp32", "fp16", "int8", "int8-static")
+
+# Both models take 224x224 face crops, so one resize serves both (resize_face)
+FACE_INPUT_SIZE = 224
+SKIN_INPUT_SIZE = FACE_INPUT_SIZE
+
+# FairFace preprocessing constants (ImageNet normalization, RGB order),
+# folded into one multiply-subtract per channel: x * scale - offset
+FAIRFACE_INPUT_SIZE = FACE_INPUT_SIZE
+FAIRFACE_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+FAIRFACE_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+FAIRFACE_SCALE = 1.0 / (255.0 * FAIRFACE_STD)
+FAIRFACE_OFFSET = FAIRFACE_MEAN / FAIRFACE_STD
+
+# Intra-op threads for FairFace inference (0 = library default)
+FAIRFACE_NUM_THREADS = int(os.getenv("FAIRFACE_NUM_THREADS", "0"))
+
+
+# Output labels of the multitask skin model
+SKIN_TYPE_LABELS = ["Normal", "Dry", "Oily"]
+SKIN_ISSUE_LABELS = ["Acne", "Redness", "Bags"]
+SKIN_ISSUE_THRESHOLD = 0.5
+
+# Output labels of the FairFace model
+RACE_CATEGORIES = ['White', 'Black', 'Latino_Hispanic', 'East Asian', 'Southeast Asian', 'Indian', 'Middle Eastern']
+GENDER_CATEGORIES = ['Male', 'Female']
+AGE_CATEGORIES = ['0-2', '3-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70+']
+
+
+def skin_results_from_predictions(type_pred, prob_pred):
+    """
+    Build the `skinType`/`skinIssues` part of the /analyze response from one
+    row of the skin model's outputs.
+    """
+    skin_type_idx = int(np.argmax(type_pred))
+    skin_issues = []
+    for i, label in enumerate(SKIN_ISSUE_LABELS):
+        if prob_pred[i] > SKIN_ISSUE_THRESHOLD:
+            skin_issues.append({
+                "name": label,
+                "confidence": float(prob_pred[i] * 100)
+            })
+    return {
+        "skinType": {
+            "type": SKIN_TYPE_LABELS[skin_type_idx],
+            "confidence": float(type_pred[skin_type_idx] * 100)
+        },
+        "skinIssues": skin_issues
+    }
+
+
+def demographics_from_logits(race_logits, gender_logits, age_logits):
+    """
+    Build one `demographics` dict per row of a batch of FairFace logits.
+    Only the top class and its softmax probability are needed, so the
+    probability is computed as 1 / sum(exp(logits - max)).
+    """
+    heads = []
+    for logits in (race_logits, gender_logits, age_logits):
+        logits = np.atleast_2d(np.asarray(logits, dtype=np.float64))
+        top = logits.argmax(axis=1)
+        confidence = 1.0 / np.exp(logits - logits.max(axis=1, keepdims=True)).sum(axis=1)
+        heads.append((top, confidence))
+
+    (race_idx, race_conf), (gender_idx, gender_conf), (age_idx, age_conf) = heads
+    return [
+        {
+            'race': RACE_CATEGORIES[race_idx[i]],
+            'gender': GENDER_CATEGORIES[gender_idx[i]],
+            'age': AGE_CATEGORIES[age_idx[i]],
+            'confidence': {
+                'race': float(race_conf[i]),
+                'gender': float(gender_conf[i]),
+                'age': float(age_conf[i])
+            }
+        }
+        for i in range(len(race_idx))
+    ]
+
+
+def find_skin_model_path():
+    for path in SKIN_MODEL_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def resize_face(face_img, out=None):
+    """
+    Resize a BGR face crop to the skin model's 224x224 input, into `out`
+    when given. Keeps cv2.resize's default bilinear interpolation, which the
+    skin model has always been fed. Crops already at that size are used as
+    they are.
+    """
+    size = FACE_INPUT_SIZE
+    if face_img.shape[:2] == (size, size):
+        if out is None:
+            return face_img
+        out[...] = face_img
+        return out
+    return cv2.resize(face_img, (size, size), dst=out)
+
+
+def skin_preprocess(face_img, out=None):
+    """
+    Resize a BGR face crop to the skin model's 224x224x3 float32 input,
+    normalizing straight into `out` when a preallocated buffer is given.
+    """
+    resized = resize_face(face_img)
+    if out is None:
+        out = np.empty((SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3), dtype=np.float32)
+    return np.divide(resized, np.float32(255.0), out=out)
+
+
+def fairface_preprocess(face_img, out=None):
+    """
+    Convert a BGR face crop into FairFace's normalized RGB 3x224x224 float32
+    input (the torchvision Resize -> ToTensor -> Normalize pipeline). The
+    resize stays on PIL's bilinear filter, as in torchvision: OpenCV's
+    resamplers differ from it by up to ~20 levels per pixel on downscaled
+    crops. Writes into `out` (3x224x224 or 1x3x224x224) when given,
+    otherwise returns a new 1x3x224x224 array.
+    """
+    size = FAIRFACE_INPUT_SIZE
+    # PIL resizes each channel on its own, so the crop can stay BGR until normalization
+    resized = np.asarray(Image.fromarray(np.ascontiguousarray(face_img)).resize((size, size), Image.BILINEAR))
+    if out is None:
+        out = np.empty((1, 3, size, size), dtype=np.float32)
+    chw = out.reshape(3, size, size)
+    for c in range(3):
+        # Channel c of the RGB output is channel 2 - c of the BGR input
+        np.multiply(resized[:, :, 2 - c], FAIRFACE_SCALE[c], out=chw[c], casting="unsafe")
+        chw[c] -= FAIRFACE_OFFSET[c]
+    return out
+
+
+def onnx_variant_path(path, variant):
+    """Return the file name of a precision variant of an exported ONNX model."""
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown MODEL_VARIANT: {variant}")
+    if variant == "fp32":
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{variant}{ext}"
+
+
+def _onnx_session(path, num_threads=0):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+class KerasSkinModel:
+    backend = "keras"
+
+    def __init__(self, path, num_threads=0):
+        import tensorflow as tf
+        from tensorflow.keras.models import load_model
+
+        if num_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        self.path = path
+        self.model = load_model(path)
+
+    def predict(self, batch):
+        type_pred, prob_pred = self.model.predict(np.asarray(batch, dtype=np.float32), verbose=0)
+        return type_pred, prob_pred
+
+
+class OnnxSkinModel:
+    backend = "onnx"
+
+    def __init__(self, path, num_threads=0):
+        self.path = path
+        self.session = _onnx_session(path, num_threads)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        type_pred, prob_pred = self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})
+        return type_pred, prob_pred
+
+
+class TorchFairFaceModel:
+    backend = "torch"
+
+    def __init__(self, path, num_threads=FAIRFACE_NUM_THREADS):
+        import torch
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.path = path
+        self.model = torch.load(path)
+        self.model.eval()
+
+    def predict(self, batch):
+        """Return the (race, gender, age) logits for a Nx3x224x224 batch."""
+        import torch
+
+        with torch.inference_mode():
+            outputs = self.model(torch.from_numpy(batch))
+            return [o.cpu().numpy() for o in outputs[:3]]
+
+
+class OnnxFairFaceModel:
+    backend = "onnx"
+
+    def __init__(self, path, num_threads=FAIRFACE_NUM_THREADS):
+        self.path = path
+        self.session = _onnx_session(path, num_threads)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[:3]
+
+
+def load_skin_model(backend=None, variant=None, num_threads=0):
+    """
+    Load the multitask skin model with the configured backend, or return None.
+    `num_threads` caps its intra-op threads (0 = library default).
+    """
+    backend = backend or SKIN_MODEL_BACKEND
+    variant = variant or MODEL_VARIANT
+    if backend == "onnx":
+        path = onnx_variant_path(SKIN_ONNX_MODEL_PATH, variant)
+        if not os.path.exists(path):
+            print(f"ONNX skin model not found at {path}")
+            return None
+        return OnnxSkinModel(path, num_threads)
+    if backend == "keras":
+        if variant != "fp32":
+            print(f"MODEL_VARIANT={variant} requires SKIN_MODEL_BACKEND=onnx, loading the FP32 Keras model")
+        path = find_skin_model_path()
+        if path is None:
+            print("Error: Could not find model file in any of the expected locations")
+            return None
+        return KerasSkinModel(path, num_threads)
+    raise ValueError(f"Unknown SKIN_MODEL_BACKEND: {backend}")
+
+
+def load_fairface_model(backend=None, variant=None, num_threads=FAIRFACE_NUM_THREADS):
+    """Load FairFace with the backend matching the skin model, or return None."""
+    backend = backend or SKIN_MODEL_BACKEND
+    variant = variant or MODEL_VARIANT
+    if backend == "onnx":
+        path = onnx_variant_path(FAIRFACE_ONNX_MODEL_PATH, variant)
+        if not os.path.exists(path):
+            print(f"ONNX FairFace model not found at {path}")
+            return None
+        return OnnxFairFaceModel(path, num_threads)
+    if backend == "keras":
+        if not os.path.exists(FAIRFACE_MODEL_PATH):
+            print(f"FairFace model not found at {FAIRFACE_MODEL_PATH}")
+            return None
+        return TorchFairFaceModel(FAIRFACE_MODEL_PATH, num_threads)
+    raise ValueError(f"Unknown SKIN_MODEL_BACKEND: {backend}")
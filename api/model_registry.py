@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+
+# "background" starts loading every model in parallel threads at startup,
+# "lazy" defers loading until a model is first requested
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background").lower()
+
+LOADING = "loading"
+PENDING = "pending"
+READY = "ready"
+UNAVAILABLE = "unavailable"
+FAILED = "failed"
+
+
+class _ModelEntry:
+    def __init__(self, name, loader, warmup, on_ready):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.on_ready = on_ready
+        self.model = None
+        self.state = PENDING
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.done = threading.Event()
+        self.thread = None
+
+
+class ModelRegistry:
+    """
+    Loads models off the request path and tracks their readiness.
+
+    Each registered model has a loader (returns the model, or None when it is
+    not available), an optional warm-up that runs a dummy inference so graph
+    compilation happens before real traffic, and an optional on_ready hook.
+    """
+
+    def __init__(self, mode=MODEL_LOADING):
+        self.mode = mode
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None, on_ready=None):
+        self._entries[name] = _ModelEntry(name, loader, warmup, on_ready)
+
+    def start(self):
+        """Start loading every registered model in parallel background threads."""
+        for name in self._entries:
+            self._start_loading(name)
+
+    def start_if_background(self):
+        if self.mode == "background":
+            self.start()
+
+    def get(self, name, wait=None):
+        """
+        Return a loaded model, or None if it is unavailable or still loading.
+        In lazy mode the first call triggers loading and (by default) waits for it.
+        """
+        entry = self._entries[name]
+        self._start_loading(name)
+        if wait is None:
+            wait = self.mode == "lazy"
+        if wait:
+            entry.done.wait()
+        return entry.model if entry.state == READY else None
+
+    def is_loaded(self, name):
+        """True once loading has finished, whether or not the model is available."""
+        return self._entries[name].done.is_set()
+
+    def is_ready(self):
+        return all(entry.done.is_set() for entry in self._entries.values())
+
+    def status(self):
+        return {
+            name: {
+                "state": entry.state,
+                "error": entry.error,
+                "loadSeconds": entry.load_seconds,
+                "warmupSeconds": entry.warmup_seconds,
+            }
+            for name, entry in self._entries.items()
+        }
+
+    def _start_loading(self, name):
+        entry = self._entries[name]
+        with self._lock:
+            if entry.state != PENDING:
+                return
+            entry.state = LOADING
+            entry.thread = threading.Thread(target=self._load, args=(entry,),
+                                            name=f"load-{name}", daemon=True)
+            entry.thread.start()
+
+    def _load(self, entry):
+        try:
+            started = time.perf_counter()
+            model = entry.loader()
+            entry.load_seconds = time.perf_counter() - started
+
+            if model is None:
+                entry.state = UNAVAILABLE
+                return
+
+            if entry.warmup is not None:
+                started = time.perf_counter()
+                entry.warmup(model)
+                entry.warmup_seconds = time.perf_counter() - started
+
+            if entry.on_ready is not None:
+                entry.on_ready(model)
+
+            entry.model = model
+            entry.state = READY
+            print(f"Model '{entry.name}' ready (load {entry.load_seconds:.2f}s, "
+                  f"warm-up {entry.warmup_seconds or 0:.2f}s)")
+        except Exception as e:
+            print(f"Error loading model '{entry.name}': {e}")
+            entry.error = str(e)
+            entry.state = FAILED
+        finally:
+            entry.done.set()
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import math
+import os
+import threading
+
+from analysis_cache import InProcessStore
+
+
+# Overridable to point at a local stub (e.g. for load tests)
+PLACES_NEARBY_URL = os.getenv("PLACES_NEARBY_URL", "https://maps.googleapis.com/maps/api/place/nearbysearch/json")
+
+PLACES_CACHE_ENABLED = os.getenv("PLACES_CACHE_ENABLED", "true").lower() == "true"
+PLACES_CACHE_TTL = int(os.getenv("PLACES_CACHE_TTL", str(24 * 3600)))
+PLACES_CACHE_MAX_ENTRIES = int(os.getenv("PLACES_CACHE_MAX_ENTRIES", "5000"))
+PLACES_CACHE_MAX_BYTES = int(os.getenv("PLACES_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Geohash precision of a tile: 6 is about 1.2 km x 0.6 km
+PLACES_CACHE_PRECISION = int(os.getenv("PLACES_CACHE_PRECISION", "6"))
+# Largest radius the Places nearbysearch API accepts
+PLACES_MAX_RADIUS = 50000
+
+EARTH_RADIUS_M = 6371008.8
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def geohash_encode(lat, lng, precision=PLACES_CACHE_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (lng, lng_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash):
+    """(min_lat, min_lng, max_lat, max_lng) of a geohash cell."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lng_range if even else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if value >> shift & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def filter_places(data, lat, lng, radius):
+    """Copy of a nearbysearch payload keeping only places within `radius` metres of (lat, lng)."""
+    results = []
+    for place in data.get("results", []):
+        location = place.get("geometry", {}).get("location", {})
+        if "lat" in location and "lng" in location and \
+                haversine_m(lat, lng, location["lat"], location["lng"]) <= radius:
+            results.append(place)
+    # A page token belongs to the upstream query, not to this filtered view
+    filtered = {key: value for key, value in data.items() if key != "next_page_token"}
+    filtered["results"] = results
+    return filtered
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PlacesCache:
+    """
+    Geo-tile cache for Places nearbysearch calls.
+
+    Requests are snapped to a geohash tile and cached on (tile, radius, type,
+    keyword). On a miss the upstream search is centred on the tile with the
+    radius widened by the tile's half-diagonal, so it covers the radius around
+    any point in the tile; every caller then gets those places filtered by
+    true haversine distance from its own location. Concurrent misses for the
+    same key share one upstream call (single-flight). `on_fetch(tile, radius,
+    place_type, keyword, data)` is called with every successful tile search.
+    """
+
+    def __init__(self, client, api_key, ttl=PLACES_CACHE_TTL, precision=PLACES_CACHE_PRECISION,
+                 store=None, enabled=PLACES_CACHE_ENABLED, on_fetch=None):
+        self.client = client
+        self.api_key = api_key
+        self.ttl = ttl
+        self.precision = precision
+        self.enabled = enabled
+        self.on_fetch = on_fetch
+        self.store = store if store is not None else InProcessStore(PLACES_CACHE_MAX_ENTRIES, PLACES_CACHE_MAX_BYTES)
+        self._flights = {}
+        self._async_flights = {}  # key -> asyncio task, used on the ASGI event loop
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "misses": 0, "shared": 0, "upstreamCalls": 0, "errors": 0}
+
+    def nearby_search(self, lat, lng, radius=5000, place_type=None, keyword=None):
+        """
+        Places within `radius` metres of (lat, lng). Returns
+        (upstream status code, payload or None, "HIT" | "MISS" | "SHARED" | "BYPASS").
+        """
+        lat, lng, radius = float(lat), float(lng), int(float(radius))
+        if not self.enabled:
+            status_code, data = self._fetch(lat, lng, radius, place_type, keyword)
+            return status_code, data, "BYPASS"
+
+        tile, key = self._tile_key(lat, lng, radius, place_type, keyword)
+        cached = self._cached(key, lat, lng, radius)
+        if cached is not None:
+            return 200, cached, "HIT"
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            self._count("shared")
+            if flight.error is not None:
+                raise flight.error
+            return self._filtered(flight.result, lat, lng, radius, "SHARED")
+
+        self._count("misses")
+        try:
+            center_lat, center_lng, fetch_radius = self._tile_search(tile, radius)
+            flight.result = self._fetch(center_lat, center_lng, fetch_radius, place_type, keyword)
+            self._store(tile, key, radius, place_type, keyword, *flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.done.set()
+            with self._lock:
+                self._flights.pop(key, None)
+        return self._filtered(flight.result, lat, lng, radius, "MISS")
+
+    async def nearby_search_async(self, client, lat, lng, radius=5000, place_type=None, keyword=None):
+        """
+        nearby_search for the ASGI server, through an AsyncUpstreamClient.
+        Concurrent misses on the event loop share one upstream call; they do
+        not join flights started by worker threads.
+        """
+        lat, lng, radius = float(lat), float(lng), int(float(radius))
+        if not self.enabled:
+            status_code, data = await self._fetch_async(client, lat, lng, radius, place_type, keyword)
+            return status_code, data, "BYPASS"
+
+        tile, key = self._tile_key(lat, lng, radius, place_type, keyword)
+        cached = self._cached(key, lat, lng, radius)
+        if cached is not None:
+            return 200, cached, "HIT"
+
+        # The fetch runs as its own task, so a leader whose client goes away
+        # does not cancel it for the followers
+        flight = self._async_flights.get(key)
+        if flight is None:
+            self._count("misses")
+            cache_status = "MISS"
+            flight = self._async_flights[key] = asyncio.ensure_future(
+                self._lead_async(client, tile, key, radius, place_type, keyword))
+        else:
+            self._count("shared")
+            cache_status = "SHARED"
+        return self._filtered(await asyncio.shield(flight), lat, lng, radius, cache_status)
+
+    async def _lead_async(self, client, tile, key, radius, place_type, keyword):
+        try:
+            center_lat, center_lng, fetch_radius = self._tile_search(tile, radius)
+            result = await self._fetch_async(client, center_lat, center_lng, fetch_radius, place_type, keyword)
+            # The fetch hook may write to disk (places index), so it runs off the event loop
+            await asyncio.to_thread(self._store, tile, key, radius, place_type, keyword, *result)
+            return result
+        finally:
+            self._async_flights.pop(key, None)
+
+    def _tile_key(self, lat, lng, radius, place_type, keyword):
+        tile = geohash_encode(lat, lng, self.precision)
+        return tile, f"{tile}:{radius}:{place_type or ''}:{keyword or ''}"
+
+    def _cached(self, key, lat, lng, radius):
+        self._count("lookups")
+        cached = self.store.get(key)
+        if cached is None:
+            return None
+        self._count("hits")
+        return filter_places(json.loads(cached), lat, lng, radius)
+
+    @staticmethod
+    def _tile_search(tile, radius):
+        """Centre of the tile and a radius covering `radius` around any point in it."""
+        min_lat, min_lng, max_lat, max_lng = geohash_bounds(tile)
+        center_lat, center_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+        half_diagonal = haversine_m(center_lat, center_lng, max_lat, max_lng)
+        return center_lat, center_lng, min(PLACES_MAX_RADIUS, int(math.ceil(radius + half_diagonal)))
+
+    def _store(self, tile, key, radius, place_type, keyword, status_code, data):
+        if status_code != 200 or data.get("status") not in ("OK", "ZERO_RESULTS"):
+            return
+        self.store.set(key, json.dumps(data), self.ttl)
+        if self.on_fetch is not None:
+            try:
+                self.on_fetch(tile, radius, place_type, keyword, data)
+            except Exception as e:
+                print(f"Error in places fetch hook: {e}")
+
+    @staticmethod
+    def _filtered(result, lat, lng, radius, cache_status):
+        status_code, data = result
+        if status_code != 200:
+            return status_code, None, cache_status
+        return status_code, filter_places(data, lat, lng, radius), cache_status
+
+    def _params(self, lat, lng, radius, place_type, keyword):
+        params = {"location": f"{lat},{lng}", "radius": radius, "key": self.api_key}
+        if place_type:
+            params["type"] = place_type
+        if keyword:
+            params["keyword"] = keyword
+        self._count("upstreamCalls")
+        return params
+
+    def _fetch(self, lat, lng, radius, place_type, keyword):
+        params = self._params(lat, lng, radius, place_type, keyword)
+        try:
+            response = self.client.get(PLACES_NEARBY_URL, params=params)
+        except Exception:
+            self._count("errors")
+            raise
+        if response.status_code != 200:
+            self._count("errors")
+            return response.status_code, None
+        return response.status_code, response.json()
+
+    async def _fetch_async(self, client, lat, lng, radius, place_type, keyword):
+        params = self._params(lat, lng, radius, place_type, keyword)
+        try:
+            response = await client.get(PLACES_NEARBY_URL, params=params)
+        except Exception:
+            self._count("errors")
+            raise
+        if response.status_code != 200:
+            self._count("errors")
+            return response.status_code, None
+        return response.status_code, response.json()
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+        served = counters["hits"] + counters["shared"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "hitRate": counters["hits"] / counters["lookups"] if counters["lookups"] else 0.0,
+            "upstreamCallsSaved": served,
+            "store": self.store.stats(),
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
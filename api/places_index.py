@@ -0,0 +1,327 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from places_cache import PLACES_CACHE_PRECISION, geohash_bounds, geohash_encode, haversine_m
+
+
+PLACES_INDEX_ENABLED = os.getenv("PLACES_INDEX_ENABLED", "true").lower() == "true"
+PLACES_INDEX_PATH = os.getenv("PLACES_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "data", "places.sqlite3"))
+# An area's coverage is stale (and goes upstream again) after this long
+PLACES_INDEX_MAX_AGE = int(os.getenv("PLACES_INDEX_MAX_AGE", str(7 * 24 * 3600)))
+# Grid cell size in degrees (0.01 is about 1.1 km north-south)
+PLACES_INDEX_CELL_DEGREES = float(os.getenv("PLACES_INDEX_CELL_DEGREES", "0.01"))
+
+METERS_PER_DEGREE = 111320.0
+# Places nearbysearch returns at most this many results per page
+PLACES_PAGE_SIZE = 20
+
+# Store categories recognized from the place name
+STORE_CATEGORIES = {
+    "luxury": ["sephora", "nordstrom", "bloomingdale", "neiman marcus", "ulta"],
+    "drugstore": ["cvs", "walgreens", "rite aid", "target", "walmart"],
+    "specialty": ["lush", "the body shop", "kiehl", "bath & body", "l'occitane"]
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT PRIMARY KEY,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    category TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS place_queries (
+    place_id TEXT NOT NULL,
+    query TEXT NOT NULL,
+    PRIMARY KEY (query, place_id)
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    query TEXT NOT NULL,
+    tile TEXT NOT NULL,
+    radius INTEGER NOT NULL,
+    covered_at REAL NOT NULL,
+    PRIMARY KEY (query, tile)
+);
+"""
+
+
+def classify_store(name):
+    """luxury / drugstore / specialty / other, from the store name."""
+    store_name = (name or "").lower()
+    for category, keywords in STORE_CATEGORIES.items():
+        if any(keyword in store_name for keyword in keywords):
+            return category
+    return "other"
+
+
+def query_key(place_type, keyword):
+    """Places are indexed under the (type, keyword) searches that returned them."""
+    return f"{place_type or ''}:{keyword or ''}"
+
+
+class IndexedPlace:
+    __slots__ = ("place_id", "lat", "lng", "category", "data", "queries")
+
+    def __init__(self, place_id, lat, lng, category, data):
+        self.place_id = place_id
+        self.lat = lat
+        self.lng = lng
+        self.category = category
+        self.data = data
+        self.queries = set()
+
+
+class PlacesIndex:
+    """
+    Local index of places seen in past Places responses (or bulk imports).
+
+    Places are persisted in SQLite and held in memory in a lat/lng grid of
+    PLACES_INDEX_CELL_DEGREES cells, which answers radius and k-nearest
+    queries (optionally filtered by search and store category) without
+    going upstream. Coverage is tracked per (search, geohash tile): an area
+    is served from the index only while its coverage is fresh.
+    """
+
+    def __init__(self, path=PLACES_INDEX_PATH, max_age=PLACES_INDEX_MAX_AGE,
+                 cell_degrees=PLACES_INDEX_CELL_DEGREES, precision=PLACES_CACHE_PRECISION,
+                 enabled=PLACES_INDEX_ENABLED):
+        self.path = path
+        self.max_age = max_age
+        self.cell_degrees = cell_degrees
+        self.precision = precision
+        self.enabled = enabled
+        self._places = {}
+        self._grid = {}
+        self._coverage = {}  # (query, tile) -> (radius, covered_at)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._counters = {"queries": 0, "covered": 0, "stale": 0, "ingested": 0, "truncated": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        self._load(connection)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _load(self, connection):
+        for place_id, lat, lng, category, data in connection.execute(
+                "SELECT place_id, lat, lng, category, data FROM places"):
+            self._insert(IndexedPlace(place_id, lat, lng, category, json.loads(data)))
+        for place_id, query in connection.execute("SELECT place_id, query FROM place_queries"):
+            if place_id in self._places:
+                self._places[place_id].queries.add(query)
+        for query, tile, radius, covered_at in connection.execute(
+                "SELECT query, tile, radius, covered_at FROM coverage"):
+            self._coverage[(query, tile)] = (radius, covered_at)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def _insert(self, place):
+        previous = self._places.get(place.place_id)
+        if previous is not None:
+            place.queries |= previous.queries
+            cell = self._grid.get(self._cell(previous.lat, previous.lng))
+            if cell is not None:
+                cell.remove(previous)
+        self._places[place.place_id] = place
+        self._grid.setdefault(self._cell(place.lat, place.lng), []).append(place)
+
+    def add_places(self, places, place_type=None, keyword=None):
+        """Add or refresh places (Places API result objects) found by a (type, keyword) search."""
+        query = query_key(place_type, keyword)
+        now = time.time()
+        rows = []
+        with self._lock:
+            for data in places:
+                location = data.get("geometry", {}).get("location", {})
+                if not data.get("place_id") or "lat" not in location or "lng" not in location:
+                    continue
+                place = IndexedPlace(data["place_id"], float(location["lat"]), float(location["lng"]),
+                                     classify_store(data.get("name")), data)
+                place.queries.add(query)
+                self._insert(place)
+                rows.append(place)
+            self._counters["ingested"] += len(rows)
+
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO places (place_id, lat, lng, category, data, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(p.place_id, p.lat, p.lng, p.category, json.dumps(p.data), now) for p in rows])
+            connection.executemany(
+                "INSERT OR IGNORE INTO place_queries (place_id, query) VALUES (?, ?)",
+                [(p.place_id, query) for p in rows])
+        return len(rows)
+
+    def mark_covered(self, tile, radius, place_type=None, keyword=None):
+        """Record that a search covered `radius` metres around every point of a geohash tile."""
+        query = query_key(place_type, keyword)
+        now = time.time()
+        with self._lock:
+            self._coverage[(query, tile)] = (radius, now)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO coverage (query, tile, radius, covered_at) VALUES (?, ?, ?, ?)",
+                (query, tile, radius, now))
+
+    def ingest_search(self, tile, radius, place_type, keyword, data):
+        """
+        PlacesCache fetch hook: index an upstream tile search and mark the tile
+        covered. A full page (or one with a next_page_token) may have left out
+        places, so the tile stays uncovered and its searches keep going
+        through PlacesCache.
+        """
+        results = data.get("results", [])
+        self.add_places(results, place_type, keyword)
+        if len(results) >= PLACES_PAGE_SIZE or data.get("next_page_token"):
+            with self._lock:
+                self._counters["truncated"] += 1
+            return
+        self.mark_covered(tile, radius, place_type, keyword)
+
+    def is_covered(self, lat, lng, radius, place_type=None, keyword=None):
+        """True if a fresh search covered `radius` metres around (lat, lng)."""
+        if not self.enabled:
+            return False
+        tile = geohash_encode(float(lat), float(lng), self.precision)
+        with self._lock:
+            self._counters["queries"] += 1
+            coverage = self._coverage.get((query_key(place_type, keyword), tile))
+            covered = coverage is not None and coverage[0] >= radius and time.time() - coverage[1] < self.max_age
+            self._counters["covered" if covered else "stale"] += 1
+        return covered
+
+    def _candidates(self, lat, lng, ring):
+        """Places in the square ring of cells `ring` cells away from (lat, lng)'s cell."""
+        row, col = self._cell(lat, lng)
+        for i in range(row - ring, row + ring + 1):
+            for j in range(col - ring, col + ring + 1):
+                if ring and abs(i - row) != ring and abs(j - col) != ring:
+                    continue
+                yield from self._grid.get((i, j), ())
+
+    def _matches(self, place, query, category):
+        return (query is None or query in place.queries) and (category is None or place.category == category)
+
+    def radius(self, lat, lng, radius, place_type=None, keyword=None, category=None, limit=None):
+        """Places within `radius` metres, nearest first, as (distance_m, place data) pairs."""
+        lat, lng = float(lat), float(lng)
+        query = query_key(place_type, keyword) if place_type or keyword else None
+        # Cells to scan: enough rings to cover the radius east-west at this latitude
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        rings = int(math.ceil(radius / (METERS_PER_DEGREE * cos_lat * self.cell_degrees)))
+        found = []
+        with self._lock:
+            for ring in range(rings + 1):
+                for place in self._candidates(lat, lng, ring):
+                    if not self._matches(place, query, category):
+                        continue
+                    distance = haversine_m(lat, lng, place.lat, place.lng)
+                    if distance <= radius:
+                        found.append((distance, place.data))
+        found.sort(key=lambda item: item[0])
+        return found[:limit] if limit else found
+
+    def nearest(self, lat, lng, k=10, place_type=None, keyword=None, category=None, max_radius=50000):
+        """The k nearest places within `max_radius` metres, as (distance_m, place data) pairs."""
+        lat, lng = float(lat), float(lng)
+        query = query_key(place_type, keyword) if place_type or keyword else None
+        # Every place in ring r is at least (r - 1) cells away north-south
+        cell_m = METERS_PER_DEGREE * self.cell_degrees
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        max_rings = int(math.ceil(max_radius / (cell_m * cos_lat)))
+        heap = []  # max-heap of the k best as (-distance, tiebreak, data)
+        with self._lock:
+            for ring in range(max_rings + 1):
+                if len(heap) >= k and (ring - 1) * cell_m * cos_lat > -heap[0][0]:
+                    break
+                for place in self._candidates(lat, lng, ring):
+                    if not self._matches(place, query, category):
+                        continue
+                    distance = haversine_m(lat, lng, place.lat, place.lng)
+                    if distance > max_radius:
+                        continue
+                    item = (-distance, id(place), place.data)
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, item)
+        return [(-d, data) for d, _, data in sorted(heap, reverse=True)]
+
+    def metrics(self):
+        with self._lock:
+            return {"enabled": self.enabled, **self._counters, "places": len(self._places),
+                    "coveredTiles": len(self._coverage)}
+
+
+def import_file(index, path, place_type=None, keyword=None, radius=None):
+    """
+    Bulk-import places from a JSON file holding a nearbysearch payload, a list
+    of payloads or a list of place objects. With `radius`, every geohash tile
+    in the imported places' bounding box is marked covered for that radius.
+    """
+    with open(path, encoding="utf-8") as f:
+        content = json.load(f)
+    payloads = content if isinstance(content, list) else [content]
+    places = []
+    for item in payloads:
+        places.extend(item.get("results", []) if "results" in item else [item])
+    count = index.add_places(places, place_type, keyword)
+
+    if radius and places:
+        lats = [p["geometry"]["location"]["lat"] for p in places if p.get("geometry", {}).get("location")]
+        lngs = [p["geometry"]["location"]["lng"] for p in places if p.get("geometry", {}).get("location")]
+        tiles = set()
+        min_lat, min_lng, max_lat, max_lng = geohash_bounds(geohash_encode(min(lats), min(lngs), index.precision))
+        step_lat, step_lng = max_lat - min_lat, max_lng - min_lng
+        lat = min(lats)
+        while lat <= max(lats) + step_lat:
+            lng = min(lngs)
+            while lng <= max(lngs) + step_lng:
+                tiles.add(geohash_encode(min(lat, max(lats)), min(lng, max(lngs)), index.precision))
+                lng += step_lng
+            lat += step_lat
+        for tile in tiles:
+            index.mark_covered(tile, radius, place_type, keyword)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import places into the local places index")
+    parser.add_argument("files", nargs="+", help="JSON files with Places nearbysearch payloads or place objects")
+    parser.add_argument("--db", default=PLACES_INDEX_PATH)
+    parser.add_argument("--type", dest="place_type", default="store", help="Places type the import stands for")
+    parser.add_argument("--keyword", default=None, help="Places keyword the import stands for")
+    parser.add_argument("--covered-radius", type=int, default=None,
+                        help="mark the imported area covered for searches up to this radius (metres)")
+    args = parser.parse_args()
+
+    index = PlacesIndex(args.db)
+    for path in args.files:
+        count = import_file(index, path, args.place_type, args.keyword, args.covered_radius)
+        print(f"Imported {count} places from {path}")
+    print(index.metrics())
+
+
+if __name__ == "__main__":
+    main()
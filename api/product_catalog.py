@@ -0,0 +1,129 @@
+import json
+import os
+
+
+PRODUCT_CATALOG_PATH = os.getenv(
+    "PRODUCT_CATALOG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "drugstore_products.json"))
+
+# Skin type whose products are served for unknown skin types
+DEFAULT_SKIN_TYPE = "normal"
+
+
+def price_band(price):
+    """Budget / Moderate / Premium, with the same cut-offs as the product endpoints."""
+    try:
+        price_value = float(price)
+    except (TypeError, ValueError):
+        price_value = 0
+    if price_value < 10:
+        return "Budget"
+    if price_value < 25:
+        return "Moderate"
+    return "Premium"
+
+
+class ProductRecord:
+    """One catalog entry. `to_dict` returns a fresh dict, so callers may mutate it."""
+
+    __slots__ = ("id", "name", "brand", "price", "currency", "link", "image_url", "description",
+                 "for_skin_type", "for_skin_issues", "target_gender", "price_band")
+
+    def __init__(self, product_id, product):
+        self.id = product_id
+        self.name = product["name"]
+        self.brand = product["brand"]
+        self.price = product["price"]
+        self.currency = product["currency"]
+        self.link = product["link"]
+        self.image_url = product["imageUrl"]
+        self.description = product["description"]
+        self.for_skin_type = tuple(product["forSkinType"])
+        self.for_skin_issues = tuple(product["forSkinIssues"]) if "forSkinIssues" in product else None
+        self.target_gender = product["targetGender"]
+        self.price_band = price_band(self.price)
+
+    def to_dict(self):
+        product = {
+            "name": self.name,
+            "brand": self.brand,
+            "price": self.price,
+            "currency": self.currency,
+            "link": self.link,
+            "imageUrl": self.image_url,
+            "description": self.description,
+            "forSkinType": list(self.for_skin_type),
+        }
+        if self.for_skin_issues is not None:
+            product["forSkinIssues"] = list(self.for_skin_issues)
+        product["targetGender"] = self.target_gender
+        return product
+
+
+class ProductCatalog:
+    """
+    Drugstore products loaded once from the data file, with inverted indexes
+    from skin type, skin issue, gender and price band to product ids.
+
+    Ids follow the data file order, so sorting a result set by id gives the
+    curated ranking within a skin type.
+    """
+
+    def __init__(self, path=PRODUCT_CATALOG_PATH):
+        with open(path, encoding="utf-8") as f:
+            products_by_skin_type = json.load(f)
+
+        self.records = []
+        self.by_skin_type = {}
+        self.by_skin_issue = {}
+        self.by_gender = {}
+        self.by_price_band = {}
+        for skin_type, products in products_by_skin_type.items():
+            ids = self.by_skin_type.setdefault(skin_type, set())
+            for product in products:
+                record = ProductRecord(len(self.records), product)
+                self.records.append(record)
+                ids.add(record.id)
+                for issue in record.for_skin_issues or ():
+                    self.by_skin_issue.setdefault(issue, set()).add(record.id)
+                self.by_gender.setdefault(record.target_gender, set()).add(record.id)
+                self.by_price_band.setdefault(record.price_band, set()).add(record.id)
+
+    def find(self, skin_type, skin_issues, gender="All", max_products=3, price_band=None):
+        """
+        Products for a skin type (falling back to the default skin type), for
+        the gender, those matching any of the skin issues ranked first.
+        """
+        ids = self.by_skin_type.get(skin_type.lower())
+        if ids is None:
+            ids = self.by_skin_type[DEFAULT_SKIN_TYPE]
+
+        # Filter by gender if specified and not "All"
+        if gender and gender != "All":
+            ids = ids & (self.by_gender.get("All", set()) | self.by_gender.get(gender, set()))
+        if price_band is not None:
+            ids = ids & self.by_price_band.get(price_band, set())
+
+        ranked = []
+        if skin_issues:
+            issue_ids = set()
+            for issue in skin_issues:
+                issue_ids |= self.by_skin_issue.get(issue.capitalize(), set())
+            matched = ids & issue_ids
+            if matched:
+                ranked = sorted(matched)
+                ids = ids - matched
+        ranked.extend(sorted(ids))
+
+        return [self.records[i].to_dict() for i in ranked[:max_products]]
+
+
+_catalog = None
+
+
+def get_catalog():
+    """The process-wide catalog, loaded on first use."""
+    global _catalog
+    if _catalog is None:
+        _catalog = ProductCatalog()
+    return _catalog
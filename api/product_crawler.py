@@ -0,0 +1,146 @@
+import argparse
+import os
+import threading
+import time
+
+from product_store import ProductStore
+from retailer_scrapers import RETAILERS
+from scrape_orchestrator import ScrapeOrchestrator
+
+
+# "off" leaves crawling to a single scheduled `python product_crawler.py`
+# (e.g. cron); "thread" crawls from a daemon thread inside the API process,
+# which with several server workers means one crawler per worker, so only
+# enable it for single-process deployments
+PRODUCT_CRAWLER = os.getenv("PRODUCT_CRAWLER", "off").lower()
+# Re-crawl each retailer x skin type x skin issue combination this often
+PRODUCT_CRAWL_INTERVAL = int(os.getenv("PRODUCT_CRAWL_INTERVAL", str(12 * 3600)))
+PRODUCT_CRAWL_MAX_PRODUCTS = int(os.getenv("PRODUCT_CRAWL_MAX_PRODUCTS", "10"))
+# Deadline for scraping one skin type x skin issue from every retailer
+PRODUCT_CRAWL_DEADLINE_SECONDS = float(os.getenv("PRODUCT_CRAWL_DEADLINE_SECONDS", "30"))
+# How often the crawler thread wakes up to look for stale combinations
+PRODUCT_CRAWL_POLL_SECONDS = int(os.getenv("PRODUCT_CRAWL_POLL_SECONDS", "600"))
+
+
+def crawl_combinations(retailers=None):
+    """Every (retailer, skin type, skin issue) to crawl; a None issue is the skin-type listing."""
+    for retailer in retailers or list(RETAILERS):
+        spec = RETAILERS[retailer]
+        for skin_type in spec["skin_type_map"]:
+            yield retailer, skin_type, None
+            for skin_issue in spec["skin_issue_map"]:
+                yield retailer, skin_type, skin_issue
+
+
+def crawl_groups(retailers=None):
+    """crawl_combinations grouped as {(skin type, skin issue): [retailers]}."""
+    groups = {}
+    for retailer, skin_type, skin_issue in crawl_combinations(retailers):
+        groups.setdefault((skin_type, skin_issue), []).append(retailer)
+    return groups
+
+
+class ProductCrawler:
+    """
+    Walks every retailer x skin type x skin issue combination and writes the
+    products into the ProductStore, so requests never scrape live. Each skin
+    type x skin issue is scraped from all its stale retailers at once by the
+    ScrapeOrchestrator (one deadline, paced by the per-host rate limiter).
+    """
+
+    def __init__(self, store, interval=PRODUCT_CRAWL_INTERVAL, max_products=PRODUCT_CRAWL_MAX_PRODUCTS,
+                 mode=PRODUCT_CRAWLER, orchestrator=None):
+        self.store = store
+        self.interval = interval
+        self.max_products = max_products
+        self.mode = mode
+        # Created on the first crawl, so an API process with the crawler off starts no scrape pool
+        self.orchestrator = orchestrator
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {"runs": 0, "crawled": 0, "empty": 0, "products": 0}
+        self._last_run = None
+
+    def crawl_once(self, force=False):
+        """Crawl every combination not crawled within the interval. Returns how many were crawled."""
+        if self.orchestrator is None:
+            self.orchestrator = ScrapeOrchestrator(deadline=PRODUCT_CRAWL_DEADLINE_SECONDS)
+        crawled = 0
+        for (skin_type, skin_issue), retailers in crawl_groups().items():
+            if self._stop.is_set():
+                break
+            stale = [retailer for retailer in retailers if force or self._stale(retailer, skin_type, skin_issue)]
+            if not stale:
+                continue
+
+            scraped = self.orchestrator.scrape(skin_type, [skin_issue] if skin_issue else [],
+                                               max_products=self.max_products, retailers=stale)
+            for retailer in stale:
+                products = scraped.get(retailer)
+                crawled += 1
+                # Keep the previous products (and retry next round) when a page yields nothing
+                if not products:
+                    self._count("empty")
+                    continue
+                self.store.save_crawl(retailer, skin_type, skin_issue, products)
+                with self._lock:
+                    self._counters["crawled"] += 1
+                    self._counters["products"] += len(products)
+
+        with self._lock:
+            self._counters["runs"] += 1
+            self._last_run = time.time()
+        return crawled
+
+    def _stale(self, retailer, skin_type, skin_issue):
+        last = self.store.last_crawled(retailer, skin_type, skin_issue)
+        return last is None or time.time() - last >= self.interval
+
+    def start_if_enabled(self):
+        if self.mode == "thread":
+            self.start()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="product-crawler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                crawled = self.crawl_once()
+                if crawled:
+                    print(f"Product crawler refreshed {crawled} combinations")
+            except Exception as e:
+                print(f"Error in product crawler: {e}")
+            self._stop.wait(PRODUCT_CRAWL_POLL_SECONDS)
+
+    def metrics(self):
+        with self._lock:
+            return {"mode": self.mode, **self._counters, "lastRun": self._last_run, "store": self.store.stats(),
+                    "scraper": self.orchestrator.metrics() if self.orchestrator else None}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl retailer products into the local product store")
+    parser.add_argument("--db", default=None, help="SQLite path (default: PRODUCT_STORE_PATH)")
+    parser.add_argument("--force", action="store_true", help="re-crawl combinations that are still fresh")
+    args = parser.parse_args()
+
+    store = ProductStore(args.db) if args.db else ProductStore()
+    crawler = ProductCrawler(store, mode="off")
+    started = time.perf_counter()
+    crawled = crawler.crawl_once(force=args.force)
+    print(f"Crawled {crawled} combinations in {time.perf_counter() - started:.1f}s: {crawler.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Relative to this module, not to the directory the server was started from
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+PRODUCT_STORE_PATH = os.getenv("PRODUCT_STORE_PATH", os.path.join(DATA_DIR, "products.sqlite3"))
+# Products not seen by a crawl for this long are no longer served
+PRODUCT_STORE_MAX_AGE = int(os.getenv("PRODUCT_STORE_MAX_AGE", str(14 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_key TEXT PRIMARY KEY,
+    retailer TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS product_tags (
+    product_key TEXT NOT NULL,
+    skin_type TEXT NOT NULL,
+    skin_issue TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (skin_type, skin_issue, product_key)
+);
+CREATE TABLE IF NOT EXISTS crawls (
+    retailer TEXT NOT NULL,
+    skin_type TEXT NOT NULL,
+    skin_issue TEXT NOT NULL,
+    crawled_at REAL NOT NULL,
+    products INTEGER NOT NULL,
+    PRIMARY KEY (retailer, skin_type, skin_issue)
+);
+"""
+
+
+def product_key(product):
+    """De-duplication key: brand + name, case-insensitive (same as the scrape merge)."""
+    return (product["brand"] + product["name"]).lower()
+
+
+class ProductStore:
+    """
+    Local SQLite catalog of crawled retailer products.
+
+    Products are de-duplicated on brand+name and tagged with every
+    (skin type, skin issue) crawl that found them; an empty skin issue means
+    the skin-type-only listing. Each thread gets its own connection.
+    """
+
+    def __init__(self, path=PRODUCT_STORE_PATH, max_age=PRODUCT_STORE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def save_crawl(self, retailer, skin_type, skin_issue, products):
+        """Upsert one crawl's products and record when the combination was crawled."""
+        now = time.time()
+        skin_type = skin_type.lower()
+        skin_issue = (skin_issue or "").lower()
+        connection = self._connection()
+        with connection:
+            for product in products:
+                key = product_key(product)
+                connection.execute(
+                    "INSERT INTO products (product_key, retailer, brand, name, data, first_seen, last_seen) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(product_key) DO UPDATE SET data = excluded.data, last_seen = excluded.last_seen",
+                    (key, retailer, product["brand"], product["name"], json.dumps(product), now, now))
+                connection.execute(
+                    "INSERT OR REPLACE INTO product_tags (product_key, skin_type, skin_issue, last_seen) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, skin_type, skin_issue, now))
+            connection.execute(
+                "INSERT OR REPLACE INTO crawls (retailer, skin_type, skin_issue, crawled_at, products) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (retailer, skin_type, skin_issue, now, len(products)))
+
+    def last_crawled(self, retailer, skin_type, skin_issue):
+        row = self._connection().execute(
+            "SELECT crawled_at FROM crawls WHERE retailer = ? AND skin_type = ? AND skin_issue = ?",
+            (retailer, skin_type.lower(), (skin_issue or "").lower())).fetchone()
+        return row[0] if row else None
+
+    def query(self, skin_type, skin_issues, max_products=12):
+        """
+        Products for a skin type, those tagged with one of the skin issues
+        first, then the skin-type listing; most recently seen first.
+        """
+        if not skin_type:
+            return []
+        issues = [issue.lower() for issue in (skin_issues or [])]
+        placeholders = ",".join("?" * (len(issues) + 1))
+        rows = self._connection().execute(
+            "SELECT p.data, MIN(CASE WHEN t.skin_issue = '' THEN 1 ELSE 0 END) AS rank, MAX(p.last_seen) AS seen "
+            "FROM product_tags t JOIN products p ON p.product_key = t.product_key "
+            f"WHERE t.skin_type = ? AND t.skin_issue IN ({placeholders}) AND t.last_seen >= ? "
+            "GROUP BY p.product_key ORDER BY rank, seen DESC LIMIT ?",
+            (skin_type.lower(), *issues, "", time.time() - self.max_age, max_products)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self):
+        connection = self._connection()
+        products = connection.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        crawls, last_crawl = connection.execute("SELECT COUNT(*), MAX(crawled_at) FROM crawls").fetchone()
+        return {"products": products, "crawledCombinations": crawls, "lastCrawl": last_crawl}
@@ -0,0 +1,194 @@
+"""
+Post-training quantization of the exported ONNX skin and FairFace models.
+
+Usage (from the api/ directory, after export_onnx.py):
+    python quantize_models.py face_crops/ --variants int8 int8-static fp16
+
+For every variant the pipeline:
+  1. builds a candidate model under models/candidates/ (dynamic INT8,
+     static INT8 calibrated on the face crops, or FP16),
+  2. runs the FP32 and candidate models on held-out face crops and reports
+     top-1 agreement for skin type, skin issues and demographics,
+  3. promotes the candidate next to the FP32 model (where MODEL_VARIANT
+     picks it up) only if every agreement is within --min-agreement.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import cv2
+import numpy as np
+
+from model_backends import (
+    FAIRFACE_ONNX_MODEL_PATH, SKIN_ISSUE_LABELS, SKIN_ISSUE_THRESHOLD, SKIN_ONNX_MODEL_PATH,
+    OnnxFairFaceModel, OnnxSkinModel, fairface_preprocess, onnx_variant_path, skin_preprocess,
+)
+
+QUANTIZED_VARIANTS = ("int8", "int8-static", "fp16")
+CANDIDATE_DIR = "models/candidates"
+DEFAULT_MIN_AGREEMENT = 0.98
+
+
+def load_face_crops(face_dir, limit=None):
+    faces = []
+    for name in sorted(os.listdir(face_dir)):
+        image = cv2.imread(os.path.join(face_dir, name), cv2.IMREAD_COLOR)
+        if image is not None:
+            faces.append(image)
+        if limit and len(faces) >= limit:
+            break
+    return faces
+
+
+class FaceCalibrationReader:
+    """Feeds preprocessed face crops to onnxruntime's static quantizer, one at a time."""
+
+    def __init__(self, input_name, batches):
+        self.input_name = input_name
+        self.batches = list(batches)
+        self._iter = iter(self.batches)
+
+    def get_next(self):
+        batch = next(self._iter, None)
+        return None if batch is None else {self.input_name: batch}
+
+    def rewind(self):
+        self._iter = iter(self.batches)
+
+
+def _input_name(model_path):
+    import onnxruntime as ort
+
+    return ort.InferenceSession(model_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+
+def build_variant(fp32_path, output_path, variant, calibration_batches):
+    """Write the `variant` of the FP32 model at `fp32_path` to `output_path`."""
+    if variant == "int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, output_path, weight_type=QuantType.QInt8)
+    elif variant == "int8-static":
+        from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+        reader = FaceCalibrationReader(_input_name(fp32_path), calibration_batches)
+        quantize_static(fp32_path, output_path, reader, quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    elif variant == "fp16":
+        import onnx
+        from onnxconverter_common import float16
+
+        model = float16.convert_float_to_float16(onnx.load(fp32_path), keep_io_types=True)
+        onnx.save(model, output_path)
+    else:
+        raise ValueError(f"Unknown quantized variant: {variant}")
+
+
+def skin_agreement(baseline, candidate, batch):
+    base_type, base_prob = baseline.predict(batch)
+    cand_type, cand_prob = candidate.predict(batch)
+    base_issues = base_prob > SKIN_ISSUE_THRESHOLD
+    cand_issues = cand_prob > SKIN_ISSUE_THRESHOLD
+    report = {
+        "skinType": float(np.mean(base_type.argmax(axis=1) == cand_type.argmax(axis=1))),
+        "skinIssues": float(np.mean(np.all(base_issues == cand_issues, axis=1))),
+    }
+    for i, label in enumerate(SKIN_ISSUE_LABELS):
+        report[f"skinIssues.{label}"] = float(np.mean(base_issues[:, i] == cand_issues[:, i]))
+    return report
+
+
+def fairface_agreement(baseline, candidate, batch):
+    base_outputs = baseline.predict(batch)
+    cand_outputs = candidate.predict(batch)
+    return {
+        f"demographics.{name}": float(np.mean(b.argmax(axis=1) == c.argmax(axis=1)))
+        for name, b, c in zip(("race", "gender", "age"), base_outputs, cand_outputs)
+    }
+
+
+MODELS = {
+    "skin": {
+        "path": SKIN_ONNX_MODEL_PATH,
+        "loader": OnnxSkinModel,
+        "preprocess": lambda face: skin_preprocess(face)[np.newaxis],
+        "agreement": skin_agreement,
+    },
+    "fairface": {
+        "path": FAIRFACE_ONNX_MODEL_PATH,
+        "loader": OnnxFairFaceModel,
+        "preprocess": fairface_preprocess,
+        "agreement": fairface_agreement,
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("face_dir", help="Directory of face crops used for calibration and evaluation")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--variants", nargs="+", choices=QUANTIZED_VARIANTS, default=["int8"])
+    parser.add_argument("--calibration-size", type=int, default=100)
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT)
+    parser.add_argument("--no-promote", action="store_true", help="Only build and report candidates")
+    parser.add_argument("--report", help="Write the agreement report as JSON to this file")
+    args = parser.parse_args()
+
+    faces = load_face_crops(args.face_dir)
+    if len(faces) < 2:
+        print(f"Need at least 2 face crops in {args.face_dir}, found {len(faces)}")
+        return 1
+
+    # Calibrate on the first part of the crops and evaluate on the rest
+    split = min(args.calibration_size, len(faces) // 2)
+    calibration_faces, eval_faces = faces[:split], faces[split:]
+    print(f"Calibration: {len(calibration_faces)} faces, evaluation: {len(eval_faces)} faces")
+
+    os.makedirs(CANDIDATE_DIR, exist_ok=True)
+    report = {}
+    for model_name in args.models:
+        spec = MODELS[model_name]
+        if not os.path.exists(spec["path"]):
+            print(f"{model_name}: FP32 ONNX model not found at {spec['path']} (run export_onnx.py first)")
+            continue
+
+        baseline = spec["loader"](spec["path"])
+        eval_batch = np.concatenate([spec["preprocess"](face) for face in eval_faces])
+        calibration_batches = [spec["preprocess"](face) for face in calibration_faces]
+
+        for variant in args.variants:
+            promoted_path = onnx_variant_path(spec["path"], variant)
+            candidate_path = os.path.join(CANDIDATE_DIR, os.path.basename(promoted_path))
+            build_variant(spec["path"], candidate_path, variant, calibration_batches)
+
+            agreement = spec["agreement"](baseline, spec["loader"](candidate_path), eval_batch)
+            passed = all(value >= args.min_agreement for value in agreement.values())
+            size_ratio = os.path.getsize(candidate_path) / os.path.getsize(spec["path"])
+
+            print(f"{model_name} [{variant}] size {size_ratio:.0%} of FP32, "
+                  f"{'PASS' if passed else 'FAIL'} (min agreement {args.min_agreement:.2%})")
+            for metric, value in agreement.items():
+                print(f"    {metric:<24} {value:.2%}")
+
+            promoted = passed and not args.no_promote
+            if promoted:
+                shutil.copyfile(candidate_path, promoted_path)
+                print(f"    promoted to {promoted_path}")
+
+            report[f"{model_name}:{variant}"] = {
+                "agreement": agreement,
+                "sizeRatio": size_ratio,
+                "passed": passed,
+                "promoted": promoted,
+            }
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if all(r["passed"] for r in report.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup
+import requests
+
+from http_client import get_client
+
+
+# Map skin types to Sephora search terms
+SEPHORA_SKIN_TYPE_MAP = {
+    "dry": "dry-skin",
+    "oily": "oily-skin",
+    "combination": "combination-skin",
+    "normal": "normal-skin",
+    "sensitive": "sensitive-skin"
+}
+
+# Map skin issues to Sephora search terms
+SEPHORA_SKIN_ISSUE_MAP = {
+    "acne": "acne-treatments",
+    "wrinkles": "anti-aging",
+    "dark spots": "dark-spots",
+    "redness": "redness",
+    "dullness": "dullness",
+    "pores": "pores",
+    "uneven texture": "uneven-texture",
+    "bags": "eye-bags"
+}
+
+# Map skin types to Ulta search terms
+ULTA_SKIN_TYPE_MAP = {
+    "dry": "dry-skin",
+    "oily": "oily-skin",
+    "combination": "combination-skin",
+    "normal": "normal-skin",
+    "sensitive": "sensitive-skin"
+}
+
+# Map skin issues to Ulta search terms
+ULTA_SKIN_ISSUE_MAP = {
+    "acne": "acne-treatment",
+    "wrinkles": "anti-aging",
+    "dark spots": "dark-spot-treatment",
+    "redness": "redness-treatment",
+    "dullness": "brightening",
+    "pores": "pore-treatment",
+    "bags": "eye-bags"
+}
+
+# Add user agent to avoid blocking
+SEPHORA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Referer": "https://www.sephora.com/",
+    "Connection": "keep-alive"
+}
+
+ULTA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Referer": "https://www.ulta.com/",
+    "Connection": "keep-alive"
+}
+
+
+def _make_product(name, brand, price, link, image_url, skin_type, skin_issues, gender):
+    # Create product object
+    product = {
+        "name": name,
+        "brand": brand,
+        "price": price,
+        "currency": "USD",
+        "link": link or "",
+        "imageUrl": image_url or "",
+        "description": f"{brand} {name} for {skin_type} skin",
+        "forSkinType": [skin_type.capitalize()],
+        "targetGender": gender
+    }
+
+    # Add skin issues to product
+    if skin_issues:
+        product["forSkinIssues"] = [issue.capitalize() for issue in skin_issues]
+    return product
+
+
+def sephora_urls(skin_type, skin_issues):
+    """Candidate Sephora URLs, in priority order."""
+    # Build search URL based on skin type
+    search_term = SEPHORA_SKIN_TYPE_MAP.get(skin_type.lower(), "skincare")
+
+    # Add the first skin issue if available
+    if skin_issues and len(skin_issues) > 0:
+        issue_term = SEPHORA_SKIN_ISSUE_MAP.get(skin_issues[0].lower(), "")
+        if issue_term:
+            search_term = f"{search_term}-{issue_term}"
+
+    return [f"https://www.sephora.com/shop/{search_term}"]
+
+
+def parse_sephora_products(html, skin_type, skin_issues, gender="All", max_products=5):
+    """
+    Parse products from a Sephora listing page. Returns None when the page has
+    no recognizable product elements, otherwise the (possibly empty) list.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Find product containers - try multiple possible selectors
+    product_elements = []
+    for selector in ['.css-12egk0t', '.css-foh744', '.css-1qe8tjm', 'div[data-comp="ProductItem"]']:
+        product_elements = soup.select(selector)
+        if product_elements:
+            print(f"Found {len(product_elements)} products with selector: {selector}")
+            break
+
+    if not product_elements:
+        print("Could not find product elements on Sephora page")
+        return None
+
+    products = []
+    for element in product_elements[:max_products]:
+        try:
+            # Try multiple selectors for each element
+            name = None
+            brand = None
+            price = None
+            image_url = None
+            link = None
+
+            # Name selectors
+            for name_selector in ['.css-ktoumz', '.css-mwngx', 'span[data-at="sku_item_name"]']:
+                name_elem = element.select_one(name_selector)
+                if name_elem:
+                    name = name_elem.text.strip()
+                    break
+
+            # Brand selectors
+            for brand_selector in ['.css-10agpv6', '.css-oiczf', 'span[data-at="sku_item_brand"]']:
+                brand_elem = element.select_one(brand_selector)
+                if brand_elem:
+                    brand = brand_elem.text.strip()
+                    break
+
+            # Price selectors
+            for price_selector in ['.css-0', '.css-19gsknt', 'span[data-at="sku_item_price"]']:
+                price_elem = element.select_one(price_selector)
+                if price_elem:
+                    price = price_elem.text.strip().replace('$', '')
+                    break
+
+            # Image selectors
+            for img_selector in ['img', '.css-1l2x4ru img']:
+                image_elem = element.select_one(img_selector)
+                if image_elem and image_elem.get('src'):
+                    image_url = image_elem.get('src')
+                    break
+
+            # Link selectors
+            for link_selector in ['a', '.css-1l2x4ru a']:
+                link_elem = element.select_one(link_selector)
+                if link_elem and link_elem.get('href'):
+                    link = f"https://www.sephora.com{link_elem.get('href')}"
+                    break
+
+            if name and price:
+                brand = brand or "Sephora Collection"
+                products.append(_make_product(name, brand, price, link, image_url, skin_type, skin_issues, gender))
+
+                # Limit to max_products
+                if len(products) >= max_products:
+                    break
+        except Exception as e:
+            print(f"Error processing product element: {e}")
+            continue
+
+    return products
+
+
+def ulta_urls(skin_type, skin_issues):
+    """Candidate Ulta URLs, in priority order."""
+    # Build search URL based on skin type
+    search_term = ULTA_SKIN_TYPE_MAP.get(skin_type.lower(), "skincare")
+
+    # Try issue-specific search if available
+    issue_term = ""
+    if skin_issues and len(skin_issues) > 0:
+        issue_term = ULTA_SKIN_ISSUE_MAP.get(skin_issues[0].lower(), "")
+
+    # Create multiple possible URLs to try
+    urls_to_try = []
+
+    if issue_term:
+        urls_to_try.append(f"https://www.ulta.com/skin-care-{issue_term}?N=1z12lx1Z2796")
+        urls_to_try.append(f"https://www.ulta.com/shop/skin-care/{issue_term}")
+
+    urls_to_try.append(f"https://www.ulta.com/skin-care-{search_term}?N=1z12lx1Z2796")
+    urls_to_try.append(f"https://www.ulta.com/shop/skin-care/{search_term}")
+    urls_to_try.append("https://www.ulta.com/shop/skin-care")
+    return urls_to_try
+
+
+def parse_ulta_products(html, skin_type, skin_issues, gender="All", max_products=5):
+    """
+    Parse products from an Ulta listing page. Returns None when the page has
+    no recognizable product elements, otherwise the (possibly empty) list.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Find product containers - try multiple possible selectors
+    product_elements = []
+    for selector in ['.ProductCard', '.ProductCard__Content', '.ProductTile', 'div[class*="ProductCard"]']:
+        product_elements = soup.select(selector)
+        if product_elements:
+            print(f"Found {len(product_elements)} products with selector: {selector}")
+            break
+
+    if not product_elements:
+        return None
+
+    products = []
+    for element in product_elements[:max_products]:
+        try:
+            # Try multiple selectors for each element
+            name = None
+            brand = None
+            price = None
+            image_url = None
+            link = None
+
+            # Name selectors
+            for name_selector in ['.ProductCard__Name', '.ProductTile__Name', 'p[class*="ProductCard__Name"]', 'h4', '.Link--primary']:
+                name_elem = element.select_one(name_selector)
+                if name_elem:
+                    name = name_elem.text.strip()
+                    break
+
+            # Brand selectors
+            for brand_selector in ['.ProductCard__Brand', '.ProductTile__Brand', 'h5[class*="Brand"]', '.Link--brand']:
+                brand_elem = element.select_one(brand_selector)
+                if brand_elem:
+                    brand = brand_elem.text.strip()
+                    break
+
+            # Price selectors
+            for price_selector in ['.ProductCard__Price', '.ProductTile__Price', 'span[class*="Price"]', '.Text--emphasis']:
+                price_elem = element.select_one(price_selector)
+                if price_elem:
+                    price = price_elem.text.strip().replace('$', '')
+                    break
+
+            # Image selectors
+            for img_selector in ['img', '.Image__Container img']:
+                image_elem = element.select_one(img_selector)
+                if image_elem and (image_elem.get('src') or image_elem.get('data-src')):
+                    image_url = image_elem.get('src') or image_elem.get('data-src')
+                    break
+
+            # Link selectors
+            for link_selector in ['a', '.Link--primary']:
+                link_elem = element.select_one(link_selector)
+                if link_elem and link_elem.get('href'):
+                    href = link_elem.get('href')
+                    if href.startswith('http'):
+                        link = href
+                    else:
+                        link = f"https://www.ulta.com{href}"
+                    break
+
+            if name and price:
+                brand = brand or "Ulta Beauty Collection"
+                products.append(_make_product(name, brand, price, link, image_url, skin_type, skin_issues, gender))
+
+                # Limit to max_products
+                if len(products) >= max_products:
+                    break
+        except Exception as e:
+            print(f"Error processing Ulta product element: {e}")
+            continue
+
+    return products
+
+
+# Retailers known to the scrapers: upstream client name, headers, search term
+# maps (what the product crawler walks), URL builder and parser
+RETAILERS = {
+    "sephora": {
+        "client": "sephora",
+        "headers": SEPHORA_HEADERS,
+        "skin_type_map": SEPHORA_SKIN_TYPE_MAP,
+        "skin_issue_map": SEPHORA_SKIN_ISSUE_MAP,
+        "urls": sephora_urls,
+        "parse": parse_sephora_products,
+    },
+    "ulta": {
+        "client": "ulta",
+        "headers": ULTA_HEADERS,
+        "skin_type_map": ULTA_SKIN_TYPE_MAP,
+        "skin_issue_map": ULTA_SKIN_ISSUE_MAP,
+        "urls": ulta_urls,
+        "parse": parse_ulta_products,
+    },
+}
+
+
+SCRAPE_HOST_MIN_INTERVAL = float(os.getenv("SCRAPE_HOST_MIN_INTERVAL", "1.0"))
+SCRAPE_HOST_JITTER = float(os.getenv("SCRAPE_HOST_JITTER", "1.0"))
+
+
+class HostRateLimiter:
+    """
+    Spaces requests to the same host at least `min_interval` seconds apart,
+    plus a random jitter. `reserve` hands out the next free slot instead of
+    sleeping, so the caller decides whether to wait for it (off the request
+    thread) or give up.
+    """
+
+    def __init__(self, min_interval=SCRAPE_HOST_MIN_INTERVAL, jitter=SCRAPE_HOST_JITTER):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, url, not_after=None):
+        """
+        Reserve the next slot for the URL's host and return its monotonic time,
+        or None (reserving nothing) if that slot would be later than `not_after`.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            if not_after is not None and slot > not_after:
+                return None
+            self._next_slot[host] = slot + self.min_interval + random.uniform(0, self.jitter)
+            return slot
+
+
+# Shared by every scraper in this process
+host_rate_limiter = HostRateLimiter()
+
+
+def fetch_retailer_page(retailer, url, timeout=None, pace=True):
+    """
+    Fetch one retailer page and return its HTML, or None on a non-200 status.
+    With `pace`, first waits for a slot from the per-host rate limiter; callers
+    that reserved their own slot pass pace=False.
+    """
+    spec = RETAILERS[retailer]
+    if pace:
+        delay = host_rate_limiter.reserve(url) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    kwargs = {"headers": spec["headers"]}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    response = get_client(spec["client"]).get(url, **kwargs)
+    if response.status_code != 200:
+        print(f"Error scraping {retailer} with URL {url}: {response.status_code}")
+        return None
+    return response.text
+
+
+def scrape_retailer(retailer, skin_type, skin_issues, gender="All", age_group=None, max_products=5):
+    """Scrape a retailer's candidate URLs in order until one yields products."""
+    spec = RETAILERS[retailer]
+    try:
+        urls = spec["urls"](skin_type, skin_issues)
+        print(f"Scraping {retailer} with URLs: {urls}")
+
+        for url in urls:
+            try:
+                html = fetch_retailer_page(retailer, url)
+            except requests.exceptions.RequestException as e:
+                print(f"Request error when scraping {retailer} URL {url}: {e}")
+                continue
+            if html is None:
+                continue
+            products = spec["parse"](html, skin_type, skin_issues, gender, max_products)
+            if products is not None:
+                print(f"Successfully scraped {len(products)} products from {retailer}")
+                return products
+
+        print(f"Could not find product elements on any {retailer} page")
+        return []
+    except Exception as e:
+        print(f"Error scraping {retailer}: {e}")
+        return []
+
+
+def scrape_sephora(skin_type, skin_issues, gender="All", age_group=None, max_products=5):
+    """
+    Scrape product recommendations from Sephora based on skin type and issues
+    """
+    return scrape_retailer("sephora", skin_type, skin_issues, gender, age_group, max_products)
+
+
+def scrape_ulta(skin_type, skin_issues, gender="All", age_group=None, max_products=5):
+    """
+    Scrape product recommendations from Ulta based on skin type and issues
+    """
+    return scrape_retailer("ulta", skin_type, skin_issues, gender, age_group, max_products)
@@ -0,0 +1,152 @@
+import concurrent.futures
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import requests
+
+from http_client import get_client
+from retailer_scrapers import RETAILERS, fetch_retailer_page, host_rate_limiter
+
+
+SCRAPE_DEADLINE_SECONDS = float(os.getenv("SCRAPE_DEADLINE_SECONDS", "4.0"))
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "8"))
+# Don't start a fetch with less than this much time left before the deadline
+SCRAPE_MIN_FETCH_SECONDS = float(os.getenv("SCRAPE_MIN_FETCH_SECONDS", "0.5"))
+
+
+class ScrapeOrchestrator:
+    """
+    Fans out to every candidate URL of every retailer at once under a single
+    deadline. Requests to the same host are paced by the shared per-host rate
+    limiter; the waiting happens in worker threads, and a fetch whose slot
+    falls past the deadline is skipped. A retailer's result is the products
+    from its highest-priority URL that returned any. Whatever hasn't arrived
+    by the deadline is cancelled and left out.
+    """
+
+    def __init__(self, max_workers=SCRAPE_MAX_WORKERS, deadline=SCRAPE_DEADLINE_SECONDS,
+                 min_fetch_time=SCRAPE_MIN_FETCH_SECONDS, limiter=host_rate_limiter):
+        self.deadline = deadline
+        self.min_fetch_time = min_fetch_time
+        self.limiter = limiter
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scrape")
+
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=1000)
+        self._counters = {"scrapes": 0, "deadlineExceeded": 0, "fetches": 0, "skipped": 0,
+                          "cancelled": 0, "errors": 0}
+
+    def scrape(self, skin_type, skin_issues, gender="All", age_group=None, max_products=4,
+               retailers=None, deadline=None):
+        """Return {retailer: products} for the retailers that answered in time."""
+        started = time.monotonic()
+        deadline_at = started + (self.deadline if deadline is None else deadline)
+        cancelled = threading.Event()
+
+        # future -> (retailer, priority); lower priority index wins
+        pending = {}
+        candidates = {}
+        for retailer in retailers or list(RETAILERS):
+            urls = RETAILERS[retailer]["urls"](skin_type, skin_issues)
+            candidates[retailer] = len(urls)
+            for priority, url in enumerate(urls):
+                future = self.executor.submit(self._fetch, retailer, url, skin_type, skin_issues, gender,
+                                              max_products, deadline_at, cancelled)
+                pending[future] = (retailer, priority)
+
+        outcomes = {retailer: {} for retailer in candidates}  # retailer -> {priority: products or None}
+        results = {}
+        while pending and len(results) < len(candidates):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = concurrent.futures.wait(pending, timeout=remaining,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                retailer, priority = pending.pop(future)
+                outcomes[retailer][priority] = future.result()
+                products = self._settled(outcomes[retailer], candidates[retailer])
+                if products is not None and retailer not in results:
+                    results[retailer] = products
+
+        timed_out = len(results) < len(candidates)
+
+        # Partial results: take the best answer that did arrive
+        for retailer, by_priority in outcomes.items():
+            if retailer not in results:
+                arrived = [by_priority[p] for p in sorted(by_priority) if by_priority[p]]
+                if arrived:
+                    results[retailer] = arrived[0]
+
+        # Cancel stragglers: queued fetches never start, waiting ones give up
+        cancelled.set()
+        for future in pending:
+            if future.cancel():
+                self._count("cancelled")
+
+        duration = time.monotonic() - started
+        with self._lock:
+            self._counters["scrapes"] += 1
+            if timed_out:
+                self._counters["deadlineExceeded"] += 1
+            self._durations.append(duration)
+        print(f"Scraped {sum(len(p) for p in results.values())} products from {list(results)} in {duration:.2f}s")
+        return results
+
+    def _settled(self, by_priority, num_candidates):
+        """Products of the best URL once every higher-priority URL has failed, else None."""
+        for priority in range(num_candidates):
+            if priority not in by_priority:
+                return None
+            if by_priority[priority]:
+                return by_priority[priority]
+        return []
+
+    def _fetch(self, retailer, url, skin_type, skin_issues, gender, max_products, deadline_at, cancelled):
+        slot = self.limiter.reserve(url, not_after=deadline_at - self.min_fetch_time)
+        if slot is None:
+            self._count("skipped")
+            return None
+        if cancelled.wait(max(0.0, slot - time.monotonic())):
+            self._count("cancelled")
+            return None
+
+        # Cap the read timeout by the time left before the deadline
+        connect_timeout, read_timeout = get_client(RETAILERS[retailer]["client"]).timeout
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            self._count("skipped")
+            return None
+        timeout = (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+        self._count("fetches")
+        try:
+            html = fetch_retailer_page(retailer, url, timeout=timeout, pace=False)
+        except requests.exceptions.RequestException as e:
+            print(f"Request error when scraping {retailer} URL {url}: {e}")
+            self._count("errors")
+            return None
+        if html is None or cancelled.is_set():
+            return None
+        try:
+            return RETAILERS[retailer]["parse"](html, skin_type, skin_issues, gender, max_products)
+        except Exception as e:
+            print(f"Error parsing {retailer} page {url}: {e}")
+            self._count("errors")
+            return None
+
+    def metrics(self):
+        with self._lock:
+            durations = np.array(self._durations) * 1000.0
+            return {
+                **self._counters,
+                "durationMsP50": float(np.percentile(durations, 50)) if len(durations) else None,
+                "durationMsP95": float(np.percentile(durations, 95)) if len(durations) else None,
+            }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
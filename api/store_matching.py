@@ -0,0 +1,181 @@
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+
+from places_cache import EARTH_RADIUS_M
+
+
+# Brands stocked by luxury stores regardless of price
+LUXURY_BRANDS = frozenset(["the ordinary", "kiehl's", "drunk elephant", "la roche-posay"])
+STORES_PER_PRODUCT = 3
+
+
+class BrandAutomaton:
+    """Aho-Corasick automaton: finds every brand occurring in a store name in one scan."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = next_state
+            self._out[state] += (index,)
+
+        # Breadth-first failure links; outputs inherit their fallback's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    def find(self, text):
+        """Indexes of the patterns occurring in `text`."""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._out[state]:
+                found.update(self._out[state])
+        return found
+
+
+@lru_cache(maxsize=256)
+def brand_automaton(brands):
+    """Automaton for a tuple of brands; product lists repeat, so these are reused across requests."""
+    return BrandAutomaton(brands)
+
+
+def store_distances(stores, lat, lng):
+    """Haversine distance in metres from (lat, lng) to every store, vectorized."""
+    locations = np.array([[s.get("location", {}).get("lat", np.nan), s.get("location", {}).get("lng", np.nan)]
+                          for s in stores], dtype=np.float64).reshape(-1, 2)
+    phi1, phi2 = np.radians(lat), np.radians(locations[:, 0])
+    dphi = phi2 - phi1
+    dlmb = np.radians(locations[:, 1] - lng)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    return np.where(np.isnan(distances), np.inf, distances)
+
+
+def rank_stores(stores, origin=None, rank_by=None):
+    """Stores in upstream order, or nearest first ("distance") or best rated first ("rating")."""
+    if rank_by == "distance" and origin is not None and stores:
+        order = np.argsort(store_distances(stores, float(origin[0]), float(origin[1])), kind="stable")
+    elif rank_by == "rating" and stores:
+        ratings = np.array([s.get("rating") or 0.0 for s in stores], dtype=np.float64)
+        order = np.argsort(-ratings, kind="stable")
+    else:
+        return list(stores)
+    return [stores[i] for i in order]
+
+
+class StoreMatcher:
+    """
+    Assigns nearby stores to recommended products.
+
+    Built once per request: store names are lower-cased once, stores are
+    bucketed by type, and each store's response entry (with its map URL) is
+    built once and shared by every product it is assigned to. `match` then finds every product brand in every store
+    name with one Aho-Corasick scan and assigns stores to all products in a
+    single pass.
+    """
+
+    def __init__(self, stores, api_key=None, origin=None, rank_by=None):
+        self.stores = rank_stores(stores, origin, rank_by)
+        self._names = [(store.get("name") or "").lower() for store in self.stores]
+        self._buckets = {}
+        for i, store in enumerate(self.stores):
+            self._buckets.setdefault(store.get("type"), []).append(i)
+        self.api_key = api_key
+        # Response entries are built the first time a store is assigned, then shared
+        self._entries = [None] * len(self.stores)
+
+    def _entry(self, i):
+        entry = self._entries[i]
+        if entry is None:
+            store = self.stores[i]
+            entry = self._entries[i] = {
+                "name": store.get("name"),
+                "address": store.get("address"),
+                "location": store.get("location"),
+                "rating": store.get("rating"),
+                "place_id": store.get("place_id"),
+                "open_now": store.get("open_now"),
+                "map_url": f"https://www.google.com/maps/place/?q=place_id:{store.get('place_id')}"
+            }
+        return entry
+
+    def brand_stores(self, brands):
+        """{brand: indexes of stores whose name contains it}, in store order."""
+        brands = list(brands)
+        matches = {brand: [] for brand in brands}
+        # An empty brand is a substring of every name
+        if "" in matches:
+            matches[""] = list(range(len(self.stores)))
+        automaton = brand_automaton(tuple(sorted(brand for brand in brands if brand)))
+        for i, name in enumerate(self._names):
+            for pattern in automaton.find(name):
+                matches[automaton.patterns[pattern]].append(i)
+        return matches
+
+    def match(self, products):
+        """Nearby-product entries: each product (with priceCategory set) plus up to 3 stores."""
+        brand_matches = self.brand_stores({product.get("brand", "").lower() for product in products})
+        luxury = self._buckets.get("luxury", [])
+        drugstore = self._buckets.get("drugstore", [])
+        fallback = list(range(min(STORES_PER_PRODUCT, len(self.stores))))
+
+        entries = []
+        for product in products:
+            brand = product.get("brand", "").lower()
+            try:
+                price_value = float(product.get("price", "0"))
+            except (TypeError, ValueError):
+                price_value = 0
+
+            # Determine price category
+            if price_value < 10:
+                product["priceCategory"] = "Budget"
+            elif price_value < 25:
+                product["priceCategory"] = "Moderate"
+            else:
+                product["priceCategory"] = "Premium"
+
+            # Luxury brands typically at luxury stores, budget products at drugstores,
+            # then stores carrying the brand's name
+            if price_value > 30 or brand in LUXURY_BRANDS:
+                base = luxury
+            elif price_value < 15:
+                base = drugstore
+            else:
+                base = ()
+            matched = (list(base[:STORES_PER_PRODUCT]) + brand_matches[brand][:STORES_PER_PRODUCT])[:STORES_PER_PRODUCT]
+
+            # If no specific matches, include some general stores
+            if not matched:
+                matched = fallback
+
+            entry = {**product, "nearbyStores": [self._entry(i) for i in matched]}
+            photo_reference = self.stores[matched[0]].get("photo_reference") if matched else None
+            if photo_reference:
+                entry["storePhotoUrl"] = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photoreference={photo_reference}&key={self.api_key}"
+            entries.append(entry)
+        return entries
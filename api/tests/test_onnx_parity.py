@@ -0,0 +1,206 @@
+"""
+Keras/torch vs ONNX parity, the same check as `export_onnx.py --verify`.
+
+Run from the api/ directory:
+    python -m pytest tests/
+
+The comparison and its tolerances are tested on synthetic outputs and on a
+tiny ONNX graph, so they run without the real models. The export tests
+build tiny Keras/torch models and are skipped when TensorFlow/tf2onnx or
+torch is missing; the real-model tests are skipped when the original or
+exported model is missing. ONNX_PARITY_FACE_DIR points the real-model check
+at face crops; random crops are used otherwise.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+import export_onnx  # noqa: E402
+from model_backends import (  # noqa: E402
+    FAIRFACE_MODEL_PATH, FAIRFACE_ONNX_MODEL_PATH, SKIN_INPUT_SIZE, SKIN_ONNX_MODEL_PATH,
+    OnnxSkinModel, find_skin_model_path, skin_preprocess,
+)
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+FACE_LIMIT = 16
+
+# Skin model outputs with every probability well away from the 0.5 issue threshold
+SKIN_TYPE = np.array([[0.7, 0.2, 0.1], [0.1, 0.3, 0.6]], dtype=np.float32)
+SKIN_PROB = np.array([[0.9, 0.2, 0.1], [0.3, 0.8, 0.6]], dtype=np.float32)
+# FairFace (race, gender, age) logits with a clear top class per row
+FAIRFACE_LOGITS = [
+    np.array([[3.0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 2.0, 0]], dtype=np.float32),
+    np.array([[1.5, 0], [0, 1.5]], dtype=np.float32),
+    np.array([[0, 0, 0, 2.5, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 2.5, 0, 0]], dtype=np.float32),
+]
+
+
+@pytest.fixture(autouse=True)
+def api_dir(monkeypatch):
+    # Model paths are relative to api/, as for export_onnx.py
+    monkeypatch.chdir(API_DIR)
+
+
+def require_files(*paths):
+    for path in paths:
+        if not os.path.exists(path):
+            pytest.skip(f"model not found: {path}")
+
+
+def parity_faces():
+    return export_onnx.load_faces(os.getenv("ONNX_PARITY_FACE_DIR", ""), FACE_LIMIT)
+
+
+def test_skin_parity_accepts_drift_within_tolerance():
+    drift = export_onnx.RAW_TOLERANCE / 2
+    ok, max_diff, mismatches = export_onnx.skin_parity((SKIN_TYPE, SKIN_PROB), (SKIN_TYPE + drift, SKIN_PROB - drift))
+    assert ok
+    assert max_diff == pytest.approx(drift, rel=1e-2)
+    assert mismatches == []
+
+
+def test_skin_parity_rejects_drift_above_tolerance():
+    drift = export_onnx.RAW_TOLERANCE * 10
+    ok, max_diff, _ = export_onnx.skin_parity((SKIN_TYPE, SKIN_PROB), (SKIN_TYPE, SKIN_PROB + drift))
+    assert not ok
+    assert max_diff > export_onnx.RAW_TOLERANCE
+
+
+def test_skin_parity_reports_changed_results():
+    prob = SKIN_PROB.copy()
+    prob[1, 0] = 0.7  # "Acne" crosses the issue threshold on the second face
+    ok, _, mismatches = export_onnx.skin_parity((SKIN_TYPE, SKIN_PROB), (SKIN_TYPE, prob))
+    assert not ok
+    assert [i for i, _, _ in mismatches] == [1]
+    assert [issue["name"] for issue in mismatches[0][2]["skinIssues"]] == ["Acne", "Redness", "Bags"]
+
+
+def test_fairface_parity_only_requires_the_same_classes():
+    shifted = [logits + 0.01 * np.arange(logits.shape[1], dtype=np.float32) for logits in FAIRFACE_LOGITS]
+    ok, max_diff, mismatches = export_onnx.fairface_parity(FAIRFACE_LOGITS, shifted)
+    assert ok and mismatches == []
+    assert max_diff > 0
+
+    age = FAIRFACE_LOGITS[2].copy()
+    age[0, 4] = 5.0  # 20-29 -> 30-39 on the first face
+    ok, _, mismatches = export_onnx.fairface_parity(FAIRFACE_LOGITS, FAIRFACE_LOGITS[:2] + [age])
+    assert not ok
+    assert [(i, expected["age"], actual["age"]) for i, expected, actual in mismatches] == [(0, "20-29", "30-39")]
+
+
+def tiny_skin_graph(path, type_weights, prob_weights):
+    """Skin-model-shaped ONNX graph: mean RGB -> (softmax skin type, sigmoid issue probabilities)."""
+    from onnx import TensorProto, helper, numpy_helper, save
+
+    nodes = [
+        helper.make_node("ReduceMean", ["input"], ["pooled"], axes=[1, 2], keepdims=0),
+        helper.make_node("MatMul", ["pooled", "type_weights"], ["type_logits"]),
+        helper.make_node("Softmax", ["type_logits"], ["type"], axis=1),
+        helper.make_node("MatMul", ["pooled", "prob_weights"], ["prob_logits"]),
+        helper.make_node("Sigmoid", ["prob_logits"], ["prob"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "tiny_skin",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3])],
+        [helper.make_tensor_value_info("type", TensorProto.FLOAT, [None, 3]),
+         helper.make_tensor_value_info("prob", TensorProto.FLOAT, [None, 3])],
+        [numpy_helper.from_array(type_weights, "type_weights"), numpy_helper.from_array(prob_weights, "prob_weights")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", export_onnx.ONNX_OPSET)])
+    model.ir_version = 8
+    save(model, path)
+
+
+def test_onnx_skin_model_parity_with_reference(tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    rng = np.random.default_rng(0)
+    type_weights = rng.normal(size=(3, 3)).astype(np.float32)
+    prob_weights = rng.normal(size=(3, 3)).astype(np.float32)
+    path = str(tmp_path / "tiny_skin.onnx")
+    tiny_skin_graph(path, type_weights, prob_weights)
+
+    batch = np.stack([skin_preprocess(face) for face in export_onnx.load_faces("", 8)])
+    pooled = batch.mean(axis=(1, 2))
+    type_logits = pooled @ type_weights
+    reference_type = np.exp(type_logits) / np.exp(type_logits).sum(axis=1, keepdims=True)
+    reference_prob = 1.0 / (1.0 + np.exp(-(pooled @ prob_weights)))
+    onnx_outputs = OnnxSkinModel(path).predict(batch)
+
+    ok, max_diff, mismatches = export_onnx.skin_parity((reference_type, reference_prob), onnx_outputs)
+    assert ok, (max_diff, mismatches)
+
+    # Weights that drifted by more than the tolerance are caught
+    tiny_skin_graph(path, type_weights, prob_weights + 0.01)
+    ok, max_diff, _ = export_onnx.skin_parity((reference_type, reference_prob), OnnxSkinModel(path).predict(batch))
+    assert not ok and max_diff > export_onnx.RAW_TOLERANCE
+
+
+if torch is not None:
+    class TinyFairFace(torch.nn.Module):
+        """FairFace-shaped stand-in: (race, gender, age) logits from the mean of each channel."""
+
+        def __init__(self):
+            super().__init__()
+            self.heads = torch.nn.ModuleList(torch.nn.Linear(3, n) for n in (7, 2, 9))
+
+        def forward(self, x):
+            pooled = x.mean(dim=(2, 3))
+            return tuple(head(pooled) for head in self.heads)
+
+
+def test_export_skin_model_parity(tmp_path):
+    tf = pytest.importorskip("tensorflow")
+    pytest.importorskip("tf2onnx")
+    pytest.importorskip("onnxruntime")
+    inputs = tf.keras.Input((SKIN_INPUT_SIZE, SKIN_INPUT_SIZE, 3))
+    pooled = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+    outputs = [tf.keras.layers.Dense(3, activation="softmax")(pooled),
+               tf.keras.layers.Dense(3, activation="sigmoid")(pooled)]
+    h5_path = str(tmp_path / "tiny_skin.h5")
+    onnx_path = str(tmp_path / "tiny_skin.onnx")
+    tf.keras.Model(inputs, outputs).save(h5_path)
+
+    export_onnx.export_skin_model(h5_path, onnx_path)
+    assert export_onnx.verify_skin_model(h5_path, onnx_path, export_onnx.load_faces("", FACE_LIMIT))
+
+
+def test_export_fairface_model_parity(tmp_path):
+    if torch is None:
+        pytest.skip("torch is not installed")
+    pytest.importorskip("onnxruntime")
+    torch.manual_seed(0)
+    pt_path = str(tmp_path / "tiny_fairface.pt")
+    onnx_path = str(tmp_path / "tiny_fairface.onnx")
+    torch.save(TinyFairFace(), pt_path)
+
+    export_onnx.export_fairface_model(pt_path, onnx_path)
+    assert export_onnx.verify_fairface_model(pt_path, onnx_path, export_onnx.load_faces("", FACE_LIMIT))
+
+
+def test_skin_model_parity():
+    h5_path = find_skin_model_path()
+    if h5_path is None:
+        pytest.skip("skin model (.h5) not found")
+    require_files(h5_path, SKIN_ONNX_MODEL_PATH)
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("onnxruntime")
+
+    assert export_onnx.verify_skin_model(h5_path, SKIN_ONNX_MODEL_PATH, parity_faces())
+
+
+def test_fairface_model_parity():
+    require_files(FAIRFACE_MODEL_PATH, FAIRFACE_ONNX_MODEL_PATH)
+    pytest.importorskip("torch")
+    pytest.importorskip("onnxruntime")
+
+    assert export_onnx.verify_fairface_model(FAIRFACE_MODEL_PATH, FAIRFACE_ONNX_MODEL_PATH, parity_faces())
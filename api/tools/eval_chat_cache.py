@@ -0,0 +1,134 @@
+"""
+Offline evaluation of the /chat semantic cache against a recorded query log.
+
+The log is JSONL, one /chat request per line:
+    {"message": "...", "skinAnalysis": {...}, "conversation": [...], "intent": "morning-routine"}
+`skinAnalysis`, `conversation` and `intent` are optional. Queries are
+replayed in order through SemanticChatCache at each threshold: a miss stores
+the query as if the upstream had answered it. Reports hit rate (upstream calls
+saved) and, when queries carry an `intent` label, how many hits returned an
+answer recorded for the same intent. The synthetic log mixes in near-miss
+intents that differ from another intent by one key word (time of day, skin
+type, negation), which a cache that matches on similarity alone confuses.
+
+Usage (from the api/ directory):
+    python tools/eval_chat_cache.py chat_log.jsonl --thresholds 0.75,0.8,0.85,0.9
+    python tools/eval_chat_cache.py --sample 2000      # synthetic log of paraphrases and near misses
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_cache import SemanticChatCache  # noqa: E402
+
+SAMPLE_INTENTS = {
+    "morning-routine": ["Can you suggest a morning routine?", "can you suggest a morning routine",
+                        "Could you suggest a morning routine for me?", "What morning routine do you suggest?",
+                        "suggest a morning skincare routine please"],
+    "evening-routine": ["What about evening skincare steps?", "what about evening skin care steps",
+                        "What evening skincare steps should I follow?", "evening skincare steps?"],
+    "ingredients": ["What ingredients work best for {type} skin?", "which ingredients work best for {type} skin",
+                    "What ingredients are best for {type} skin?", "best ingredients for {type} skin?"],
+    "recommend": ["Can you recommend products for me?", "can you recommend some products for me?",
+                  "Could you recommend products for me please", "recommend products for me"],
+    "texture": ["How can I improve my skin texture?", "how do I improve my skin texture",
+                "How can I improve the texture of my skin?"],
+    "causes": ["What causes my skin issues?", "what is causing my skin issues?", "What causes these skin issues?"],
+    # Near misses: one key word away from each other or from the intents above
+    "oily-morning-routine": ["Can you suggest a morning routine for oily skin?",
+                             "can you suggest a morning routine for oily skin"],
+    "oily-evening-routine": ["Can you suggest an evening routine for oily skin?",
+                             "can you suggest an evening routine for oily skin"],
+    "dry-morning-routine": ["Can you suggest a morning routine for dry skin?",
+                            "can you suggest a morning routine for dry skin"],
+    "not-morning-routine": ["Can you not suggest a morning routine for oily skin?",
+                            "can you not suggest a morning routine for oily skin"],
+    "avoid-ingredients": ["What ingredients should I avoid for {type} skin?",
+                          "which ingredients should i avoid for {type} skin"],
+    "texture-without": ["How can I improve my skin texture without exfoliating?",
+                        "how can i improve my skin texture without exfoliating"],
+}
+SAMPLE_TYPES = ["Oily", "Dry", "Combination", "Normal", "Sensitive"]
+SAMPLE_ISSUES = [[], ["Acne"], ["Wrinkles"], ["Dark Spots", "Redness"]]
+
+
+def sample_log(count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        intent = rng.choice(list(SAMPLE_INTENTS))
+        skin_type = rng.choice(SAMPLE_TYPES)
+        analysis = {
+            "skinType": {"type": skin_type, "confidence": 0.9},
+            "skinIssues": [{"name": issue, "confidence": 0.8} for issue in rng.choice(SAMPLE_ISSUES)],
+            "demographics": {"gender": rng.choice(["Male", "Female"]), "age": rng.choice(["20-29", "30-39"])},
+        }
+        message = rng.choice(SAMPLE_INTENTS[intent]).format(type=skin_type.lower())
+        queries.append({"message": message, "skinAnalysis": analysis, "intent": intent})
+    return queries
+
+
+def evaluate(queries, threshold):
+    cache = SemanticChatCache(threshold=threshold, enabled=True, ttl=10 ** 9)
+    answer_intents = {}
+    hits = correct = labelled_hits = bypassed = 0
+    lookup_time = 0.0
+    for i, query in enumerate(queries):
+        if not cache.cacheable(query):
+            bypassed += 1
+            continue
+        started = time.perf_counter()
+        answer, _ = cache.lookup(query.get("skinAnalysis"), query["message"])
+        lookup_time += time.perf_counter() - started
+        if answer is None:
+            answer = f"answer-{i}"
+            answer_intents[answer] = query.get("intent")
+            cache.store(query.get("skinAnalysis"), query["message"], answer)
+            continue
+        hits += 1
+        if query.get("intent") is not None:
+            labelled_hits += 1
+            correct += answer_intents.get(answer) == query["intent"]
+
+    lookups = len(queries) - bypassed
+    return {
+        "threshold": threshold,
+        "queries": len(queries),
+        "bypassed": bypassed,
+        "hitRate": hits / lookups if lookups else 0.0,
+        "upstreamCallsSaved": hits,
+        "hitPrecision": correct / labelled_hits if labelled_hits else None,
+        "lookupUs": lookup_time / lookups * 1e6 if lookups else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", nargs="?", help="JSONL query log")
+    parser.add_argument("--sample", type=int, default=0, help="evaluate on a synthetic log of this many queries")
+    parser.add_argument("--thresholds", default="0.75,0.8,0.85,0.9,0.95")
+    args = parser.parse_args()
+
+    if args.log:
+        with open(args.log, encoding="utf-8") as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    elif args.sample:
+        queries = sample_log(args.sample)
+    else:
+        parser.error("pass a query log or --sample N")
+
+    print(f"{'threshold':>9} {'hit rate':>9} {'saved':>7} {'precision':>10} {'lookup us':>10}")
+    for threshold in [float(t) for t in args.thresholds.split(",")]:
+        result = evaluate(queries, threshold)
+        precision = f"{result['hitPrecision']:.3f}" if result["hitPrecision"] is not None else "-"
+        print(f"{threshold:>9.2f} {result['hitRate']:>9.3f} {result['upstreamCallsSaved']:>7} "
+              f"{precision:>10} {result['lookupUs']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
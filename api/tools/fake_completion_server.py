@@ -0,0 +1,87 @@
+"""
+Local stand-in for the chat-completions API, for exercising /chat and
+/chat/stream without calling Groq.
+
+Usage (from the api/ directory):
+    python tools/fake_completion_server.py --port 8099 --tokens 50 --delay-ms 20
+    GROQ_API_KEY=test GROQ_CHAT_URL=http://127.0.0.1:8099/v1/chat/completions python server.py
+
+Streaming requests ("stream": true) get one SSE chunk per token, `--delay-ms`
+apart; other requests get a single JSON completion. The server logs when a
+client disconnects mid-stream, which is how cancellation shows up upstream.
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(tokens, delay):
+    words = [f"token{i} " for i in range(tokens)]
+
+    class FakeCompletionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            # Rough stand-in for the upstream tokenizer's count
+            prompt_tokens = sum(len(m.get("content", "")) // 4 + 4 for m in body.get("messages", []))
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                     "total_tokens": prompt_tokens + tokens}
+
+            if not body.get("stream"):
+                payload = json.dumps({
+                    "choices": [{"message": {"role": "assistant", "content": "".join(words)}}],
+                    "usage": usage,
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for i, word in enumerate(words):
+                    time.sleep(delay)
+                    chunk = {"choices": [{"index": 0, "delta": {"content": word}}]}
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                # Groq reports usage on the final chunk
+                final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+                self._write_chunk(f"data: {json.dumps(final)}\n\n")
+                self._write_chunk("data: [DONE]\n\n")
+                self._write_chunk("")
+            except (BrokenPipeError, ConnectionResetError):
+                print(f"Client disconnected after {i} of {tokens} tokens")
+
+        def _write_chunk(self, text):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeCompletionHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--delay-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.tokens, args.delay_ms / 1000.0))
+    print(f"Fake completion server on http://{args.host}:{args.port}/v1/chat/completions")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Local stand-in for the SMTP server, for exercising /send-email and the
+email worker without sending mail.
+
+Usage (from the api/ directory):
+    python tools/fake_smtp_server.py --port 8025 --fail-rate 0.2
+    EMAIL_SMTP_HOST=127.0.0.1 EMAIL_SMTP_PORT=8025 EMAIL_SMTP_STARTTLS=false python server.py
+
+Accepts any AUTH LOGIN/PLAIN credentials over plain TCP. Each message is
+logged (or written to `--maildir`); `--fail-rate` answers that share of
+messages with a temporary 451 so retries can be observed, and the log shows
+how many connections and logins the worker needed.
+"""
+import argparse
+import asyncio
+import mailbox
+import random
+import time
+from email import message_from_bytes
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+
+class FakeSmtpHandler:
+    def __init__(self, fail_rate, delay, maildir=None):
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.maildir = mailbox.Maildir(maildir) if maildir else None
+        self.counters = {"connections": 0, "logins": 0, "messages": 0, "rejected": 0}
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.counters["connections"] += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self.counters["rejected"] += 1
+            return "451 Temporary failure, try again later"
+        self.counters["messages"] += 1
+        message = message_from_bytes(envelope.content)
+        if self.maildir is not None:
+            self.maildir.add(message)
+        print(f"Message {self.counters['messages']} to {', '.join(envelope.rcpt_tos)}: "
+              f"{message['Subject']!r} ({len(envelope.content)} bytes, "
+              f"{'/'.join(part.get_content_type() for part in message.walk() if not part.is_multipart())}) "
+              f"{self.counters}")
+        return "250 Message accepted for delivery"
+
+
+def authenticator(handler):
+    def authenticate(server, session, envelope, mechanism, auth_data):
+        handler.counters["logins"] += 1
+        return AuthResult(success=True)
+    return authenticate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of messages answered with 451")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="time to accept each message")
+    parser.add_argument("--maildir", default=None, help="store accepted messages in this Maildir")
+    args = parser.parse_args()
+
+    handler = FakeSmtpHandler(args.fail_rate, args.delay_ms / 1000.0, args.maildir)
+    controller = Controller(handler, hostname=args.host, port=args.port, authenticator=authenticator(handler),
+                            auth_require_tls=False)
+    controller.start()
+    print(f"Fake SMTP server on {args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()